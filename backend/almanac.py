@@ -0,0 +1,270 @@
+"""
+黄道吉日本地历法引擎
+
+根据公历日期推算农历、年/月/日干支与建除十二神（值日），并据此给出当日吉/平/凶、宜/忌、
+各项运势星级与幸运信息。节气时刻按太阳视黄经低精度公式计算（误差约十几分钟），
+月建以「节」为界。整年的结果在首次使用时一次性预先编译，运行时只需查表，无需调用 LLM。
+"""
+
+import math
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Union
+
+from lunardate import LunarDate
+
+# lunardate 农历表覆盖的公历年份（整年编译）
+MIN_YEAR = 1900
+MAX_YEAR = 2100
+
+STEMS = "甲乙丙丁戊己庚辛壬癸"
+BRANCHES = "子丑寅卯辰巳午未申酉戌亥"
+
+# 天干五行
+STEM_ELEMENTS = "木木火火土土金金水水"
+
+# 建除十二神（顺序即值日循环顺序）
+OFFICERS = "建除满平定执破危成收开闭"
+
+# 值日吉凶：除定执危成开为吉，建满平收为平，破闭为凶
+OFFICER_TRENDS = {
+    "建": "平", "除": "吉", "满": "平", "平": "平", "定": "吉", "执": "吉",
+    "破": "凶", "危": "吉", "成": "吉", "收": "平", "开": "吉", "闭": "凶",
+}
+
+# 值日宜忌
+OFFICER_ACTIVITIES = {
+    "建": (["出行", "上任", "会友", "祈福"], ["动土", "开仓", "嫁娶"]),
+    "除": (["祭祀", "沐浴", "扫舍", "求医"], ["嫁娶", "远行", "签约"]),
+    "满": (["祈福", "开市", "纳财", "交易"], ["动土", "栽种", "服药"]),
+    "平": (["修饰", "祭祀", "会友", "整理"], ["开市", "嫁娶", "远行"]),
+    "定": (["签约", "嫁娶", "纳财", "拜访"], ["诉讼", "出行", "求医"]),
+    "执": (["祭祀", "修造", "纳采", "捕捉"], ["开市", "移徙", "远行"]),
+    "破": (["求医", "拆卸", "破屋"], ["嫁娶", "开市", "签约", "出行"]),
+    "危": (["祭祀", "祈福", "安床"], ["登高", "行船", "远行"]),
+    "成": (["开市", "嫁娶", "入学", "签约", "出行"], ["诉讼", "争执"]),
+    "收": (["纳财", "收账", "捕捉"], ["出行", "安葬", "放债"]),
+    "开": (["开市", "入学", "出行", "求职", "祈福"], ["安葬", "动土"]),
+    "闭": (["修补", "收藏", "安葬"], ["出行", "开市", "求医"]),
+}
+
+# 各项运势的基础星级（按吉/平/凶）与值日加成
+TREND_STARS = {"吉": 4, "平": 3, "凶": 2}
+ASPECTS = ("财运", "事业", "感情", "健康")
+ASPECT_BONUS = {
+    "财运": "满收开成",
+    "事业": "建定成开",
+    "感情": "定成除满",
+    "健康": "除平危开",
+}
+
+# 各项运势与今日建议的本地说明（按吉/平/凶），离线或 LLM 不可用时使用
+LOCAL_PARAGRAPHS = {
+    "财运": {
+        "吉": "财星得位，正财稳进，偏财亦有可期，宜把握合作机会。",
+        "平": "财运平稳，收支大致相抵，宜量入为出、稳健理财。",
+        "凶": "财气受阻，宜守不宜攻，避免冲动消费与高风险投资。",
+    },
+    "事业": {
+        "吉": "事业顺遂，贵人相助，适合推进重要计划。",
+        "平": "工作按部就班，宜处理积压事务，稳中求进。",
+        "凶": "事务多阻，宜谨慎决策，避免与人正面冲突。",
+    },
+    "感情": {
+        "吉": "感情和睦，沟通顺畅，单身者易遇良缘。",
+        "平": "感情平淡，多些耐心与陪伴，细水长流。",
+        "凶": "情绪易起波澜，宜多体谅少争执。",
+    },
+    "健康": {
+        "吉": "精力充沛，身心舒畅，适合适度运动。",
+        "平": "身体状况平稳，注意作息规律与饮食均衡。",
+        "凶": "易感疲惫，宜早睡静养，勿过度劳累。",
+    },
+    "今日建议": {
+        "吉": "今日气数上扬，宜积极行事，广结善缘，诚心祈福，福运自来。",
+        "平": "今日宜以静制动，守正持中，循序渐进，自有时来运转之机。",
+        "凶": "今日宜收敛锋芒，多行善事，静待时机，逢凶化吉。",
+    },
+}
+
+# 日干五行对应的幸运颜色、方位与数字（河图数）
+ELEMENT_LUCK = {
+    "木": ("青色", "东方", (3, 8)),
+    "火": ("红色", "南方", (2, 7)),
+    "土": ("黄色", "中央", (5, 10)),
+    "金": ("金色", "西方", (4, 9)),
+    "水": ("黑色", "北方", (1, 6)),
+}
+
+# 地支六合：与日支相合的时辰为吉时
+SIX_HARMONY = {0: 1, 1: 0, 2: 11, 11: 2, 3: 10, 10: 3, 4: 9, 9: 4, 5: 8, 8: 5, 6: 7, 7: 6}
+
+LUNAR_MONTHS = ["正", "二", "三", "四", "五", "六", "七", "八", "九", "十", "冬", "腊"]
+LUNAR_DAYS = [
+    "初一", "初二", "初三", "初四", "初五", "初六", "初七", "初八", "初九", "初十",
+    "十一", "十二", "十三", "十四", "十五", "十六", "十七", "十八", "十九", "二十",
+    "廿一", "廿二", "廿三", "廿四", "廿五", "廿六", "廿七", "廿八", "廿九", "三十",
+]
+
+# 十二「节」的太阳视黄经与其起始的月支：小寒起丑月，立春起寅月……大雪起子月
+JIE_TERMS = [
+    ("小寒", 285, 1), ("立春", 315, 2), ("惊蛰", 345, 3), ("清明", 15, 4),
+    ("立夏", 45, 5), ("芒种", 75, 6), ("小暑", 105, 7), ("立秋", 135, 8),
+    ("白露", 165, 9), ("寒露", 195, 10), ("立冬", 225, 11), ("大雪", 255, 0),
+]
+
+# 儒略日与 date.toordinal() 的换算：JD(某日 0 时 UT) = ordinal + 1721424.5
+_JD_ORDINAL_OFFSET = 1721424.5
+# 节气日期按北京时间（UTC+8）确定
+_BEIJING_OFFSET = 8 / 24
+
+
+def ganzhi(index: int) -> str:
+    """六十甲子序号（0 = 甲子）转干支"""
+    return STEMS[index % 10] + BRANCHES[index % 12]
+
+
+def day_ganzhi_index(day: date) -> int:
+    """日柱六十甲子序号：2000-01-01 为戊午日（序号 54）"""
+    return (day.toordinal() - date(2000, 1, 1).toordinal() + 54) % 60
+
+
+def _sun_longitude(jd: float) -> float:
+    """太阳视黄经（度），低精度公式"""
+    t = (jd - 2451545.0) / 36525
+    mean_longitude = 280.46646 + 36000.76983 * t + 0.0003032 * t * t
+    mean_anomaly = math.radians(357.52911 + 35999.05029 * t - 0.0001537 * t * t)
+    center = ((1.914602 - 0.004817 * t - 0.000014 * t * t) * math.sin(mean_anomaly)
+              + (0.019993 - 0.000101 * t) * math.sin(2 * mean_anomaly)
+              + 0.000289 * math.sin(3 * mean_anomaly))
+    omega = math.radians(125.04 - 1934.136 * t)
+    return (mean_longitude + center - 0.00569 - 0.00478 * math.sin(omega)) % 360
+
+
+def solar_term_date(year: int, longitude: float) -> date:
+    """某年太阳视黄经到达 longitude 的北京时间日期"""
+    # 春分（0°）约在 3 月 20 日，按平均速度估算初值后迭代修正
+    estimate = date(year, 3, 20).toordinal() + ((longitude % 360) / 360) * 365.2422
+    if longitude >= 270:
+        estimate -= 365.2422
+    jd = estimate + _JD_ORDINAL_OFFSET
+    for _ in range(6):
+        diff = (longitude - _sun_longitude(jd) + 180) % 360 - 180
+        jd += diff / 360 * 365.2422
+    return date.fromordinal(int(math.floor(jd + _BEIJING_OFFSET - _JD_ORDINAL_OFFSET)))
+
+
+@lru_cache(maxsize=8)
+def jie_dates(year: int) -> List[tuple]:
+    """某公历年内十二「节」的 (日期, 名称, 月支序号)，按日期排序"""
+    return sorted((solar_term_date(year, lon), name, branch) for name, lon, branch in JIE_TERMS)
+
+
+def month_branch_index(day: date) -> int:
+    """月建地支序号（以节为界，节当日即入新月）"""
+    branch = 0  # 上一年大雪之后为子月
+    for jie_day, _, jie_branch in jie_dates(day.year):
+        if day >= jie_day:
+            branch = jie_branch
+        else:
+            break
+    return branch
+
+
+def lunar_text(lunar: LunarDate) -> str:
+    month = ("闰" if lunar.isLeapMonth else "") + LUNAR_MONTHS[lunar.month - 1] + "月"
+    return month + LUNAR_DAYS[lunar.day - 1]
+
+
+def _compile_day(day: date, year_start_jie: date) -> Dict:
+    """推算单日的历法信息（整年预编译时调用）"""
+    lunar = LunarDate.fromSolarDate(day.year, day.month, day.day)
+    # 年柱与月柱以立春为界
+    pillar_year = day.year if day >= year_start_jie else day.year - 1
+    year_index = (pillar_year - 4) % 60
+    month_branch = month_branch_index(day)
+    # 五虎遁：甲己之年丙作首……寅月天干 = (年干 × 2 + 2) % 10
+    month_stem = (year_index % 10 * 2 + 2 + (month_branch - 2) % 12) % 10
+    day_index = day_ganzhi_index(day)
+    day_branch = day_index % 12
+    officer = OFFICERS[(day_branch - month_branch) % 12]
+    trend = OFFICER_TRENDS[officer]
+    suitable, avoid = OFFICER_ACTIVITIES[officer]
+    base = TREND_STARS[trend]
+    stars = {aspect: max(1, min(5, base + (1 if officer in ASPECT_BONUS[aspect] else 0))) for aspect in ASPECTS}
+    element = STEM_ELEMENTS[day_index % 10]
+    color, direction, numbers = ELEMENT_LUCK[element]
+    hour_branch = SIX_HARMONY[day_branch]
+    hour_start = (hour_branch * 2 - 1) % 24
+    return {
+        "date": day.isoformat(),
+        "lunar_date": f"{lunar.month}月{lunar.day}日",
+        "lunar_text": lunar_text(lunar),
+        "year_ganzhi": ganzhi(year_index),
+        "month_ganzhi": STEMS[month_stem] + BRANCHES[month_branch],
+        "day_ganzhi": ganzhi(day_index),
+        "officer": officer,
+        "trend": trend,
+        "suitable": list(suitable),
+        "avoid": list(avoid),
+        "stars": stars,
+        "lucky_color": color,
+        "lucky_direction": direction,
+        "lucky_numbers": [numbers[0], numbers[1], (day.day % 9 + 1) * 10 + numbers[0]],
+        "lucky_hour": f"{hour_start:02d}:00-{(hour_start + 2) % 24:02d}:00",
+    }
+
+
+@lru_cache(maxsize=8)
+def year_table(year: int) -> Dict[str, Dict]:
+    """预先编译一整年（公历）的历法表：ISO 日期 -> 当日信息；超出农历表范围时抛出 ValueError"""
+    if not MIN_YEAR <= year <= MAX_YEAR:
+        raise ValueError(f"仅支持 {MIN_YEAR}-{MAX_YEAR} 年")
+    start_jie = next(day for day, name, _ in jie_dates(year) if name == "立春")
+    day = date(year, 1, 1)
+    table = {}
+    while day.year == year:
+        table[day.isoformat()] = _compile_day(day, start_jie)
+        day += timedelta(days=1)
+    return table
+
+
+def get_day(target: Optional[Union[date, datetime]] = None) -> Dict:
+    """查询某日的历法信息（默认今天）"""
+    if target is None:
+        target = date.today()
+    if isinstance(target, datetime):
+        target = target.date()
+    return year_table(target.year)[target.isoformat()]
+
+
+def get_trend(target: Optional[Union[date, datetime]] = None) -> str:
+    """某日的吉/平/凶"""
+    return get_day(target)["trend"]
+
+
+def stars_text(count: int) -> str:
+    return "★" * count + "☆" * (5 - count)
+
+
+def local_paragraphs(info: Dict) -> Dict[str, str]:
+    """按当日吉/平/凶取本地说明文字"""
+    return {aspect: texts[info["trend"]] for aspect, texts in LOCAL_PARAGRAPHS.items()}
+
+
+def format_fortune(info: Dict, paragraphs: Dict[str, str], date_string: str) -> str:
+    """按每日运势的固定格式排版：结构化部分来自历法表，各段说明来自 paragraphs"""
+    numbers = ", ".join(str(n) for n in info["lucky_numbers"])
+    aspects = "\n\n".join(
+        f"{aspect}{stars_text(info['stars'][aspect])}\n{paragraphs[aspect]}" for aspect in ASPECTS
+    )
+    return (
+        f"黄道吉日\n{date_string}\n"
+        f"{info['lunar_date']} {info['year_ganzhi']}年 {info['month_ganzhi']}月 {info['day_ganzhi']}日 "
+        f"建除：{info['officer']} [{info['trend']}]\n"
+        f"宜 {' '.join(info['suitable'])}\n忌 {' '.join(info['avoid'])}\n\n"
+        f"{aspects}\n\n"
+        f"今日建议\n{paragraphs['今日建议']}\n\n"
+        f"今日幸运\n幸运颜色: {info['lucky_color']}\n幸运数字: {numbers}\n"
+        f"幸运方位: {info['lucky_direction']}\n吉时: {info['lucky_hour']}"
+    )
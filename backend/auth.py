@@ -0,0 +1,126 @@
+"""
+用户身份：签名会话令牌与钱包签名登录
+
+- 没有有效令牌的客户端首次请求时签发匿名会话（user_id 形如 s:<随机串>），每个客户端各自独立
+- 钱包地址须先对服务端下发的登录消息签名（EIP-191 personal_sign），验证签名者后才签发绑定该地址的令牌
+- 令牌为 HMAC 签名的 (user_id, 过期时间)，无法伪造或改写成他人的地址；多个 worker 共用 AUTH_SECRET 校验
+- 登录消息自带 HMAC 校验与过期时间，不需要服务端保存；一次性使用由调用方记录（见 UserStore.consume_nonce）
+"""
+
+import os
+import hmac
+import time
+import secrets
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+from user_store import is_wallet, normalize_user_id
+
+try:
+    from eth_account import Account
+    from eth_account.messages import encode_defunct
+except ImportError:  # 未安装 eth-account 时不支持钱包登录，匿名会话不受影响
+    Account = None
+
+logger = logging.getLogger(__name__)
+
+# 匿名会话的用户标识前缀
+SESSION_PREFIX = "s:"
+
+_LOGIN_TITLE = "小六壬神庙 钱包登录"
+
+
+class AuthError(Exception):
+    """登录消息或钱包签名无效"""
+
+
+class IdentitySigner:
+    """签发与校验身份令牌，生成与验证钱包登录消息"""
+
+    def __init__(self, secret: bytes, token_ttl: float = 30 * 86400, challenge_ttl: float = 300.0):
+        self._secret = secret
+        self.token_ttl = token_ttl
+        self.challenge_ttl = challenge_ttl
+
+    @classmethod
+    def from_env(cls) -> "IdentitySigner":
+        """AUTH_SECRET 未设置时使用随机密钥：重启后令牌失效，且不预加载的多 worker 之间互不认可"""
+        secret = os.getenv('AUTH_SECRET', '')
+        if not secret:
+            logger.warning("未设置 AUTH_SECRET，使用随机密钥签发身份令牌（重启后全部失效）")
+            secret = secrets.token_hex(32)
+        return cls(
+            secret.encode(),
+            token_ttl=float(os.getenv('AUTH_TOKEN_TTL', str(30 * 86400))),
+            challenge_ttl=float(os.getenv('AUTH_CHALLENGE_TTL', '300')),
+        )
+
+    @property
+    def wallet_login_available(self) -> bool:
+        return Account is not None
+
+    def _mac(self, *parts: str) -> str:
+        return hmac.new(self._secret, "|".join(parts).encode(), hashlib.sha256).hexdigest()
+
+    def issue(self, user_id: str) -> str:
+        """签发令牌：<user_id>.<过期时间>.<签名>"""
+        expires = str(int(time.time() + self.token_ttl))
+        return f"{user_id}.{expires}.{self._mac('token', user_id, expires)}"
+
+    def verify(self, token: str) -> Optional[str]:
+        """校验令牌，返回其中的 user_id；签名不符或已过期时返回 None"""
+        try:
+            user_id, expires, mac = token.rsplit(".", 2)
+            if int(expires) <= time.time():
+                return None
+        except ValueError:
+            return None
+        if not hmac.compare_digest(mac.encode(), self._mac('token', user_id, expires).encode()):
+            return None
+        return user_id
+
+    def new_session(self) -> Tuple[str, str]:
+        """签发匿名会话，返回 (user_id, 令牌)"""
+        user_id = SESSION_PREFIX + secrets.token_hex(16)
+        return user_id, self.issue(user_id)
+
+    def challenge(self, address: str) -> Dict:
+        """生成待钱包签名的登录消息；地址格式非法时抛出 ValueError"""
+        address = normalize_user_id(address)
+        if not is_wallet(address):
+            raise ValueError("钱包地址格式不正确")
+        nonce = secrets.token_hex(16)
+        expires = str(int(time.time() + self.challenge_ttl))
+        message = "\n".join([
+            _LOGIN_TITLE,
+            f"Address: {address}",
+            f"Nonce: {nonce}",
+            f"Expires: {expires}",
+            f"Check: {self._mac('challenge', address, nonce, expires)}",
+        ])
+        return {"message": message, "nonce": nonce, "expires_at": int(expires)}
+
+    def verify_wallet(self, message: str, signature: str) -> Tuple[str, str, float]:
+        """验证登录消息与钱包签名，返回 (钱包地址, nonce, 消息过期时间)；无效时抛出 AuthError"""
+        if Account is None:
+            raise AuthError("服务端未启用钱包登录")
+        lines = message.split("\n")
+        fields = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+        try:
+            address, nonce, expires, check = (fields[name] for name in ("Address", "Nonce", "Expires", "Check"))
+            expires_at = float(expires)
+        except (KeyError, ValueError):
+            raise AuthError("登录消息格式不正确")
+        expected = self._mac('challenge', address, nonce, expires)
+        if lines[0] != _LOGIN_TITLE or not hmac.compare_digest(check.encode(), expected.encode()):
+            raise AuthError("登录消息无效")
+        if expires_at <= time.time():
+            raise AuthError("登录消息已过期，请重新登录")
+        try:
+            signer = Account.recover_message(encode_defunct(text=message), signature=signature)
+        except Exception:
+            raise AuthError("钱包签名无效")
+        if signer.lower() != address:
+            raise AuthError("钱包签名与地址不符")
+        return address, nonce, expires_at
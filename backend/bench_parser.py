@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+占卜结果解析器基准测试
+使用方法：python bench_parser.py [迭代次数]
+
+对 bench_corpus/ 中的真实风格模型输出（中/英，含格式异常的样本），
+比较旧版多次正则扫描解析器与当前单次扫描解析器：
+1. 校验两者解析结果一致（旧版无法解析、新版可恢复的样本单独列出）
+2. 统计每次解析的平均 CPU 耗时
+"""
+
+import re
+import sys
+import json
+import time
+import warnings
+from pathlib import Path
+from typing import Dict, Optional
+
+from llm_service import llm_service
+
+CORPUS_DIR = Path(__file__).parent / "bench_corpus"
+
+# 旧版模式中的 "[[]" 写法会触发 FutureWarning，对照实现保持原样，仅屏蔽告警
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+
+# ---------------------------------------------------------------------------
+# 旧版解析器（保留原实现用于对照）
+# ---------------------------------------------------------------------------
+
+def legacy_extract_section(text: str, section_title) -> str:
+    titles = section_title if isinstance(section_title, (list, tuple)) else [section_title]
+    for title in titles:
+        escaped = re.escape(title).replace("\\[", "[[]").replace("\\]", "[]]")
+        pattern = rf"{escaped}([\s\S]*?)(?=【|\[|$)"
+        match = re.search(pattern, text, flags=re.IGNORECASE)
+        if match:
+            return match.group(1).strip()
+    return ""
+
+
+def legacy_extract_luck_score(text: str) -> int:
+    patterns = [
+        r"(?:overall\s*)?(?:score|rating|luck)[^\d]{0,10}(\d{1,2})(?:\s*/\s*10)?",
+        r"(\d{1,2})\s*/\s*10",
+        r"(\d{1,2})\s*分"
+    ]
+    for pat in patterns:
+        m = re.search(pat, text, flags=re.IGNORECASE)
+        if m:
+            try:
+                val = int(m.group(1))
+                return max(1, min(10, val))
+            except Exception:
+                continue
+    m = re.search(r"(\d+(?:\.\d+)?)\s*/\s*10", text)
+    if m:
+        try:
+            val = int(round(float(m.group(1))))
+            return max(1, min(10, val))
+        except Exception:
+            pass
+    return 7
+
+
+def legacy_extract_json_block(text: str) -> Optional[Dict]:
+    import json
+    fence = re.search(r"```json\s*([\s\S]*?)```", text, flags=re.IGNORECASE)
+    if fence:
+        try:
+            return json.loads(fence.group(1).strip())
+        except Exception:
+            pass
+    brace = re.search(r"\{[\s\S]*\}", text)
+    if brace:
+        blob = brace.group(0)
+        try:
+            data = json.loads(blob)
+            if isinstance(data, dict) and any(k in data for k in ("divination", "prediction", "advice", "luck")):
+                return data
+        except Exception:
+            pass
+    return None
+
+
+def legacy_parse(result: str) -> Dict:
+    try:
+        json_data = legacy_extract_json_block(result)
+        if json_data:
+            return llm_service._result_from_json(json_data, result)
+        div_keys = ["【卦象解析】", "[Hexagram Analysis]", "Hexagram Analysis"]
+        pre_keys = ["【运势预测】", "[Prediction]", "Prediction"]
+        adv_keys = ["【神明指引】", "[Divine Guidance]", "Divine Guidance"]
+        return {
+            "success": True,
+            "divination": legacy_extract_section(result, div_keys),
+            "prediction": legacy_extract_section(result, pre_keys),
+            "advice": legacy_extract_section(result, adv_keys),
+            "luck": legacy_extract_luck_score(result),
+            "full_text": result
+        }
+    except Exception:
+        return {"success": False, "error": "解析结果失败"}
+
+
+# ---------------------------------------------------------------------------
+
+def load_corpus():
+    return [(path.name, path.read_text(encoding="utf-8")) for path in sorted(CORPUS_DIR.glob("*.txt"))]
+
+
+def cpu_time_per_call(func, texts, iterations: int) -> float:
+    """返回单次解析的平均 CPU 耗时（微秒）"""
+    start = time.process_time()
+    for _ in range(iterations):
+        for text in texts:
+            func(text)
+    return (time.process_time() - start) / (iterations * len(texts)) * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    corpus = load_corpus()
+    print(f"📚 语料: {len(corpus)} 条（{CORPUS_DIR.name}/）")
+    print("-" * 60)
+
+    mismatches = 0
+    for name, text in corpus:
+        old = legacy_parse(text)
+        new = llm_service.parse_divination_result(text)
+        if old == new:
+            status = "✅ 一致"
+        elif not legacy_extract_json_block(text) and llm_service.extract_json_block(text):
+            status = "🔧 新版恢复了 JSON"
+        else:
+            status = "❌ 不一致"
+            mismatches += 1
+            print(json.dumps({"old": old, "new": new}, ensure_ascii=False, indent=2))
+        print(f"{status:<14} {name}")
+
+    texts = [text for _, text in corpus]
+    old_us = cpu_time_per_call(legacy_parse, texts, iterations)
+    new_us = cpu_time_per_call(llm_service.parse_divination_result, texts, iterations)
+    print("-" * 60)
+    print(f"旧版解析: {old_us:8.1f} µs/次")
+    print(f"新版解析: {new_us:8.1f} µs/次  （{old_us / new_us:.1f}x）")
+
+    if mismatches:
+        print(f"\n❌ {mismatches} 条样本解析结果不一致")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
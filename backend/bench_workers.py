@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+多 worker 吞吐基准测试
+使用方法：python bench_workers.py [worker 数] [每轮秒数] [并发连接数]
+
+以生产模式（start_server.py --production）分别启动 1 个与 N 个 worker（默认 N 为 CPU 核数）的服务，
+LLM 使用 mock 提供方（LLM_PROVIDER=mock），用户数据、库存与缓存写入每轮各自的临时目录。
+压测客户端由多个进程组成，混合请求商城、每日运势、用户状态、上香与占卜接口，
+统计每秒请求数与延迟分位数，对比 1 个与 N 个 worker 的吞吐。
+
+依赖 httpx（pip install httpx）。
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import tempfile
+import subprocess
+import multiprocessing
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+try:
+    import httpx
+except ImportError:
+    print("❌ 需要 httpx：pip install httpx")
+    sys.exit(1)
+
+from start_server import cpu_count
+
+BACKEND_DIR = Path(__file__).parent
+
+# (方法, 路径, 请求体)；占卜的愿望按序号变化，部分命中缓存、部分触发 mock LLM
+REQUEST_MIX = (
+    ("GET", "/api/shop", None),
+    ("GET", "/api/daily-fortune", None),
+    ("GET", "/api/daily-fortune?format=structured", None),
+    ("GET", "/api/user/status", None),
+    ("POST", "/api/incense", {"wish": "平安顺遂", "amount": 1}),
+    ("POST", "/api/divination", {"wish": "事业顺利{n}", "numbers": [3, 18, 66]}),
+    ("POST", "/api/divination", {"wish": "身体健康", "numbers": [8, 26, 67], "mode": "local"}),
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, port: int, data_dir: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        LLM_PROVIDER="mock",
+        AUTH_SECRET=os.getenv('AUTH_SECRET') or "bench-workers",
+        SERVER_HOST="127.0.0.1",
+        SERVER_PORT=str(port),
+        CACHE_DB_PATH=os.path.join(data_dir, "cache.sqlite3"),
+        USER_DB_PATH=os.path.join(data_dir, "users.sqlite3"),
+        INVENTORY_DB_PATH=os.path.join(data_dir, "shop.sqlite3"),
+        DAILY_FORTUNE_PREGEN_LOCK=os.path.join(data_dir, "pregen.lock"),
+    )
+    return subprocess.Popen(
+        [sys.executable, "start_server.py", "--production", "--workers", str(workers), "--skip-checks"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_until_ready(port: int, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"服务在 {timeout} 秒内未就绪")
+
+
+async def client_loop(port: int, duration: float, concurrency: int, client_id: int) -> Tuple[int, int, List[float]]:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30.0) as client:
+        async def worker(slot: int) -> None:
+            nonlocal errors
+            n = 0
+            # 每个并发槽位各自保存服务端签发的会话令牌，模拟不同的访客；
+            # 首次请求携带无效令牌（优先于客户端共享的 Cookie），由服务端签发新会话
+            headers = {"Authorization": "Bearer -"}
+            while time.perf_counter() < deadline:
+                method, path, body = REQUEST_MIX[n % len(REQUEST_MIX)]
+                if body and "{n}" in body.get("wish", ""):
+                    body = dict(body, wish=body["wish"].format(n=n % 50))
+                n += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body, headers=headers)
+                    if "x-session-token" in response.headers:
+                        headers["Authorization"] = f"Bearer {response.headers['x-session-token']}"
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        await asyncio.gather(*(worker(slot) for slot in range(concurrency)))
+    return len(latencies), errors, latencies
+
+
+def run_client(args) -> Tuple[int, int, List[float]]:
+    return asyncio.run(client_loop(*args))
+
+
+def run_round(workers: int, duration: float, concurrency: int, clients: int) -> Dict:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as data_dir:
+        server = start_server(workers, port, data_dir)
+        try:
+            wait_until_ready(port)
+            # 预热：建立连接、填充运势缓存
+            asyncio.run(client_loop(port, 1.0, 4, -1))
+
+            per_client = max(1, concurrency // clients)
+            started = time.perf_counter()
+            with multiprocessing.Pool(clients) as pool:
+                results = pool.map(run_client, [(port, duration, per_client, i) for i in range(clients)])
+            elapsed = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    total = sum(count for count, _, _ in results)
+    errors = sum(err for _, err, _ in results)
+    latencies = sorted(ms for _, _, samples in results for ms in samples)
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+
+    return {
+        "workers": workers,
+        "requests": total,
+        "errors": errors,
+        "rps": total / elapsed,
+        "p50": percentile(0.5),
+        "p99": percentile(0.99),
+    }
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else cpu_count()
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    clients = max(1, min(cpu_count(), 4))
+
+    print(f"🖥️  CPU 核数: {cpu_count()}，压测进程: {clients}，并发连接: {concurrency}，每轮 {duration:.0f} 秒")
+    print("-" * 60)
+
+    rounds = []
+    for count in sorted({1, workers}):
+        result = run_round(count, duration, concurrency, clients)
+        rounds.append(result)
+        print(f"{result['workers']:>2} worker: {result['rps']:9.1f} req/s  "
+              f"p50 {result['p50']:7.1f} ms  p99 {result['p99']:7.1f} ms  "
+              f"错误 {result['errors']}/{result['requests']}")
+
+    if len(rounds) > 1:
+        print("-" * 60)
+        print(f"吞吐提升: {rounds[-1]['rps'] / rounds[0]['rps']:.2f}x（{rounds[-1]['workers']} worker 对比 1 worker）")
+    if cpu_count() < 2:
+        print("⚠️  当前机器只有 1 个可用核心，多 worker 无法体现吞吐提升")
+
+
+if __name__ == "__main__":
+    main()
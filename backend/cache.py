@@ -0,0 +1,165 @@
+"""
+缓存工具：带过期时间的 LRU 内存缓存与异步单飞（single-flight）合并
+
+TTLCache 可挂载磁盘缓存（persistent_cache.SQLiteCacheStore）：内存未命中时在存储线程中回查磁盘，
+写入时提交到存储线程写穿（不等待完成），磁盘读写都不阻塞事件循环。
+"""
+
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def next_local_midnight(target: Optional[datetime] = None) -> datetime:
+    """返回目标日期（若早于今天则取今天）之后的本地零点"""
+    today = datetime.now().date()
+    day = max(target.date(), today) if target else today
+    return datetime.combine(day + timedelta(days=1), datetime.min.time())
+
+
+class TTLCache:
+    """带过期时间与容量上限的内存缓存，超出容量时淘汰最久未使用的条目
+
+    store 为可选的磁盘缓存，namespace 区分同一存储中的不同缓存；disk_maxsize 为磁盘条目上限
+    （默认与内存容量相同）。
+    """
+
+    def __init__(self, maxsize: int = 1024, default_ttl: Optional[float] = None,
+                 store=None, namespace: str = "", disk_maxsize: Optional[int] = None):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        # key -> (过期时间戳 或 None, 值)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.store = store
+        self.namespace = namespace
+        self.disk_hits = 0
+        if store is not None:
+            store.register(namespace, disk_maxsize or maxsize)
+
+    def _memory_entry(self, key: str) -> Optional[tuple]:
+        """返回内存中未过期的条目"""
+        entry = self._data.get(key)
+        if entry is not None:
+            if entry[0] is None or entry[0] > time.time():
+                return entry
+            del self._data[key]
+        return None
+
+    async def _entry(self, key: str) -> Optional[tuple]:
+        """返回未过期的条目；内存未命中时回查磁盘并回填内存"""
+        entry = self._memory_entry(key)
+        if entry is not None or self.store is None:
+            return entry
+        entry = await self.store.run(self.store.get, self.namespace, key)
+        # 等待磁盘期间可能已有新值写入内存，以内存为准
+        current = self._memory_entry(key)
+        if current is not None or entry is None:
+            return current
+        self.disk_hits += 1
+        self._insert(key, entry)
+        return entry
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        entry = await self._entry(key)
+        if entry is not None:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return default
+
+    async def peek(self, key: str, default: Any = None) -> Any:
+        """读取未过期的条目，不计入命中统计、不调整淘汰顺序"""
+        entry = await self._entry(key)
+        return entry[1] if entry is not None else default
+
+    def ttl(self, key: str) -> Optional[float]:
+        """条目剩余有效秒数（仅查内存，用于刚经 get 读取的条目）；不存在或已过期时返回 None，永不过期时返回 inf"""
+        entry = self._memory_entry(key)
+        if entry is None:
+            return None
+        if entry[0] is None:
+            return float("inf")
+        remaining = entry[0] - time.time()
+        return remaining if remaining > 0 else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, expires_at: Optional[float] = None) -> None:
+        """写入缓存；expires_at 为绝对时间戳，优先于 ttl（秒）。磁盘写穿提交到存储线程，不等待完成"""
+        if expires_at is None:
+            ttl = self.default_ttl if ttl is None else ttl
+            expires_at = time.time() + ttl if ttl is not None else None
+        self._insert(key, (expires_at, value))
+        if self.store is not None:
+            self.store.submit(self.store.set, self.namespace, key, value, expires_at)
+
+    def _insert(self, key: str, entry: tuple) -> None:
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+        if self.store is not None:
+            self.store.submit(self.store.delete, self.namespace, key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        if self.store is not None:
+            self.store.submit(self.store.clear, self.namespace)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "disk_hits": self.disk_hits,
+            "persistent": self.store is not None,
+        }
+
+
+class SingleFlight:
+    """同一个 key 的并发调用只执行一次，其余调用等待并共享同一结果
+
+    生成任务独立于调用方运行：发起者被取消（如客户端断开）不会影响其他等待者。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            self.executed += 1
+            task.add_done_callback(lambda done, k=key: self._finish(k, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 标记异常已读取，避免所有等待者都被取消时产生告警
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "shared": self.shared,
+        }
@@ -0,0 +1,169 @@
+"""
+每日运势后台预生成
+
+在应用生命周期内运行：启动时生成今日及之后 N 天的运势，此后每天零点窗口前移时补齐新的一天，
+失败按指数退避重试。运势按日期键缓存，零点切换日期时新一天的结果已就绪，切换即原子完成，
+用户请求与上香都不会等待生成。
+
+多 worker 部署时，运势缓存写穿到共享的磁盘缓存，只需一个 worker 负责预生成：
+各 worker 启动时竞争同一个文件锁，持有锁的 worker 运行预生成任务，其余 worker 从磁盘缓存读取。
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：不支持文件锁，各进程各自预生成
+    fcntl = None
+
+from cache import next_local_midnight
+from llm_scheduler import PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+class DailyFortuneScheduler:
+    """每日运势预生成任务：维护 [今天, 今天 + days_ahead] 的运势缓存"""
+
+    def __init__(self, service, days_ahead: int = 1, retry_seconds: float = 30.0, max_retry_seconds: float = 600.0,
+                 lock_path: Optional[str] = None):
+        self.service = service
+        # 多进程间的预生成锁文件；为空时不做选主
+        self.lock_path = lock_path
+        self._lock_file = None
+        # 至少提前生成明天
+        self.days_ahead = max(1, days_ahead)
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._task: Optional[asyncio.Task] = None
+        self.status = {
+            "last_run": None,
+            "next_run": None,
+            "generated": 0,
+            "failures": 0,
+            "last_error": None,
+        }
+
+    @classmethod
+    def from_env(cls, service) -> "DailyFortuneScheduler":
+        return cls(
+            service,
+            days_ahead=int(os.getenv('DAILY_FORTUNE_PREGEN_DAYS', '1')),
+            retry_seconds=float(os.getenv('DAILY_FORTUNE_PREGEN_RETRY_SECONDS', '30')),
+            max_retry_seconds=float(os.getenv('DAILY_FORTUNE_PREGEN_MAX_RETRY_SECONDS', '600')),
+            lock_path=os.getenv('DAILY_FORTUNE_PREGEN_LOCK', 'daily_fortune_pregen.lock') or None,
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        if not self.service.provider:
+            logger.info("LLM 提供方未配置，跳过每日运势预生成")
+            return
+        if not self._acquire_leader_lock():
+            logger.info("其他 worker 正在负责每日运势预生成，本进程从共享缓存读取")
+            return
+        self._task = asyncio.ensure_future(self._run())
+        logger.info(f"每日运势预生成已启动：提前 {self.days_ahead} 天")
+
+    def _acquire_leader_lock(self) -> bool:
+        """多 worker 选主：非阻塞获取文件锁，获取成功（或无需选主）返回 True
+
+        只有运势缓存写穿到共享磁盘缓存时才需要选主，否则各进程的内存缓存互不可见。
+        """
+        if not self.lock_path or fcntl is None or getattr(self.service, "cache_store", None) is None:
+            return True
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # 锁随文件句柄存活，进程退出时自动释放
+        self._lock_file = lock_file
+        return True
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def target_dates(self) -> List[datetime]:
+        """需要就绪的日期：今天及之后 days_ahead 天"""
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        return [today + timedelta(days=offset) for offset in range(self.days_ahead + 1)]
+
+    async def _is_ready(self, date: datetime) -> bool:
+        cached = await self.service.cached_daily_fortune(date)
+        return bool(cached and cached.get("success"))
+
+    async def ensure_window(self) -> bool:
+        """生成窗口内尚未就绪的日期；全部就绪返回 True"""
+        ready = True
+        for date in self.target_dates():
+            if await self._is_ready(date):
+                continue
+            result = await self.service.refresh_daily_fortune(date, priority=PRIORITY_BACKGROUND)
+            if result.get("success"):
+                self.status["generated"] += 1
+                logger.info(f"已预生成 {date.strftime('%Y-%m-%d')} 的每日运势")
+            else:
+                ready = False
+                self.status["failures"] += 1
+                self.status["last_error"] = f"{date.strftime('%Y-%m-%d')} 生成失败，使用默认运势"
+        self.status["last_run"] = datetime.now().isoformat(timespec="seconds")
+        return ready
+
+    async def _run(self) -> None:
+        retry = self.retry_seconds
+        while True:
+            try:
+                ready = await self.ensure_window()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.error(f"每日运势预生成异常: {error!r}")
+                self.status["failures"] += 1
+                self.status["last_error"] = repr(error)[:200]
+                ready = False
+
+            # 全部就绪则等到零点窗口前移；否则按指数退避重试（不晚于零点）
+            until_midnight = next_local_midnight().timestamp() - time.time()
+            if ready:
+                retry = self.retry_seconds
+                delay = until_midnight + 1
+            else:
+                delay = min(retry, until_midnight + 1)
+                retry = min(retry * 2, self.max_retry_seconds)
+            delay = max(1.0, delay)
+            self.status["next_run"] = (datetime.now() + timedelta(seconds=delay)).isoformat(timespec="seconds")
+            await asyncio.sleep(delay)
+
+    async def get_status(self) -> Dict:
+        return {
+            "running": self.running,
+            "lock_held": self._lock_file is not None,
+            "days_ahead": self.days_ahead,
+            "dates": {
+                date.strftime('%Y-%m-%d'): "ready" if await self._is_ready(date) else "pending"
+                for date in self.target_dates()
+            },
+            **self.status,
+        }
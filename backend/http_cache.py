@@ -0,0 +1,60 @@
+"""
+HTTP 缓存语义：强 ETag、Cache-Control 与 304 Not Modified
+
+序列化后的响应体按「来源对象」缓存：来源对象不变（同一份缓存结果 / 同一版本商品目录）时
+直接复用字节与 ETag，不再重复序列化；客户端携带匹配的 If-None-Match 时返回 304。
+"""
+
+import hashlib
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+
+def make_etag(body: bytes) -> str:
+    """根据响应体生成强 ETag"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 使用弱比较：忽略 W/ 前缀，支持逗号分隔的多个值与 *"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """序列化响应体缓存：key -> (来源对象, 响应体, ETag)，来源对象变化时重新序列化"""
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._entries: Dict[str, Tuple[Any, bytes, str]] = {}
+
+    def get(self, key: str, source: Any, serialize: Callable[[], bytes]) -> Tuple[bytes, str]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is source:
+            return entry[1], entry[2]
+        body = serialize()
+        etag = make_etag(body)
+        if key not in self._entries and len(self._entries) >= self.maxsize:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (source, body, etag)
+        return body, etag
+
+
+def cached_response(request: Request, body: bytes, etag: str, max_age: int,
+                    media_type: str = "application/json") -> Response:
+    """返回带 ETag / Cache-Control 的响应；If-None-Match 命中时返回 304（无响应体）"""
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max(0, int(max_age))}",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,349 @@
+"""
+商城库存：按商品记录库存数量，原子预留 / 扣减，支持限时保留（等待链上支付确认）
+
+- 预留为单条条件更新（available >= 数量 时才扣减），多个 worker 并发下单也不会超卖
+- 预留生成保留单（hold），确认后计入已售；取消或超时未确认时库存自动退回
+- 链上支付确认的保留单记录支付交易哈希（唯一），同一笔交易不能确认多个保留单
+- 已售罄的商品在进程内短暂记录，抢购高峰时后续请求直接返回售罄，不再访问数据库
+- 抢购商品（flash_sale）限制每个用户的购买总量，只对经签名验证的用户（钱包）开放：
+  匿名会话可随时重新签发，按会话计数无法限购
+- 未设置库存数量的商品不限量，不经过库存表
+- 方法均为同步调用，异步代码中经 run() 在存储专用线程中执行
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventory (
+    item_id INTEGER PRIMARY KEY,
+    available INTEGER NOT NULL,
+    sold INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stock_holds (
+    hold_id TEXT PRIMARY KEY,
+    item_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    ref TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hold_payments (
+    tx_hash TEXT PRIMARY KEY,
+    hold_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_stock_holds_pending ON stock_holds (status, expires_at);
+CREATE INDEX IF NOT EXISTS idx_stock_holds_user ON stock_holds (item_id, user_id, status);
+"""
+
+# 保留单状态
+HOLD_PENDING = "pending"
+HOLD_COMMITTED = "committed"
+HOLD_RELEASED = "released"
+HOLD_EXPIRED = "expired"
+HOLD_STATUS_TEXT = {HOLD_COMMITTED: "已确认", HOLD_RELEASED: "已取消", HOLD_EXPIRED: "已过期"}
+
+_SEED = "INSERT INTO inventory (item_id, available, sold, updated_at) VALUES (?, ?, 0, ?) ON CONFLICT(item_id) DO NOTHING"
+_RESERVE = (
+    "UPDATE inventory SET available = available - ?, updated_at = ? "
+    "WHERE item_id = ? AND available >= ?"
+)
+_RETURN_STOCK = "UPDATE inventory SET available = available + ?, updated_at = ? WHERE item_id = ?"
+# 配置的库存总量 = 可售 + 已售 + 保留中（预留、确认、退回都保持该总量不变）
+_STOCK_TOTAL = (
+    "SELECT i.available + i.sold + COALESCE((SELECT SUM(quantity) FROM stock_holds h "
+    "WHERE h.item_id = i.item_id AND h.status = ?), 0) FROM inventory i WHERE i.item_id = ?"
+)
+_RESTOCK = "UPDATE inventory SET available = MAX(available + ?, 0), updated_at = ? WHERE item_id = ?"
+_ADD_SOLD = "UPDATE inventory SET sold = sold + ?, updated_at = ? WHERE item_id = ?"
+_INSERT_HOLD = (
+    "INSERT INTO stock_holds (hold_id, item_id, user_id, quantity, status, expires_at, ref, created_at, updated_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?)"
+)
+_SELECT_HOLD = (
+    "SELECT item_id, user_id, quantity, status, expires_at, ref, created_at FROM stock_holds WHERE hold_id = ?"
+)
+_SET_HOLD_STATUS = (
+    "UPDATE stock_holds SET status = ?, ref = COALESCE(?, ref), updated_at = ? "
+    "WHERE hold_id = ? AND status = ?"
+)
+_USER_QUANTITY = (
+    "SELECT COALESCE(SUM(quantity), 0) FROM stock_holds "
+    "WHERE item_id = ? AND user_id = ? AND status IN (?, ?)"
+)
+_EXPIRED_HOLDS = "SELECT hold_id, item_id, quantity FROM stock_holds WHERE status = ? AND expires_at <= ? LIMIT ?"
+
+
+class OutOfStockError(Exception):
+    """库存不足；available 为当前可售数量"""
+
+    def __init__(self, available: int = 0):
+        super().__init__("商品已售罄" if available <= 0 else f"库存不足，仅剩 {available} 件")
+        self.available = available
+
+
+class PurchaseLimitError(Exception):
+    """超过抢购商品的每人限购数量"""
+
+
+class HoldError(Exception):
+    """保留单不存在、不属于当前用户、已过期或已处理"""
+
+
+class InventoryStore(SQLiteStore):
+    """SQLite 库存：inventory 记录可售与已售数量，stock_holds 记录保留单"""
+
+    SCHEMA = _SCHEMA
+
+    def __init__(self, path: str, hold_seconds: float = 900.0, sold_out_recheck: float = 2.0,
+                 flash_sale_max_per_user: int = 1, sweep_interval: float = 30.0):
+        super().__init__(path)
+        self.hold_seconds = hold_seconds
+        self.sold_out_recheck = sold_out_recheck
+        self.flash_sale_max_per_user = max(1, flash_sale_max_per_user)
+        self.sweep_interval = max(1.0, sweep_interval)
+        # 限量商品 -> 是否为抢购商品
+        self.limited: Dict[int, bool] = {}
+        # 售罄短路：商品 -> 下次重新查询数据库的时间（monotonic）
+        self._sold_out_until: Dict[int, float] = {}
+        # 售罄商品集合的缓存：(刷新时间 monotonic, 集合)，商城列表按此区分缓存版本
+        self._sold_out_cache: Tuple[float, frozenset] = (0.0, frozenset())
+        self._sweep_task: Optional[asyncio.Task] = None
+        self.stats_counters = {
+            "reserved": 0, "committed": 0, "released": 0, "expired": 0,
+            "out_of_stock": 0, "short_circuited": 0, "limit_rejected": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "InventoryStore":
+        return cls(
+            os.getenv('INVENTORY_DB_PATH', 'shop.sqlite3'),
+            hold_seconds=float(os.getenv('INVENTORY_HOLD_SECONDS', '900')),
+            sold_out_recheck=float(os.getenv('INVENTORY_SOLD_OUT_RECHECK_SECONDS', '2')),
+            flash_sale_max_per_user=int(os.getenv('FLASH_SALE_MAX_PER_USER', '1')),
+            sweep_interval=float(os.getenv('INVENTORY_SWEEP_INTERVAL', '30')),
+        )
+
+    def _after_fork(self) -> None:
+        self._sold_out_until = {}
+        self._sold_out_cache = (0.0, frozenset())
+
+    def seed(self, items: Iterable[Tuple[int, Optional[int], bool]]) -> None:
+        """登记商品库存：(商品 ID, 库存总量 或 None 表示不限量, 是否抢购)
+
+        库存行已存在时不重置已售与保留中的数量，只把总量的变化（补货或减量）计入可售数量，
+        重启或重新加载未改动的目录不会改变库存；减量超过可售数量时可售记为 0。
+        """
+        now = time.time()
+        limited = {}
+        restocked = []
+        with self._transaction() as conn:
+            for item_id, stock, flash_sale in items:
+                if stock is None:
+                    continue
+                limited[item_id] = flash_sale
+                if conn.execute(_SEED, (item_id, stock, now)).rowcount:
+                    continue
+                delta = stock - conn.execute(_STOCK_TOTAL, (HOLD_PENDING, item_id)).fetchone()[0]
+                if delta:
+                    conn.execute(_RESTOCK, (delta, now, item_id))
+                    restocked.append((item_id, delta))
+        self.limited = limited
+        for item_id, delta in restocked:
+            logger.info(f"商品 {item_id} 库存总量调整 {delta:+d}")
+            self._sold_out_until.pop(item_id, None)
+        if restocked:
+            self._stock_changed()
+
+    def schedule_seed(self, items: Iterable[Tuple[int, Optional[int], bool]]) -> None:
+        """在存储线程中登记库存（商品目录重新加载时由事件循环调用），失败时记录日志"""
+        future = self.submit(self.seed, list(items))
+        future.add_done_callback(
+            lambda done: done.exception() and logger.error(f"登记商品库存失败: {done.exception()!r}")
+        )
+
+    def is_limited(self, item_id: int) -> bool:
+        return item_id in self.limited
+
+    def availability(self) -> Dict[int, int]:
+        """限量商品的当前可售数量"""
+        if not self.limited:
+            return {}
+        rows = self._connection().execute("SELECT item_id, available FROM inventory").fetchall()
+        return {item_id: available for item_id, available in rows if item_id in self.limited}
+
+    def sold_out(self) -> frozenset:
+        """当前售罄的限量商品；结果缓存 sold_out_recheck 秒，列表请求不必每次查询数据库"""
+        refreshed_at, items = self._sold_out_cache
+        if time.monotonic() - refreshed_at >= self.sold_out_recheck:
+            items = frozenset(item_id for item_id, available in self.availability().items() if available <= 0)
+            self._sold_out_cache = (time.monotonic(), items)
+        return items
+
+    async def current_sold_out(self) -> frozenset:
+        """sold_out() 的异步版本：缓存有效时直接返回，需要查询数据库时在存储线程中执行"""
+        refreshed_at, items = self._sold_out_cache
+        if time.monotonic() - refreshed_at < self.sold_out_recheck:
+            return items
+        return await self.run(self.sold_out)
+
+    def _stock_changed(self) -> None:
+        """本进程观察到库存售罄或退回时，让售罄集合在下次读取时刷新"""
+        self._sold_out_cache = (0.0, self._sold_out_cache[1])
+
+    def reserve(self, item_id: int, quantity: int, user_id: str, hold_seconds: Optional[float] = None,
+                verified: bool = False) -> Optional[str]:
+        """原子预留库存并生成保留单，返回保留单 ID；不限量商品返回 None
+
+        verified 表示 user_id 为经签名验证的身份，抢购商品只对其开放（否则抛出 PurchaseLimitError）。
+        库存不足时先回收已超时的保留单再重试一次，仍不足则抛出 OutOfStockError。
+        """
+        if item_id not in self.limited:
+            return None
+        if self.limited[item_id] and not verified:
+            self.stats_counters["limit_rejected"] += 1
+            raise PurchaseLimitError("抢购商品需先连接钱包并签名登录")
+        if self._sold_out_until.get(item_id, 0.0) > time.monotonic():
+            self.stats_counters["short_circuited"] += 1
+            raise OutOfStockError()
+
+        for attempt in range(2):
+            try:
+                return self._reserve(item_id, quantity, user_id, hold_seconds or self.hold_seconds)
+            except OutOfStockError as error:
+                if attempt or not self.release_expired():
+                    self.stats_counters["out_of_stock"] += 1
+                    if error.available <= 0:
+                        self._sold_out_until[item_id] = time.monotonic() + self.sold_out_recheck
+                        self._stock_changed()
+                    raise
+
+    def _reserve(self, item_id: int, quantity: int, user_id: str, hold_seconds: float) -> str:
+        now = time.time()
+        with self._transaction() as conn:
+            if self.limited.get(item_id):
+                bought = conn.execute(
+                    _USER_QUANTITY, (item_id, user_id, HOLD_PENDING, HOLD_COMMITTED)
+                ).fetchone()[0]
+                if bought + quantity > self.flash_sale_max_per_user:
+                    self.stats_counters["limit_rejected"] += 1
+                    raise PurchaseLimitError(f"抢购商品每人限购 {self.flash_sale_max_per_user} 件")
+            if not conn.execute(_RESERVE, (quantity, now, item_id, quantity)).rowcount:
+                row = conn.execute("SELECT available FROM inventory WHERE item_id = ?", (item_id,)).fetchone()
+                raise OutOfStockError(row[0] if row else 0)
+            hold_id = uuid.uuid4().hex
+            conn.execute(_INSERT_HOLD, (hold_id, item_id, user_id, quantity, HOLD_PENDING, now + hold_seconds, now, now))
+        self.stats_counters["reserved"] += 1
+        return hold_id
+
+    def get_hold(self, hold_id: str) -> Optional[Dict]:
+        row = self._connection().execute(_SELECT_HOLD, (hold_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "hold_id": hold_id, "item_id": row[0], "user_id": row[1], "quantity": row[2],
+            "status": row[3], "expires_at": row[4], "ref": row[5], "created_at": row[6],
+        }
+
+    def commit(self, hold_id: Optional[str], user_id: str, ref: Optional[str] = None,
+               tx_hash: Optional[str] = None) -> None:
+        """确认保留单（支付完成），库存计入已售；保留单已超时、已处理或交易已被使用时抛出 HoldError"""
+        if hold_id is None:
+            return
+        now = time.time()
+        with self._transaction() as conn:
+            hold = self._pending_hold(conn, hold_id, user_id)
+            if hold[4] <= now:
+                raise HoldError("保留已超时，请重新下单")
+            if tx_hash is not None:
+                try:
+                    conn.execute("INSERT INTO hold_payments (tx_hash, hold_id, created_at) VALUES (?, ?, ?)",
+                                 (tx_hash, hold_id, now))
+                except sqlite3.IntegrityError:
+                    raise HoldError("该支付交易已用于其他订单")
+            conn.execute(_SET_HOLD_STATUS, (HOLD_COMMITTED, ref, now, hold_id, HOLD_PENDING))
+            conn.execute(_ADD_SOLD, (hold[2], now, hold[0]))
+        self.stats_counters["committed"] += 1
+
+    def release(self, hold_id: Optional[str], user_id: str) -> None:
+        """取消保留单，库存退回"""
+        if hold_id is None:
+            return
+        now = time.time()
+        with self._transaction() as conn:
+            hold = self._pending_hold(conn, hold_id, user_id)
+            conn.execute(_SET_HOLD_STATUS, (HOLD_RELEASED, None, now, hold_id, HOLD_PENDING))
+            conn.execute(_RETURN_STOCK, (hold[2], now, hold[0]))
+        self._sold_out_until.pop(hold[0], None)
+        self._stock_changed()
+        self.stats_counters["released"] += 1
+
+    @staticmethod
+    def _pending_hold(conn: sqlite3.Connection, hold_id: str, user_id: str) -> tuple:
+        hold = conn.execute(_SELECT_HOLD, (hold_id,)).fetchone()
+        if hold is None or hold[1] != user_id:
+            raise HoldError("保留单不存在")
+        if hold[3] != HOLD_PENDING:
+            raise HoldError(f"保留单{HOLD_STATUS_TEXT.get(hold[3], '已处理')}")
+        return hold
+
+    def release_expired(self, batch: int = 500) -> int:
+        """回收已超时未确认的保留单，库存退回；返回回收数量"""
+        now = time.time()
+        with self._transaction() as conn:
+            expired = conn.execute(_EXPIRED_HOLDS, (HOLD_PENDING, now, batch)).fetchall()
+            for hold_id, item_id, quantity in expired:
+                conn.execute(_SET_HOLD_STATUS, (HOLD_EXPIRED, None, now, hold_id, HOLD_PENDING))
+                conn.execute(_RETURN_STOCK, (quantity, now, item_id))
+        for _, item_id, _ in expired:
+            self._sold_out_until.pop(item_id, None)
+        if expired:
+            self._stock_changed()
+        self.stats_counters["expired"] += len(expired)
+        return len(expired)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                released = await self.run(self.release_expired)
+                if released:
+                    logger.info(f"回收超时保留单 {released} 个")
+            except sqlite3.Error as error:
+                logger.warning(f"回收超时保留单失败: {error!r}")
+
+    def start(self) -> None:
+        """启动超时保留单回收任务"""
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.ensure_future(self._sweep_loop())
+
+    async def stop(self) -> None:
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "limited_items": len(self.limited),
+            "sold_out_cached": sum(1 for until in self._sold_out_until.values() if until > time.monotonic()),
+            **self.stats_counters,
+        }
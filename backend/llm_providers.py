@@ -0,0 +1,366 @@
+"""
+LLM 提供方抽象
+
+- GeminiProvider: 基于 google-genai 异步客户端，支持多密钥客户端池（最少在途 + 轮询分发，配额/鉴权错误自动隔离）
+- MockProvider: 本地模拟（可配置延迟分布、错误率），输出与真实模型格式一致，用于离线压测
+
+通过环境变量 LLM_PROVIDER=gemini|mock 选择。
+"""
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+from google import genai
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GEMINI_MODEL = 'gemini-2.0-flash-lite'
+
+
+class LLMProvider:
+    """LLM 提供方接口：generate 返回完整文本，stream 逐块产出文本"""
+
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    async def generate(self, prompt: str, json_schema: Optional[Dict] = None) -> str:
+        """生成完整文本；提供 json_schema 时要求模型按该 schema 输出 JSON"""
+        raise NotImplementedError
+
+    def stream(self, prompt: str) -> AsyncIterator[str]:
+        """流式生成，逐块产出文本"""
+        raise NotImplementedError
+
+    async def count_tokens(self, text: str) -> Optional[int]:
+        """统计 token 数；不支持时返回 None"""
+        return None
+
+    def key_stats(self) -> List[Dict]:
+        """各 API 密钥的负载与健康状态；无密钥概念的提供方返回空列表"""
+        return []
+
+
+def parse_api_keys(keys: str, fallback: str = '') -> List[str]:
+    """解析逗号分隔的密钥列表（去空白、去重、保持顺序）；为空时使用 fallback"""
+    parsed = []
+    for key in (keys or '').split(','):
+        key = key.strip()
+        if key and key not in parsed:
+            parsed.append(key)
+    if not parsed and fallback.strip():
+        parsed.append(fallback.strip())
+    return parsed
+
+
+class NoHealthyKeyError(Exception):
+    """客户端池中所有密钥均处于隔离状态"""
+
+
+class _KeySlot:
+    """客户端池中的一个密钥：长期复用的客户端（保持连接）、在途数与隔离状态"""
+
+    def __init__(self, index: int, api_key: str):
+        self.index = index
+        self.hint = f"...{api_key[-4:]}"
+        self.client = genai.Client(api_key=api_key)
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.quarantined_until = 0.0
+        self.last_error: Optional[str] = None
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini（google-genai SDK 异步客户端）
+
+    传入多个密钥时组成客户端池：按最少在途请求分发，在途数相同时轮询；
+    返回配额（429）或鉴权（401/403/无效密钥）错误的密钥被暂时隔离，并在其他密钥上重试一次。
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_keys: Union[str, List[str]], model: str = DEFAULT_GEMINI_MODEL):
+        super().__init__(model)
+        keys = [api_keys] if isinstance(api_keys, str) else list(api_keys)
+        if not keys:
+            raise ValueError("未提供 Gemini API 密钥")
+        self.slots = [_KeySlot(index, key) for index, key in enumerate(keys)]
+        self._next = 0
+        # 隔离时长（秒）：配额错误较短，鉴权错误较长
+        self.quota_quarantine = float(os.getenv('LLM_KEY_QUOTA_QUARANTINE_SECONDS', '60'))
+        self.auth_quarantine = float(os.getenv('LLM_KEY_AUTH_QUARANTINE_SECONDS', '3600'))
+
+    @property
+    def client(self):
+        """首个密钥的客户端（兼容单客户端用法）"""
+        return self.slots[0].client
+
+    def _pick(self, exclude: Optional[_KeySlot] = None) -> _KeySlot:
+        """选取未隔离的密钥：在途数最少者优先，相同时从轮询位置起依次选择"""
+        now = time.monotonic()
+        count = len(self.slots)
+        start = self._next
+        self._next = (start + 1) % count
+        best = None
+        for offset in range(count):
+            slot = self.slots[(start + offset) % count]
+            if slot is exclude or slot.quarantined_until > now:
+                continue
+            if best is None or slot.in_flight < best.in_flight:
+                best = slot
+        if best is None:
+            raise NoHealthyKeyError("所有 Gemini API 密钥均处于隔离状态")
+        return best
+
+    def _quarantine(self, slot: _KeySlot, error: Exception) -> bool:
+        """按错误类型隔离密钥；返回是否已隔离（即可换用其他密钥重试）"""
+        slot.failures += 1
+        code = getattr(error, 'code', None)
+        slot.last_error = f"{code} {error}"[:200] if code else repr(error)[:200]
+        message = str(error)
+        if code == 429:
+            duration = self.quota_quarantine
+        elif code in (401, 403) or 'API_KEY_INVALID' in message or 'API key not valid' in message:
+            duration = self.auth_quarantine
+        else:
+            return False
+        slot.quarantined_until = time.monotonic() + duration
+        logger.warning(f"Gemini API 密钥 {slot.hint} 返回 {code}，隔离 {duration:.0f} 秒")
+        return True
+
+    async def generate(self, prompt: str, json_schema: Optional[Dict] = None) -> str:
+        config = None
+        if json_schema:
+            config = types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=json_schema
+            )
+        slot = self._pick()
+        for attempt in range(2):
+            slot.in_flight += 1
+            slot.requests += 1
+            try:
+                response = await slot.client.aio.models.generate_content(
+                    model=self.model,
+                    contents=prompt,
+                    config=config
+                )
+                return response.text
+            except Exception as error:
+                if not self._quarantine(slot, error) or attempt:
+                    raise
+                # 换用其他密钥重试一次
+                try:
+                    retry_slot = self._pick(exclude=slot)
+                except NoHealthyKeyError:
+                    raise error
+            finally:
+                slot.in_flight -= 1
+            slot = retry_slot
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        slot = self._pick()
+        for attempt in range(2):
+            slot.in_flight += 1
+            slot.requests += 1
+            started = False
+            try:
+                stream = await slot.client.aio.models.generate_content_stream(
+                    model=self.model,
+                    contents=prompt
+                )
+                async for chunk in stream:
+                    if chunk.text:
+                        started = True
+                        yield chunk.text
+                return
+            except Exception as error:
+                # 已产出内容后不再重试，避免重复输出
+                if not self._quarantine(slot, error) or started or attempt:
+                    raise
+                try:
+                    retry_slot = self._pick(exclude=slot)
+                except NoHealthyKeyError:
+                    raise error
+            finally:
+                slot.in_flight -= 1
+            slot = retry_slot
+
+    async def count_tokens(self, text: str) -> Optional[int]:
+        response = await self._pick().client.aio.models.count_tokens(model=self.model, contents=text)
+        return response.total_tokens
+
+    def key_stats(self) -> List[Dict]:
+        now = time.monotonic()
+        return [
+            {
+                "key": slot.hint,
+                "in_flight": slot.in_flight,
+                "requests": slot.requests,
+                "failures": slot.failures,
+                "quarantined": slot.quarantined_until > now,
+                "quarantine_remaining_seconds": round(max(0.0, slot.quarantined_until - now), 1),
+                "last_error": slot.last_error,
+            }
+            for slot in self.slots
+        ]
+
+
+class MockProviderError(Exception):
+    """模拟提供方按错误率注入的失败"""
+
+
+class MockProvider(LLMProvider):
+    """本地模拟提供方：对数正态延迟分布 + 随机错误，返回真实格式的中英文输出"""
+
+    name = "mock"
+
+    MOCK_ZH = (
+        "【卦象解析】\n"
+        "1. 您与事情的关系 (人 vs 事)：两宫气场相合，您对此事投入自然，推进阻力较小。\n"
+        "2. 您与结果的关系 (人 vs 应)：结果一方对您略有压制，目标宜留出余地，切忌操之过急。\n"
+        "3. 事情与结果的关系 (事 vs 应)：过程易受外部条件约束，先争取支持再行动更为稳妥。\n\n"
+        "【运势预测】\n"
+        "近期运势以稳为主，所求之事「{wish}」循序渐进可成；待时机转变，局面将更加明朗。\n\n"
+        "【神明指引】\n"
+        "诚心守正，先求稳再求进。与人和睦相处，遇到分歧时多倾听少争辩，贵人自会相助。\n"
+    )
+    MOCK_EN = (
+        "[Hexagram Analysis]\n"
+        "1) Person vs Matter: the two palaces resonate, so your effort flows naturally into the matter.\n"
+        "2) Person vs Outcome: the outcome presses on you slightly; keep your expectations flexible.\n"
+        "3) Matter vs Outcome: external conditions may slow things down; secure support before acting.\n\n"
+        "[Prediction]\n"
+        "Steady progress is favoured; your wish '{wish}' can be reached step by step as timing improves.\n\n"
+        "[Divine Guidance]\n"
+        "Stay patient and grounded. Seek allies first, and listen more than you argue.\n"
+    )
+    MOCK_DAILY = {
+        "wealth": "财运平稳，正财可期，偏财宜守。",
+        "career": "工作推进顺利，适合处理积压事务。",
+        "love": "感情平淡，多些耐心与沟通。",
+        "health": "精力充沛，注意作息规律。",
+        "advice": "心存善念，稳中求进。",
+    }
+
+    def __init__(self, model: str = "mock", latency_ms: float = 800.0, latency_sigma: float = 0.5,
+                 error_rate: float = 0.0, chunks: int = 12, seed: Optional[int] = None):
+        super().__init__(model)
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.chunks = max(1, chunks)
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_env(cls, model: Optional[str] = None, seed_offset: int = 0) -> "MockProvider":
+        seed = os.getenv('LLM_MOCK_SEED')
+        return cls(
+            model=model or os.getenv('LLM_MOCK_MODEL', 'mock'),
+            latency_ms=float(os.getenv('LLM_MOCK_LATENCY_MS', '800')),
+            latency_sigma=float(os.getenv('LLM_MOCK_LATENCY_SIGMA', '0.5')),
+            error_rate=float(os.getenv('LLM_MOCK_ERROR_RATE', '0')),
+            chunks=int(os.getenv('LLM_MOCK_STREAM_CHUNKS', '12')),
+            seed=int(seed) + seed_offset if seed else None,
+        )
+
+    def sample_latency(self) -> float:
+        """按对数正态分布采样一次延迟（秒），中位数为 latency_ms"""
+        if self.latency_ms <= 0:
+            return 0.0
+        return self._random.lognormvariate(0.0, self.latency_sigma) * self.latency_ms / 1000
+
+    def _maybe_fail(self) -> None:
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise MockProviderError("模拟 LLM 调用失败")
+
+    def render(self, prompt: str, json_schema: Optional[Dict] = None) -> str:
+        """按提示词类型返回真实格式的模拟输出"""
+        if "黄道吉日" in prompt:
+            # 每日运势：结构化部分由本地历法算定，模型只返回各项说明
+            return json.dumps(self.MOCK_DAILY, ensure_ascii=False)
+
+        english = "User wish:" in prompt
+        wish = re.search(r"(?:User wish:|用户愿望：)\s*(.+)", prompt)
+        wish = wish.group(1).strip() if wish else ""
+        text = (self.MOCK_EN if english else self.MOCK_ZH).format(wish=wish)
+        luck = self._random.randint(3, 9)
+        sections = re.split(r"\n\n", text.strip())
+        fields = {
+            "divination": sections[0].split("\n", 1)[1],
+            "prediction": sections[1].split("\n", 1)[1],
+            "advice": sections[2].split("\n", 1)[1],
+            "luck": luck,
+        }
+        if json_schema:
+            return json.dumps(fields, ensure_ascii=False)
+        if "```json" in prompt:
+            # 完整提示词模式：可读分段之后追加机器可读 JSON 代码块
+            score = f"[Fortune Level]\nOverall score: {luck}/10" if english else f"【吉凶判断】\n总体运势评分：{luck}/10分"
+            return f"{text}\n{score}\n\n```json\n{json.dumps(fields, ensure_ascii=False, indent=2)}\n```"
+        return text
+
+    async def generate(self, prompt: str, json_schema: Optional[Dict] = None) -> str:
+        await asyncio.sleep(self.sample_latency())
+        self._maybe_fail()
+        return self.render(prompt, json_schema)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        latency = self.sample_latency()
+        # 首块约占总延迟的 30%，其余分摊到后续各块
+        await asyncio.sleep(latency * 0.3)
+        self._maybe_fail()
+        text = self.render(prompt)
+        size = max(1, len(text) // self.chunks)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(latency * 0.7 / max(1, len(pieces) - 1))
+            yield piece
+
+
+def create_provider(api_keys: Union[str, List[str]] = '') -> Optional[LLMProvider]:
+    """按 LLM_PROVIDER 创建提供方；gemini 未配置密钥或初始化失败时返回 None（使用本地结果）"""
+    name = os.getenv('LLM_PROVIDER', 'gemini').lower()
+    if name == 'mock':
+        provider = MockProvider.from_env()
+        logger.info(f"使用模拟 LLM 提供方：中位延迟 {provider.latency_ms}ms，错误率 {provider.error_rate}")
+        return provider
+    if name != 'gemini':
+        logger.warning(f"未知的 LLM_PROVIDER: {name}，使用 gemini")
+
+    if not api_keys:
+        logger.warning("GEMINI_API_KEY 环境变量未设置，将使用默认占卜结果")
+        return None
+    try:
+        # 使用新的 google-genai SDK，显式传入 API 密钥（多个密钥组成客户端池）
+        provider = GeminiProvider(api_keys, model=os.getenv('GEMINI_MODEL', DEFAULT_GEMINI_MODEL))
+        logger.info(f"LLM 客户端初始化成功（{len(provider.slots)} 个 API 密钥）")
+        return provider
+    except Exception as error:
+        logger.error(f"初始化 LLM 客户端失败: {error}")
+        return None
+
+
+def create_hedge_provider(primary: Optional[LLMProvider], api_keys: Union[str, List[str]] = '') -> Optional[LLMProvider]:
+    """创建对冲请求使用的备用提供方：LLM_HEDGE_MODEL / LLM_HEDGE_API_KEY 未设置时沿用主提供方的模型与密钥"""
+    if primary is None:
+        return None
+    model = os.getenv('LLM_HEDGE_MODEL') or primary.model
+    if isinstance(primary, MockProvider):
+        # 独立的随机序列，模拟另一条请求路径的延迟
+        return MockProvider.from_env(model=model, seed_offset=1)
+    try:
+        return GeminiProvider(parse_api_keys(os.getenv('LLM_HEDGE_API_KEY', '')) or api_keys, model=model)
+    except Exception as error:
+        logger.error(f"初始化对冲 LLM 客户端失败: {error}")
+        return None
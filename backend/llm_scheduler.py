@@ -0,0 +1,202 @@
+"""
+LLM 配额调度：按每分钟请求数（RPM）与每分钟 token 数（TPM）限流的令牌桶 + 优先级排队
+
+- 配额不足时请求按优先级排队等待，而不是直接打到 Gemini 触发 429
+- 同优先级先到先得；等待超过预算时抛出 QuotaWaitTimeout，由调用方回退到本地结果
+"""
+
+import re
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Dict, Optional
+
+# 优先级：数值越小越优先
+PRIORITY_INTERACTIVE = 0   # 用户实时占卜
+PRIORITY_INCENSE = 1       # 上香触发的每日运势
+PRIORITY_BACKGROUND = 2    # 后台预热
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_INCENSE: "incense",
+    PRIORITY_BACKGROUND: "background",
+}
+
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符约 1 token/字，其余约 4 字符/token"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class QuotaWaitTimeout(Exception):
+    """排队等待配额超过等待预算"""
+
+
+class TokenBucket:
+    """令牌桶：每分钟补充 per_minute 个令牌，容量为 capacity（允许的突发量）
+
+    超过容量的单次消耗在桶满时放行并全额扣除，余额变为负数，之后的调用等待补足欠额，
+    长期放行量仍不超过补充速率。
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """距离可以放行 amount 还需的秒数（调用前须先 refill）；超过容量的消耗只需等到桶满"""
+        missing = min(amount, self.capacity) - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float) -> None:
+        self.tokens -= amount
+
+
+class QuotaScheduler:
+    """RPM/TPM 双令牌桶调度器：严格按优先级放行，配额恢复时由定时器唤醒队首
+
+    rpm / tpm 为 0 表示不限制该维度。burst 为允许突发的配额比例（0.01-0.5）：桶容量取 burst 份额，
+    补充速率取其余份额，容量与每分钟补充量之和不超过配额，保证任意一分钟内放行量不超过配额，
+    流量平稳贴合上限而不是先冲后停。
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, max_wait: float = 10.0, burst: float = 0.1):
+        burst = min(max(burst, 0.01), 0.5)
+        self.buckets = []
+        for kind, quota in (("requests", rpm), ("tokens", tpm)):
+            if quota > 0:
+                self.buckets.append((kind, self._bucket(quota, burst)))
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+        # 等待队列：(优先级, 序号, token 数, future)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {
+            "granted": 0,
+            "queued": 0,
+            "timeouts": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
+        self.granted_by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+
+    @staticmethod
+    def _bucket(quota: int, burst: float) -> TokenBucket:
+        """容量至少为 1（单次调用），补充速率为配额减去容量"""
+        capacity = max(1.0, quota * burst)
+        rate = quota - capacity
+        if rate <= 0:
+            # 配额仅 1：容量已占满配额，保守地每两分钟补充一次
+            rate = quota / 2
+        return TokenBucket(rate, capacity=capacity)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.buckets)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        for _, bucket in self.buckets:
+            bucket.refill(now)
+
+    def _wait_time(self, tokens: int) -> float:
+        amounts = {"requests": 1, "tokens": tokens}
+        return max((bucket.time_until(amounts[kind]) for kind, bucket in self.buckets), default=0.0)
+
+    def _take(self, tokens: int, priority: int) -> None:
+        amounts = {"requests": 1, "tokens": tokens}
+        for kind, bucket in self.buckets:
+            bucket.take(amounts[kind])
+        self.stats["granted"] += 1
+        self.granted_by_priority[PRIORITY_NAMES.get(priority, "background")] += 1
+
+    def try_acquire(self, tokens: int, priority: int = PRIORITY_BACKGROUND) -> bool:
+        """不排队地尝试获取配额（无人等待且配额充足时成功），用于对冲等可选调用"""
+        if not self.enabled:
+            return True
+        if self._waiters:
+            return False
+        self._refill()
+        if self._wait_time(tokens) > 0:
+            return False
+        self._take(tokens, priority)
+        return True
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """获取一次调用的配额；需要排队时按优先级等待，超过 max_wait 抛出 QuotaWaitTimeout"""
+        if self.try_acquire(tokens, priority):
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        self.stats["queued"] += 1
+        enqueued_at = time.perf_counter()
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # 超时的同时已获放行
+                return
+            self.stats["timeouts"] += 1
+            raise QuotaWaitTimeout(f"等待 LLM 配额超过 {self.max_wait} 秒")
+        finally:
+            if not future.done():
+                # 超时或被取消：标记作废，队首出队后唤醒后续等待者
+                future.cancel()
+                self._dispatch()
+            wait_ms = (time.perf_counter() - enqueued_at) * 1000
+            self.stats["wait_ms_total"] += wait_ms
+            self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], wait_ms)
+
+    def _dispatch(self) -> None:
+        """按优先级放行队首等待者，配额不足时设置定时器在恢复后再次放行"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiters:
+            priority, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._wait_time(tokens)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self._take(tokens, priority)
+            future.set_result(None)
+
+    def get_stats(self) -> Dict:
+        stats = self.stats
+        queued = stats["queued"]
+        return {
+            "enabled": self.enabled,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "max_wait_seconds": self.max_wait,
+            "available": {kind: round(bucket.tokens, 1) for kind, bucket in self.buckets},
+            "waiting": sum(1 for *_, future in self._waiters if not future.done()),
+            "granted": stats["granted"],
+            "granted_by_priority": dict(self.granted_by_priority),
+            "queued": queued,
+            "timeouts": stats["timeouts"],
+            "wait_ms_avg": round(stats["wait_ms_total"] / queued, 2) if queued else 0.0,
+            "wait_ms_max": round(stats["wait_ms_max"], 2),
+        }
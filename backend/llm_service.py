@@ -1,12 +1,26 @@
 import os
 import re
+import json
+import time
+import asyncio
+from bisect import bisect_left
+from collections import deque
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
-from google import genai
-from lunardate import LunarDate
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import logging
 from dotenv import load_dotenv
 
+import almanac
+import three_palace
+from cache import SingleFlight, TTLCache, next_local_midnight
+from llm_providers import LLMProvider, create_hedge_provider, create_provider, parse_api_keys
+from persistent_cache import SQLiteCacheStore
+from llm_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, QuotaScheduler, QuotaWaitTimeout, estimate_tokens
+from resilience import CircuitBreaker, CircuitOpenError, LatencyTracker
+from three_palace import HEXAGRAMS, HEXAGRAM_PINYIN
+
 # 加载环境变量
 load_dotenv()
 
@@ -15,7 +29,103 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# 结构化输出 schema：模型只输出一次结构化字段，无需重复的可读分段
+DIVINATION_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "divination": {"type": "STRING"},
+        "prediction": {"type": "STRING"},
+        "advice": {"type": "STRING"},
+        "luck": {"type": "INTEGER"},
+    },
+    "required": ["divination", "prediction", "advice", "luck"],
+}
+
+
+# 每日运势：LLM 只撰写各项说明，字段名 -> 运势项
+DAILY_FORTUNE_FIELDS = (
+    ("财运", "wealth"),
+    ("事业", "career"),
+    ("感情", "love"),
+    ("健康", "health"),
+    ("今日建议", "advice"),
+)
+DAILY_FORTUNE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {field: {"type": "STRING"} for _, field in DAILY_FORTUNE_FIELDS},
+    "required": [field for _, field in DAILY_FORTUNE_FIELDS],
+}
+
+
+# 可读分段：字段名 -> 支持的标题（中/英，按优先级排列）
+DIVINATION_SECTIONS = (
+    ("divination", ("【卦象解析】", "[Hexagram Analysis]", "Hexagram Analysis")),
+    ("prediction", ("【运势预测】", "[Prediction]", "Prediction")),
+    ("advice", ("【神明指引】", "[Divine Guidance]", "Divine Guidance")),
+)
+_DIVINATION_KEYS = ("divination", "prediction", "advice", "luck")
+
+# 预编译的解析模式
+# 评分模式：(预检子串, 模式)；casefold 后的文本不含任一预检子串时跳过该模式。
+# 关键词模式以字符类前瞻开头，让非候选位置快速失败（可选的 "overall" 前缀不影响捕获值，故省略）
+_LUCK_PATTERNS = (
+    (("score", "rating", "luck"), re.compile(r"(?=[slr])(?:score|rating|luck)[^\d]{0,10}(\d{1,2})(?:\s*/\s*10)?", re.IGNORECASE)),  # overall score: 7/10
+    (("/",), re.compile(r"(\d{1,2})\s*/\s*10")),  # 7/10
+    (("分",), re.compile(r"(\d{1,2})\s*分")),      # 7分
+)
+_LUCK_DECIMAL_RE = re.compile(r"(\d+(?:\.\d+)?)\s*/\s*10")
+_JSON_FENCE_RE = re.compile(r"```json\s*", re.IGNORECASE)
+_JSON_DECODER = json.JSONDecoder()
+
+
+@lru_cache(maxsize=32)
+def _section_scanner(titles: Tuple[str, ...]) -> "re.Pattern":
+    """分段扫描模式：任一标题，或段落边界字符【 / [
+
+    以各标题首字符组成的字符类前瞻开头，非候选位置无需逐个尝试标题分支。
+    """
+    alternatives = "|".join(re.escape(t) for t in sorted(titles, key=len, reverse=True))
+    first_chars = "".join(sorted({re.escape(t[0]) for t in titles if t} | {"【", r"\["}))
+    return re.compile(rf"(?=[{first_chars}])(?:(?P<title>{alternatives})|[【\[])", re.IGNORECASE)
+
+
+_ALL_SECTION_TITLES = tuple(t for _, titles in DIVINATION_SECTIONS for t in titles)
+
+
+def _scan_sections(text: str, titles: Tuple[str, ...] = _ALL_SECTION_TITLES) -> Tuple[Dict[str, int], List[int]]:
+    """单次扫描文本：记录每个标题首次出现的结束位置，以及所有段落边界（【 或 [）的位置"""
+    first_end: Dict[str, int] = {}
+    boundaries: List[int] = []
+    for m in _section_scanner(tuple(titles)).finditer(text):
+        token = m.group(0)
+        if token[0] in "【[":
+            boundaries.append(m.start())
+        if m.group("title") is not None:
+            first_end.setdefault(token.casefold(), m.end())
+    return first_end, boundaries
+
+
+def _section_text(text: str, scan: Tuple[Dict[str, int], List[int]], titles, require_end: bool = False) -> Optional[str]:
+    """按标题优先级取段落内容：从标题结束处到下一个段落边界（或文末）
+
+    require_end=True 时，标题之后尚未出现边界则视为段落未完成，返回 None。
+    """
+    first_end, boundaries = scan
+    for title in titles:
+        start = first_end.get(title.casefold())
+        if start is None:
+            continue
+        idx = bisect_left(boundaries, start)
+        if idx < len(boundaries):
+            return text[start:boundaries[idx]].strip()
+        return None if require_end else text[start:].strip()
+    return None
+
+
 class LLMService:
+    # 可读分段：字段名 -> 支持的标题（中/英）
+    DIVINATION_SECTIONS = DIVINATION_SECTIONS
+
     def __init__(self):
         # 强制重新加载环境变量
         load_dotenv()
@@ -42,118 +152,575 @@ class LLMService:
         logger.info(f"运行环境: {'Render' if is_render else '本地'}")
         logger.info("=== 调试信息结束 ===")
         
-        if not self.api_key:
-            logger.warning("GEMINI_API_KEY 环境变量未设置，将使用默认占卜结果")
-            self.client = None
-        else:
-            try:
-                # 使用新的 google-genai SDK，显式传入 API 密钥
-                self.client = genai.Client(api_key=self.api_key)
-                logger.info("LLM 客户端初始化成功")
-            except Exception as error:
-                logger.error(f"初始化 LLM 客户端失败: {error}")
-                self.client = None
+        # API 密钥池：GEMINI_API_KEYS（逗号分隔）优先，未设置时使用 GEMINI_API_KEY
+        self.api_keys = parse_api_keys(os.getenv('GEMINI_API_KEYS', ''), fallback=self.api_key)
+        logger.info(f"API 密钥数量: {len(self.api_keys)}")
+
+        # LLM 提供方（LLM_PROVIDER=gemini|mock）；为 None 时使用本地占卜结果
+        self.provider: Optional[LLMProvider] = create_provider(self.api_keys)
+
+        # LLM 异步执行配置：最大在途请求数（超出部分排队等待，不阻塞事件循环）
+        self.model_name = self.provider.model if self.provider else os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-lite')
+        self.max_in_flight = max(1, int(os.getenv('LLM_MAX_CONCURRENCY', '16')))
+        # 信号量延迟到首次调用时在运行中的事件循环内创建
+        self._llm_semaphore: Optional[asyncio.Semaphore] = None
+        self.llm_stats = {
+            "in_flight": 0,
+            "waiting": 0,
+            "started": 0,
+            "completed": 0,
+            "failed": 0,
+            "queue_wait_ms_total": 0.0,
+            "queue_wait_ms_max": 0.0,
+            "timeouts": 0,
+        }
+        # 最近的排队等待样本，用于计算分位数
+        self._queue_wait_samples = deque(maxlen=512)
+
+        # 单次 LLM 调用的截止时间（秒），超时计为失败
+        self.llm_timeout = float(os.getenv('LLM_TIMEOUT_SECONDS', '20'))
+        # 熔断器：连续失败达到阈值后直接使用本地结果，冷却后半开探测
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv('LLM_BREAKER_FAILURES', '5')),
+            recovery_timeout=float(os.getenv('LLM_BREAKER_RECOVERY_SECONDS', '30')),
+            half_open_max_calls=int(os.getenv('LLM_BREAKER_HALF_OPEN_CALLS', '1'))
+        )
+
+        # 配额调度：按 RPM/TPM 令牌桶放行，配额不足时按优先级排队（不超过等待预算）
+        # 多 worker 部署时各进程平分配额（SERVER_WORKERS 由生产启动器设置）
+        self.workers = max(1, int(os.getenv('SERVER_WORKERS', '1')))
+        self.quota = QuotaScheduler(
+            rpm=self._worker_share(int(os.getenv('LLM_QUOTA_RPM', '0'))),
+            tpm=self._worker_share(int(os.getenv('LLM_QUOTA_TPM', '0'))),
+            max_wait=float(os.getenv('LLM_QUOTA_MAX_WAIT_SECONDS', '10')),
+            burst=float(os.getenv('LLM_QUOTA_BURST', '0.1'))
+        )
+        # 预估的单次输出 token 数，计入 TPM
+        self.quota_output_tokens = int(os.getenv('LLM_QUOTA_OUTPUT_TOKENS', '600'))
+
+        # 对冲请求（可选）：主调用超过近期耗时的指定分位仍未返回时，向备用模型/密钥再发一次，取先返回者
+        self.hedge_enabled = os.getenv('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+        self.hedge_provider = create_hedge_provider(self.provider, self.api_keys) if self.hedge_enabled else None
+        self.hedge_percentile = float(os.getenv('LLM_HEDGE_PERCENTILE', '0.95'))
+        # 样本不足时使用固定的对冲延迟
+        self.hedge_min_samples = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+        self.hedge_default_delay_ms = float(os.getenv('LLM_HEDGE_DELAY_MS', '3000'))
+        # 对冲比例上限，控制额外调用成本
+        self.hedge_max_rate = float(os.getenv('LLM_HEDGE_MAX_RATE', '0.1'))
+        self.hedge_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "primary_wins": 0}
+        self._generate_latency = LatencyTracker()
+
+        # 占卜提示词模式：full（默认，完整知识库，由模型自行推算）/ compact（注入本地算定的三宫与生克，
+        # 吉凶评分、三宫与生克关系改由本地引擎给出，需显式开启）
+        self.prompt_mode = os.getenv('LLM_PROMPT_MODE', 'full').lower()
+        if self.prompt_mode not in ('full', 'compact'):
+            logger.warning(f"未知的 LLM_PROMPT_MODE: {self.prompt_mode}，使用 full")
+            self.prompt_mode = 'full'
+
+        # 结构化输出：使用 SDK 的 JSON response schema，解析只需一次 json.loads
+        self.structured_output = os.getenv('LLM_STRUCTURED_OUTPUT', 'false').lower() == 'true'
+        # 各解析路径的使用次数：structured / json_block / sections / failed
+        self.parse_stats = {"structured": 0, "json_block": 0, "sections": 0, "failed": 0}
+
+        # 磁盘缓存（SQLite WAL）：位于内存缓存之后，重启或休眠唤醒后仍可直接命中
+        self.cache_store = SQLiteCacheStore.from_env()
+
+        # 每日运势缓存：按日期键缓存至当日结束；生成失败时的回退结果仅缓存较短时间
+        self.daily_fortune_cache = TTLCache(maxsize=64, store=self.cache_store, namespace="daily_fortune")
+        self.daily_fortune_retry_seconds = int(os.getenv('DAILY_FORTUNE_RETRY_SECONDS', '60'))
+        self._daily_fortune_flight = SingleFlight()
+        # 每日运势趋势索引：日期缓存键 -> 吉/平/凶，运势生成时解析一次，上香时 O(1) 读取
+        self.daily_trends: Dict[str, str] = {}
+        # 后台生成任务的引用，避免任务被提前回收
+        self._background_tasks = set()
+
+        # 占卜结果缓存（LRU + TTL）与在途请求合并
+        self.divination_cache = TTLCache(
+            maxsize=int(os.getenv('DIVINATION_CACHE_SIZE', '2048')),
+            default_ttl=int(os.getenv('DIVINATION_CACHE_TTL', '86400')),
+            store=self.cache_store,
+            namespace="divination",
+            disk_maxsize=int(os.getenv('DIVINATION_CACHE_DISK_SIZE', '20000')),
+        )
+        self._divination_flight = SingleFlight()
+        # 批量占卜：单个批次内同时调用 LLM 的最大条目数
+        self.batch_concurrency = max(1, int(os.getenv('DIVINATION_BATCH_CONCURRENCY', '8')))
         
-        # 六神配置
-        self.hexagrams = [
-            {"name": "大安", "element": "木", "meaning": "事事如意，心想事成", "luck": 9},
-            {"name": "留连", "element": "土", "meaning": "需要耐心等待，时机未到", "luck": 6},
-            {"name": "速喜", "element": "火", "meaning": "好事将至，喜事临门", "luck": 8},
-            {"name": "赤口", "element": "金", "meaning": "需要谨慎言行，避免冲突", "luck": 4},
-            {"name": "小吉", "element": "水", "meaning": "小有收获，稳中求进", "luck": 7},
-            {"name": "空亡", "element": "土", "meaning": "暂时困顿，需要调整方向", "luck": 3}
-        ]
+        # 六神配置（与本地三宫五行引擎共用）
+        self.hexagrams = HEXAGRAMS
         # 六神拼音（英文，按字分隔，全部小写）
-        self.hexagram_pinyin = {
-            "大安": "da an",
-            "留连": "liu lian",
-            "速喜": "su xi",
-            "赤口": "chi kou",
-            "小吉": "xiao ji",
-            "空亡": "kong wang",
+        self.hexagram_pinyin = HEXAGRAM_PINYIN
+
+    def _worker_share(self, quota: int) -> int:
+        """本进程分得的配额；0 表示不限制"""
+        return max(1, quota // self.workers) if quota > 0 else 0
+
+    def _get_llm_semaphore(self) -> asyncio.Semaphore:
+        """获取（必要时创建）限制 LLM 在途请求数的信号量"""
+        if self._llm_semaphore is None:
+            self._llm_semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._llm_semaphore
+
+    @asynccontextmanager
+    async def _llm_slot(self, tokens: int = 0, priority: int = PRIORITY_INTERACTIVE):
+        """占用一个 LLM 执行槽位：受熔断器、配额调度与最大在途数限制，并记录排队等待时间
+
+        熔断中直接抛出 CircuitOpenError（不排队），配额等待超出预算抛出 QuotaWaitTimeout，
+        调用方立即使用本地回退。
+        """
+        if not self.provider:
+            raise RuntimeError("LLM 客户端未初始化")
+
+        breaker = self.circuit_breaker
+        breaker.before_call()
+        semaphore = self._get_llm_semaphore()
+        stats = self.llm_stats
+        enqueued_at = time.perf_counter()
+        stats["waiting"] += 1
+        try:
+            await self.quota.acquire(tokens, priority)
+            await semaphore.acquire()
+        except BaseException:
+            breaker.release()
+            raise
+        finally:
+            stats["waiting"] -= 1
+
+        wait_ms = (time.perf_counter() - enqueued_at) * 1000
+        stats["started"] += 1
+        stats["queue_wait_ms_total"] += wait_ms
+        stats["queue_wait_ms_max"] = max(stats["queue_wait_ms_max"], wait_ms)
+        self._queue_wait_samples.append(wait_ms)
+
+        stats["in_flight"] += 1
+        try:
+            yield
+            stats["completed"] += 1
+            breaker.record_success()
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开等取消不代表服务端故障，不计入熔断
+            stats["failed"] += 1
+            breaker.release()
+            raise
+        except BaseException:
+            stats["failed"] += 1
+            breaker.record_failure()
+            raise
+        finally:
+            stats["in_flight"] -= 1
+            semaphore.release()
+
+    def estimate_call_tokens(self, prompt: str) -> int:
+        """预估一次调用消耗的 token 数（提示词 + 预估输出），用于 TPM 配额"""
+        return estimate_tokens(prompt) + self.quota_output_tokens
+
+    async def generate_text(self, prompt: str, json_schema: Optional[Dict] = None, priority: int = PRIORITY_INTERACTIVE) -> str:
+        """通过 LLM 提供方生成完整文本；json_schema 用于结构化输出，超过 llm_timeout 视为失败"""
+        tokens = self.estimate_call_tokens(prompt)
+        async with self._llm_slot(tokens, priority):
+            try:
+                return await asyncio.wait_for(self._generate(prompt, json_schema, tokens), timeout=self.llm_timeout)
+            except asyncio.TimeoutError:
+                self.llm_stats["timeouts"] += 1
+                raise
+
+    def hedge_delay_ms(self) -> float:
+        """对冲触发延迟：近期生成耗时的 hedge_percentile 分位，样本不足时使用固定值"""
+        if len(self._generate_latency) < self.hedge_min_samples:
+            return self.hedge_default_delay_ms
+        return self._generate_latency.percentile(self.hedge_percentile)
+
+    async def _generate(self, prompt: str, json_schema: Optional[Dict] = None, tokens: int = 0) -> str:
+        """调用提供方生成文本；启用对冲时，主调用超过延迟分位仍未返回则向备用提供方再发一次，取先成功者"""
+        started = time.perf_counter()
+        if not self.hedge_provider:
+            text = await self.provider.generate(prompt, json_schema=json_schema)
+            self._generate_latency.record((time.perf_counter() - started) * 1000)
+            return text
+
+        stats = self.hedge_stats
+        stats["requests"] += 1
+        tasks = [asyncio.ensure_future(self.provider.generate(prompt, json_schema=json_schema))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay_ms() / 1000)
+            if (not done and stats["hedged"] < self.hedge_max_rate * stats["requests"]
+                    and self.quota.try_acquire(tokens, PRIORITY_BACKGROUND)):
+                stats["hedged"] += 1
+                tasks.append(asyncio.ensure_future(self.hedge_provider.generate(prompt, json_schema=json_schema)))
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            stats["hedge_wins" if task is tasks[1] else "primary_wins"] += 1
+                        self._generate_latency.record((time.perf_counter() - started) * 1000)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # 取消未完成的一方；已完成的读取异常，避免未检索异常告警
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+    async def stream_text(self, prompt: str, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[str]:
+        """通过 LLM 提供方流式生成，逐块产出文本；整个流须在 llm_timeout 内结束"""
+        async with self._llm_slot(self.estimate_call_tokens(prompt), priority):
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.llm_timeout
+            chunks = self.provider.stream(prompt)
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        self.llm_stats["timeouts"] += 1
+                        raise
+                    yield chunk
+            finally:
+                await chunks.aclose()
+
+    def get_llm_stats(self) -> Dict:
+        """返回 LLM 执行层指标（在途数、排队数、排队等待耗时）"""
+        stats = self.llm_stats
+        samples = sorted(self._queue_wait_samples)
+        started = stats["started"]
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+        return {
+            "provider": self.provider.name if self.provider else None,
+            "model": self.model_name,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": stats["in_flight"],
+            "waiting": stats["waiting"],
+            "started": started,
+            "completed": stats["completed"],
+            "failed": stats["failed"],
+            "queue_wait_ms_avg": round(stats["queue_wait_ms_total"] / started, 2) if started else 0.0,
+            "queue_wait_ms_p95": round(percentile(0.95), 2),
+            "queue_wait_ms_max": round(stats["queue_wait_ms_max"], 2),
+            "timeout_seconds": self.llm_timeout,
+            "timeouts": stats["timeouts"],
+            "keys": self.provider.key_stats() if self.provider else [],
+            "circuit_breaker": self.circuit_breaker.stats(),
+            "hedge": self.get_hedge_stats(),
+            "quota": self.quota.get_stats(),
+            "structured_output": self.structured_output,
+            "parse_paths": dict(self.parse_stats),
+        }
+
+    def get_hedge_stats(self) -> Dict:
+        """返回对冲请求指标：对冲比例与胜出次数"""
+        stats = self.hedge_stats
+        requests = stats["requests"]
+        return {
+            "enabled": self.hedge_provider is not None,
+            "model": self.hedge_provider.model if self.hedge_provider else None,
+            "delay_ms": round(self.hedge_delay_ms(), 1),
+            "requests": requests,
+            "hedged": stats["hedged"],
+            "hedge_rate": round(stats["hedged"] / requests, 4) if requests else 0.0,
+            "hedge_wins": stats["hedge_wins"],
+            "primary_wins": stats["primary_wins"],
+        }
+
+    def get_cache_stats(self) -> Dict:
+        """返回各级缓存的命中统计"""
+        return {
+            "divination": {
+                **self.divination_cache.stats(),
+                **self._divination_flight.stats(),
+            },
+            "daily_fortune": {
+                **self.daily_fortune_cache.stats(),
+                **self._daily_fortune_flight.stats(),
+            },
+            "disk": self.cache_store.stats() if self.cache_store else None,
         }
 
     def luck_to_text(self, luck: int) -> str:
         """将 luck 数值转换为吉凶文本"""
-        if luck >= 9:
-            return "大吉"
-        if luck >= 8:
-            return "中吉"
-        if luck >= 7:
-            return "小吉"
-        if luck >= 6:
-            return "平吉"
-        if luck >= 4:
-            return "小凶"
-        return "大凶"
+        return three_palace.luck_to_text(luck)
 
     def compute_palaces(self, numbers: List[int]) -> List[Dict]:
         """根据三个数字计算人/事/应三宫的六神信息（含拼音）"""
-        positions = ["ren", "shi", "ying"]
-        palaces = []
-        for idx, n in enumerate(numbers[:3]):
-            remainder = n % 6
-            # 余数为0 视为第6宫
-            index = 5 if remainder == 0 else (remainder - 1)
-            info = self.hexagrams[index]
-            name = info["name"]
-            palaces.append({
-                "name": name,
-                "pinyin": self.hexagram_pinyin.get(name, ""),
-                "element": info["element"],
-                "position": positions[idx],
-            })
-        return palaces
-
-    async def perform_divination(self, wish: str, numbers: List[int], language: str = 'zh') -> Dict:
-        """执行小六壬占卜"""
-        # 如果没有 API 客户端，直接返回默认结果
-        if not self.client:
-            logger.info("使用默认占卜结果（API 客户端未初始化）")
-            return self.get_default_divination(wish, numbers, language=language)
-            
-        try:
-            logger.info(f"开始调用 LLM API 进行占卜：愿望='{wish}', 数字={numbers}")
-            prompt = self.build_divination_prompt(wish, numbers, language=language)
-            
-            if language == 'en':
-                system_prompt = (
-                    "You are an AI divination analyst specialized in the ‘Three Palaces Five Elements’ method. "
-                    "Your only task is to take three numbers (1–99) and a concrete wish, "
-                    "apply the traditional Chinese Xiao Liu Ren method to analyze, and output a structured, insightful report."
-                )
-            else:
-                system_prompt = "你是一位精通「三宫五行法」的AI术数分析师。你的**唯一任务**是接收用户提供的**三个1-99之间的数字**和**一个具体的愿望**，运用中国古代的小六壬「三宫五行占算法」来进行测算，进而给出与财富、运势等相关的结果和建议,进行深度分析，并输出一份结构化的、富有洞见的解读报告。"
-            full_prompt = f"{system_prompt}\n\n{prompt}"
-            
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash-lite",
-                contents=full_prompt
+        return [dict(p) for p in three_palace.get_reading(numbers)["palaces"]]
+
+    def local_luck(self, numbers: List[int]) -> int:
+        """本地三宫五行引擎计算的运势评分"""
+        return three_palace.get_reading(numbers)["luck"]
+
+    def get_divination_system_prompt(self, language: str = 'zh') -> str:
+        """占卜系统提示词（中英）"""
+        if language == 'en':
+            return (
+                "You are an AI divination analyst specialized in the ‘Three Palaces Five Elements’ method. "
+                "Your only task is to take three numbers (1–99) and a concrete wish, "
+                "apply the traditional Chinese Xiao Liu Ren method to analyze, and output a structured, insightful report."
             )
+        return "你是一位精通「三宫五行法」的AI术数分析师。你的**唯一任务**是接收用户提供的**三个1-99之间的数字**和**一个具体的愿望**，运用中国古代的小六壬「三宫五行占算法」来进行测算，进而给出与财富、运势等相关的结果和建议,进行深度分析，并输出一份结构化的、富有洞见的解读报告。"
 
-            logger.info("LLM API 调用成功，正在解析结果")
-            result = response.text
-            logger.info(f"AI 原始返回内容: {result}")
-            parsed_result = self.parse_divination_result(result, language=language)
-            # 增补结构化字段：luck_text、palaces（三宫）
+    def finalize_divination(self, parsed_result: Dict, numbers: List[int], language: str = 'zh') -> Dict:
+        """增补结构化字段：luck_text、palaces（三宫）、full_text，模型未提供时使用本地计算
+
+        精简提示词模式下评分与三宫由本地引擎算定，模型只负责文字解读。
+        """
+        if not parsed_result.get("success"):
+            return parsed_result
+        if self.prompt_mode == 'compact':
+            reading = three_palace.get_reading(numbers)
+            parsed_result["luck"] = reading["luck"]
+            parsed_result["luck_text"] = reading["luck_text"]
+            parsed_result["palaces"] = [dict(p) for p in reading["palaces"]]
+            parsed_result["relations"] = [dict(r) for r in reading["relations"]]
+        else:
             try:
                 lv = int(parsed_result.get("luck", 7))
             except Exception:
                 lv = 7
-            # 若模型未提供，则补充本地计算
             if not parsed_result.get("luck_text"):
                 parsed_result["luck_text"] = self.luck_to_text(lv)
             if not parsed_result.get("palaces"):
                 parsed_result["palaces"] = self.compute_palaces(numbers)
-            logger.info("LLM AI 占卜结果解析完成")
-            logger.info(f"解析后的结果: {parsed_result}")
-            return parsed_result
-        
+        if not parsed_result.get("full_text"):
+            parsed_result["full_text"] = self.format_full_text(parsed_result, language=language)
+        return parsed_result
+
+    def divination_cache_key(self, wish: str, numbers: List[int], language: str = 'zh') -> str:
+        """占卜结果缓存键：规范化愿望 + 三宫六神 + 语言（数字不同但三宫相同视为同一占卜）"""
+        normalized_wish = " ".join(wish.split()).casefold()
+        palaces = "|".join(p["name"] for p in self.compute_palaces(numbers))
+        return f"divination:{language}:{palaces}:{normalized_wish}"
+
+    async def perform_divination(self, wish: str, numbers: List[int], language: str = 'zh', mode: str = 'llm',
+                                 priority: int = PRIORITY_INTERACTIVE) -> Dict:
+        """执行小六壬占卜：相同占卜命中结果缓存，或合并到正在进行的同一请求
+
+        mode='local' 时直接使用本地三宫五行引擎，不调用 LLM。
+        """
+        if mode == 'local':
+            return self.get_default_divination(wish, numbers, language=language)
+
+        # 如果没有 LLM 提供方，直接返回默认结果
+        if not self.provider:
+            logger.info("使用默认占卜结果（API 客户端未初始化）")
+            return self.get_default_divination(wish, numbers, language=language)
+
+        cache_key = self.divination_cache_key(wish, numbers, language)
+        cached = await self.divination_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+
+        try:
+            result = await self._divination_flight.do(
+                cache_key, lambda: self._generate_and_cache_divination(wish, numbers, language, cache_key, priority)
+            )
+            return dict(result)
+        except (CircuitOpenError, QuotaWaitTimeout) as error:
+            logger.info(f"{error}")
+            return self.get_default_divination(wish, numbers, language=language)
         except Exception as error:
-            logger.error(f"LLM API 调用失败: {error}")
+            logger.error(f"LLM API 调用失败: {error!r}")
             logger.info("回退到默认占卜结果")
             return self.get_default_divination(wish, numbers, language=language)
 
+    async def _generate_and_cache_divination(self, wish: str, numbers: List[int], language: str, cache_key: str,
+                                             priority: int = PRIORITY_INTERACTIVE) -> Dict:
+        """调用 LLM 生成占卜结果，解析成功后写入结果缓存"""
+        logger.info(f"开始调用 LLM API 进行占卜：愿望='{wish}', 数字={numbers}")
+        if self.structured_output:
+            full_prompt = self.build_llm_prompt(wish, numbers, language=language, structured=True)
+            result = await self.generate_text(full_prompt, json_schema=DIVINATION_RESPONSE_SCHEMA, priority=priority)
+        else:
+            full_prompt = self.build_llm_prompt(wish, numbers, language=language)
+            result = await self.generate_text(full_prompt, priority=priority)
+
+        logger.info("LLM API 调用成功，正在解析结果")
+        logger.info(f"AI 原始返回内容: {result}")
+        if self.structured_output:
+            parsed_result = self.parse_structured_result(result, language=language)
+        else:
+            parsed_result = self.parse_divination_result(result, language=language)
+        parsed_result = self.finalize_divination(parsed_result, numbers, language=language)
+        logger.info("LLM AI 占卜结果解析完成")
+        logger.info(f"解析后的结果: {parsed_result}")
+        if parsed_result.get("success"):
+            self.divination_cache.set(cache_key, parsed_result)
+        return parsed_result
+
+    async def iter_divination_batch(self, items: List[Tuple[str, List[int], str, str]],
+                                    priority: int = PRIORITY_BACKGROUND) -> AsyncIterator[Tuple[List[int], Dict]]:
+        """批量占卜：items 为 (愿望, 数字, 语言, 模式) 列表
+
+        相同条目（同一缓存键与模式）只计算一次，以 batch_concurrency 为上限并发调用 LLM，
+        按完成顺序产出 (对应的条目下标列表, 结果)。
+        """
+        groups: Dict[str, List[int]] = {}
+        for index, (wish, numbers, language, mode) in enumerate(items):
+            key = f"{mode}:{self.divination_cache_key(wish, numbers, language)}"
+            groups.setdefault(key, []).append(index)
+
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def run(indexes: List[int]) -> Tuple[List[int], Dict]:
+            wish, numbers, language, mode = items[indexes[0]]
+            async with semaphore:
+                try:
+                    result = await self.perform_divination(wish, numbers, language=language, mode=mode, priority=priority)
+                except Exception as error:
+                    logger.error(f"批量占卜条目失败: {error!r}")
+                    result = {"success": False, "error": f"占卜服务异常: {error}"}
+            return indexes, result
+
+        tasks = [asyncio.ensure_future(run(indexes)) for indexes in groups.values()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 客户端断开时取消尚未完成的条目
+            for task in tasks:
+                task.cancel()
+
+    async def stream_divination(self, wish: str, numbers: List[int], language: str = 'zh', mode: str = 'llm') -> AsyncIterator[Tuple[str, Dict]]:
+        """流式占卜：依次产出 (事件名, 数据)
+
+        - palaces: 本地计算的三宫与吉凶文本（首个事件，无需等待 LLM）
+        - section: 【卦象解析】/【运势预测】/【神明指引】 各段生成完毕即产出
+        - result: 最终解析结果（与 perform_divination 返回结构一致）
+        """
+        luck = self.local_luck(numbers)
+        yield "palaces", {
+            "palaces": self.compute_palaces(numbers),
+            "luck": luck,
+            "luck_text": self.luck_to_text(luck),
+        }
+
+        emitted = set()
+        result = None
+        cache_key = self.divination_cache_key(wish, numbers, language)
+        use_llm = bool(self.provider) and mode != 'local'
+        cached = await self.divination_cache.get(cache_key) if use_llm else None
+        if cached is not None:
+            result = dict(cached)
+        elif use_llm:
+            buffer = ""
+            try:
+                logger.info(f"开始流式调用 LLM API 进行占卜：愿望='{wish}', 数字={numbers}")
+                full_prompt = self.build_llm_prompt(wish, numbers, language=language)
+                async for chunk in self.stream_text(full_prompt):
+                    buffer += chunk
+                    scan = _scan_sections(buffer)
+                    for key, titles in self.DIVINATION_SECTIONS:
+                        if key in emitted:
+                            continue
+                        text = _section_text(buffer, scan, titles, require_end=True)
+                        if text is not None:
+                            emitted.add(key)
+                            yield "section", {"key": key, "text": text}
+                result = self.finalize_divination(
+                    self.parse_divination_result(buffer, language=language), numbers, language=language
+                )
+                if result.get("success"):
+                    self.divination_cache.set(cache_key, result)
+            except (CircuitOpenError, QuotaWaitTimeout) as error:
+                logger.info(f"{error}")
+            except Exception as error:
+                logger.error(f"LLM 流式调用失败: {error!r}")
+                logger.info("回退到默认占卜结果")
+
+        if result is None:
+            result = self.get_default_divination(wish, numbers, language=language)
+
+        # 补发尚未产出的分段（流结束或回退时）
+        for key, _ in self.DIVINATION_SECTIONS:
+            if key not in emitted and result.get(key):
+                yield "section", {"key": key, "text": result[key]}
+        yield "result", result
+
+    def build_llm_prompt(self, wish: str, numbers: List[int], language: str = 'zh', mode: Optional[str] = None, structured: bool = False) -> str:
+        """按提示词模式构建发送给 LLM 的完整提示词（full: 系统提示 + 完整知识库；compact: 预计算精简版）
+
+        structured=True 时要求模型按 JSON schema 输出字段，而非可读分段。
+        """
+        if (mode or self.prompt_mode) == 'compact':
+            return self.build_compact_divination_prompt(wish, numbers, language=language, structured=structured)
+        prompt = self.build_divination_prompt(wish, numbers, language=language)
+        full_prompt = f"{self.get_divination_system_prompt(language)}\n\n{prompt}"
+        if structured:
+            if language == 'en':
+                full_prompt += "\nIgnore the section layout above: respond only with the JSON fields divination, prediction, advice and luck, each filled once.\n"
+            else:
+                full_prompt += "\n请忽略上述分段格式：仅以 JSON 输出 divination、prediction、advice、luck 四个字段，每项内容只写一次。\n"
+        return full_prompt
+
+    def build_compact_divination_prompt(self, wish: str, numbers: List[int], language: str = 'zh', structured: bool = False) -> str:
+        """构建精简占卜提示词：注入本地算定的三宫与生克判词，只请模型撰写情景化解读"""
+        reading = three_palace.get_reading(numbers)
+        palaces = reading["palaces"]
+        relations = reading["relations"]
+        if language == 'en':
+            palace_lines = "\n".join(
+                f"- {label}: {three_palace.HEXAGRAM_EN[p['name']][0]} "
+                f"({three_palace.ELEMENT_EN[p['element']]}; {three_palace.HEXAGRAM_EN[p['name']][1]})"
+                for label, p in zip(("Person", "Matter", "Outcome"), palaces)
+            )
+            relation_lines = "\n".join(
+                f"{n}) {title}: {r['phrase_en']}, meaning '{r['verdict_en']}'"
+                for n, ((_, _, _, title), r) in enumerate(zip(three_palace.PAIRS, relations), start=1)
+            )
+            return (
+                "You are a Xiao Liu Ren 'Three Palaces Five Elements' divination analyst. "
+                "The palaces and element relationships below are already computed; do not recompute them. "
+                "Write situational interpretations tied to the user's wish.\n\n"
+                f"Palaces:\n{palace_lines}\n\nRelationships:\n{relation_lines}\n"
+                f"Overall luck: {reading['luck']}/10\n\n"
+                + (
+                    "Respond in JSON (no emojis, no exact dates): divination = three lines interpreting "
+                    "Person vs Matter, Person vs Outcome and Matter vs Outcome; prediction = fortune forecast; "
+                    f"advice = practical guidance; luck = {reading['luck']}.\n\n"
+                    if structured else
+                    "Output plain text in exactly these sections (no JSON, no emojis, no exact dates):\n"
+                    "[Hexagram Analysis]\n1) Person vs Matter: …\n2) Person vs Outcome: …\n3) Matter vs Outcome: …\n"
+                    "[Prediction]\n…\n[Divine Guidance]\n…\n\n"
+                ) +
+                f"User wish: {wish}\n"
+            )
+
+        palace_lines = "\n".join(
+            f"- {label}：{p['name']}（{p['element']}，{three_palace.HEXAGRAM_KEYWORDS[p['name']]}）"
+            for label, p in zip(("人宫", "事宫", "应宫"), palaces)
+        )
+        relation_lines = "\n".join(
+            f"{n}. {title}：{r['phrase']}，主「{r['verdict']}」"
+            for n, ((_, _, title, _), r) in enumerate(zip(three_palace.PAIRS, relations), start=1)
+        )
+        return (
+            "你是精通小六壬「三宫五行占算法」的术数分析师。以下三宫与五行生克已由系统算定，请勿重新推算，"
+            "只需紧密结合用户愿望撰写情景化解读。\n\n"
+            f"三宫：\n{palace_lines}\n\n生克：\n{relation_lines}\n"
+            f"综合评分：{reading['luck']}/10（{reading['luck_text']}）\n\n"
+            + (
+                "请以 JSON 输出（不要 emoji、具体年月日或任何数字推算过程）：divination 为三行，依次解读人 vs 事、"
+                f"人 vs 应、事 vs 应；prediction 为运势预测；advice 为神明指引；luck 为 {reading['luck']}。\n\n"
+                if structured else
+                "请严格按以下分段输出纯文本，不要输出 JSON、emoji、具体年月日或任何数字推算过程：\n"
+                "【卦象解析】\n1. 您与事情的关系 (人 vs 事)：…\n2. 您与结果的关系 (人 vs 应)：…\n3. 事情与结果的关系 (事 vs 应)：…\n"
+                "【运势预测】\n…\n【神明指引】\n…\n\n"
+            ) +
+            f"用户愿望：{wish}\n"
+        )
+
     def build_divination_prompt(self, wish: str, numbers: List[int], language: str = 'zh') -> str:
         """构建占卜提示词（中英双语），要求产出可读分段 + 机器可读 JSON（含 luck_text, palaces）。
 
@@ -338,48 +905,72 @@ JSON 约束：
         tail = f"\n用户愿望：{wish}\n三个数字：{', '.join(map(str, numbers))}\n"
         return base + tail
 
+    def parse_structured_result(self, result: str, language: str = 'zh') -> Dict:
+        """解析结构化输出（JSON response schema）：单次 json.loads，失败时回退到文本解析"""
+        try:
+            data = json.loads(result)
+        except (TypeError, ValueError):
+            data = None
+        if not isinstance(data, dict) or not any(k in data for k in ("divination", "prediction", "advice")):
+            logger.warning("结构化输出解析失败，回退到文本解析")
+            return self.parse_divination_result(result, language=language)
+
+        self.parse_stats["structured"] += 1
+        # 结构化输出不含可读全文，由 finalize_divination 按最终字段拼出
+        return self._result_from_json(data, None)
+
+    def format_full_text(self, result: Dict, language: str = 'zh') -> str:
+        """由结构化字段拼出可读全文（与分段输出格式一致）"""
+        if language == 'en':
+            return (
+                f"[Hexagram Analysis]\n{result.get('divination', '')}\n\n[Prediction]\n{result.get('prediction', '')}\n\n"
+                f"[Divine Guidance]\n{result.get('advice', '')}\n\n[Fortune Level]\nOverall score: {result.get('luck', 7)}/10"
+            )
+        return (
+            f"【卦象解析】\n{result.get('divination', '')}\n\n【运势预测】\n{result.get('prediction', '')}\n\n"
+            f"【神明指引】\n{result.get('advice', '')}\n\n【吉凶判断】\n总体运势评分：{result.get('luck', 7)}/10分"
+        )
+
+    def _result_from_json(self, json_data: Dict, full_text: Optional[str]) -> Dict:
+        """将模型输出的 JSON 对象规范化为占卜结果"""
+        divination = str(json_data.get("divination", "")).strip()
+        prediction = str(json_data.get("prediction", "")).strip()
+        advice = str(json_data.get("advice", "")).strip()
+        try:
+            luck_val = int(json_data.get("luck", 7))
+        except Exception:
+            luck_val = 7
+        luck_val = max(1, min(10, luck_val))
+
+        # 可选字段：luck_text / palaces（若存在则透传）
+        luck_text = str(json_data.get("luck_text", "")).strip() or None
+        palaces = json_data.get("palaces") if isinstance(json_data.get("palaces"), list) else None
+
+        return {
+            "success": True,
+            "divination": divination,
+            "prediction": prediction,
+            "advice": advice,
+            "luck": luck_val,
+            **({"luck_text": luck_text} if luck_text else {}),
+            **({"palaces": palaces} if palaces else {}),
+            "full_text": full_text
+        }
+
     def parse_divination_result(self, result: str, language: str = 'zh') -> Dict:
         """解析占卜结果：优先解析 JSON，其次解析分段与 luck 文本"""
         try:
             # 1) 优先尝试解析 JSON 代码块
             json_data = self.extract_json_block(result)
             if json_data:
-                divination = str(json_data.get("divination", "")).strip()
-                prediction = str(json_data.get("prediction", "")).strip()
-                advice = str(json_data.get("advice", "")).strip()
-                try:
-                    luck_val = int(json_data.get("luck", 7))
-                except Exception:
-                    luck_val = 7
-                luck_val = max(1, min(10, luck_val))
-
-                # 可选字段：luck_text / palaces（若存在则透传）
-                luck_text = str(json_data.get("luck_text", "")).strip() or None
-                palaces = json_data.get("palaces") if isinstance(json_data.get("palaces"), list) else None
-
-                return {
-                    "success": True,
-                    "divination": divination,
-                    "prediction": prediction,
-                    "advice": advice,
-                    "luck": luck_val,
-                    **({"luck_text": luck_text} if luck_text else {}),
-                    **({"palaces": palaces} if palaces else {}),
-                    "full_text": result
-                }
+                self.parse_stats["json_block"] += 1
+                return self._result_from_json(json_data, result)
 
             # 2) 正常解析可读分段
-            div_keys = ["【卦象解析】", "[Hexagram Analysis]", "Hexagram Analysis"]
-            pre_keys = ["【运势预测】", "[Prediction]", "Prediction"]
-            adv_keys = ["【神明指引】", "[Divine Guidance]", "Divine Guidance"]
-
-            sections = {
-                "divination": self.extract_section(result, div_keys),
-                "prediction": self.extract_section(result, pre_keys),
-                "advice": self.extract_section(result, adv_keys),
-                "luck": self.extract_luck_score(result)
-            }
+            sections = self.extract_sections(result)
+            sections["luck"] = self.extract_luck_score(result)
 
+            self.parse_stats["sections"] += 1
             return {
                 "success": True,
                 **sections,
@@ -387,6 +978,7 @@ JSON 约束：
             }
         except Exception as error:
             logger.error(f"解析占卜结果失败: {error}")
+            self.parse_stats["failed"] += 1
             return {
                 "success": False,
                 "error": "解析结果失败"
@@ -395,253 +987,203 @@ JSON 约束：
     def extract_section(self, text: str, section_title) -> str:
         """提取文本段落，支持单个或多个标题（中/英）"""
         titles = section_title if isinstance(section_title, (list, tuple)) else [section_title]
-        for title in titles:
-            # 允许中文【】或英文[]或无括号
-            escaped = re.escape(title).replace("\\[", "[[]").replace("\\]", "[]]")
-            pattern = rf"{escaped}([\s\S]*?)(?=【|\[|$)"
-            match = re.search(pattern, text, flags=re.IGNORECASE)
-            if match:
-                return match.group(1).strip()
-        return ""
+        return _section_text(text, _scan_sections(text, titles), titles) or ""
+
+    def extract_completed_section(self, text: str, section_title) -> Optional[str]:
+        """流式场景下提取已完整生成的段落：标题之后已出现下一个【或[ 才视为完成"""
+        titles = section_title if isinstance(section_title, (list, tuple)) else [section_title]
+        return _section_text(text, _scan_sections(text, titles), titles, require_end=True)
+
+    def extract_sections(self, text: str) -> Dict[str, str]:
+        """一次扫描提取全部可读分段（卦象解析 / 运势预测 / 神明指引）"""
+        scan = _scan_sections(text)
+        return {key: _section_text(text, scan, titles) or "" for key, titles in self.DIVINATION_SECTIONS}
 
     def extract_luck_score(self, text: str) -> int:
         """提取运势评分（更鲁棒）：支持 /10、分、score、rating、luck 等关键词，允许小数取整"""
-        patterns = [
-            r"(?:overall\s*)?(?:score|rating|luck)[^\d]{0,10}(\d{1,2})(?:\s*/\s*10)?",  # overall score: 7/10
-            r"(\d{1,2})\s*/\s*10",                                                   # 7/10
-            r"(\d{1,2})\s*分"                                                           # 7分
-        ]
-        for pat in patterns:
-            m = re.search(pat, text, flags=re.IGNORECASE)
+        folded = text.casefold()
+        for guards, pattern in _LUCK_PATTERNS:
+            if not any(g in folded for g in guards):
+                continue
+            m = pattern.search(text)
             if m:
-                try:
-                    val = int(m.group(1))
-                    return max(1, min(10, val))
-                except Exception:
-                    continue
+                return max(1, min(10, int(m.group(1))))
         # 小数形式 6.5/10
-        m = re.search(r"(\d+(?:\.\d+)?)\s*/\s*10", text)
+        m = _LUCK_DECIMAL_RE.search(text) if "/" in text else None
         if m:
-            try:
-                val = int(round(float(m.group(1))))
-                return max(1, min(10, val))
-            except Exception:
-                pass
+            return max(1, min(10, int(round(float(m.group(1))))))
         return 7
 
     def extract_json_block(self, text: str) -> Optional[Dict]:
-        """从文本中提取 JSON（优先 ```json 代码块; 其次第一个花括号对象）"""
-        import json
-        # 优先三引号 json 代码块
-        fence = re.search(r"```json\s*([\s\S]*?)```", text, flags=re.IGNORECASE)
+        """从文本中提取 JSON（优先 ```json 代码块; 其次从左到右第一个含占卜字段的花括号对象）"""
+        # 优先三引号 json 代码块：从代码块起点直接解码，不依赖结尾的 ```
+        fence = _JSON_FENCE_RE.search(text)
         if fence:
             try:
-                return json.loads(fence.group(1).strip())
-            except Exception:
-                pass
-        # 次选：第一个大括号对象（尽量不贪婪）
-        brace = re.search(r"\{[\s\S]*\}", text)
-        if brace:
-            blob = brace.group(0)
-            # 尝试限制为只包含我们关心的四个键，移除可能的结尾多余字符
-            try:
-                data = json.loads(blob)
-                if isinstance(data, dict) and any(k in data for k in ("divination","prediction","advice","luck")):
+                data, _ = _JSON_DECODER.raw_decode(text, fence.end())
+                if isinstance(data, dict):
                     return data
-            except Exception:
+            except ValueError:
                 pass
+        # 次选：逐个花括号位置尝试解码，取第一个包含占卜字段的对象
+        start = text.find("{")
+        while start != -1:
+            try:
+                data, end = _JSON_DECODER.raw_decode(text, start)
+            except ValueError:
+                start = text.find("{", start + 1)
+                continue
+            if isinstance(data, dict) and any(k in data for k in _DIVINATION_KEYS):
+                return data
+            start = text.find("{", end)
         return None
 
     def get_default_divination(self, wish: str, numbers: List[int], language: str = 'zh') -> Dict:
-        """获取默认占卜结果（当API失败时使用, 中英）"""
-        num1, num2, num3 = numbers
-        sum_numbers = sum(numbers)
-        remainder = sum_numbers % 6
-        
-        hexagram = self.hexagrams[remainder]
-        palaces = self.compute_palaces(numbers)
-        luck_text = self.luck_to_text(hexagram['luck'])
-        if language == 'en':
-            return {
-                "success": True,
-                "divination": f"Based on your numbers {num1}, {num2}, {num3}, the hexagram indicates '{hexagram['name']}'. It suggests: {hexagram['meaning']}.",
-                "prediction": f"Regarding your wish '{wish}', {self.generate_prediction_en(hexagram['luck'])}",
-                "advice": f"Divine guidance: {self.generate_advice_en(hexagram['luck'])}",
-                "luck": hexagram['luck'],
-                "luck_text": luck_text,
-                "palaces": palaces,
-                "full_text": (
-                    f"[Hexagram Analysis]\nBased on your numbers {num1}, {num2}, {num3}, the hexagram indicates '{hexagram['name']}'.\n\n"
-                    f"[Prediction]\n{self.generate_prediction_en(hexagram['luck'])}\n\n"
-                    f"[Divine Guidance]\n{self.generate_advice_en(hexagram['luck'])}\n\n"
-                    f"[Fortune Level]\nOverall score: {hexagram['luck']}/10"
-                )
-            }
-        else:
-            return {
-                "success": True,
-                "divination": f"根据您选择的数字 {num1}、{num2}、{num3}，推算得出「{hexagram['name']}」卦象。此卦象预示着{hexagram['meaning']}。",
-                "prediction": f"您的愿望「{wish}」在当前时运下，{self.generate_prediction(hexagram['luck'])}",
-                "advice": f"神明指引：{self.generate_advice(hexagram['luck'])}",
-                "luck": hexagram['luck'],
-                "luck_text": luck_text,
-                "palaces": palaces,
-                "full_text": f"【卦象解析】\n根据您选择的数字 {num1}、{num2}、{num3}，推算得出「{hexagram['name']}」卦象。\n\n【运势预测】\n您的愿望在当前时运下，{self.generate_prediction(hexagram['luck'])}\n\n【神明指引】\n{self.generate_advice(hexagram['luck'])}\n\n【吉凶判断】\n总体运势评分：{hexagram['luck']}/10分"
-            }
+        """获取默认占卜结果（本地三宫五行引擎，API 不可用或失败时使用, 中英）"""
+        return three_palace.divine(wish, numbers, language=language)
 
-    def generate_prediction_en(self, luck: int) -> str:
-        if luck >= 8:
-            return "high likelihood of success; timing is ripe to act."
-        elif luck >= 6:
-            return "some chance of success; patience is needed until timing aligns."
-        elif luck >= 4:
-            return "challenges present; proceed cautiously and adjust strategy."
-        else:
-            return "significant headwinds; pause plans and seek alternatives."
-
-    def generate_advice_en(self, luck: int) -> str:
-        if luck >= 8:
-            return "Stay sincere and kind; continued good deeds will bring fulfillment."
-        elif luck >= 6:
-            return "Be patient and steady; keep making efforts as timing matures."
-        elif luck >= 4:
-            return "Adjust mindset and resolve obstacles; prayers/incense may help."
-        else:
-            return "Low fortune currently; do good deeds and wait for a turn of luck."
-
-    def generate_prediction(self, luck: int) -> str:
-        """生成预测文本"""
-        if luck >= 8:
-            return "实现的可能性很高，时机已经成熟，可以积极行动。"
-        elif luck >= 6:
-            return "有一定的实现可能，需要耐心等待合适的时机。"
-        elif luck >= 4:
-            return "面临一些挑战，需要谨慎处理，调整策略。"
-        else:
-            return "当前阻力较大，建议暂缓行动，寻求其他途径。"
-
-    def generate_advice(self, luck: int) -> str:
-        """生成建议文本"""
-        if luck >= 8:
-            return "诚心祈福，保持善念，您的愿望将会实现。建议多行善事，积累福德。"
-        elif luck >= 6:
-            return "保持耐心，坚持努力，时机成熟时自然水到渠成。建议多烧香祈福。"
-        elif luck >= 4:
-            return "需要调整心态，化解阻碍，可通过上香祈福来改善运势。"
-        else:
-            return "当前运势低迷，建议多行善事，上香祈福，等待时机转变。"
+    async def get_daily_fortune(self, date: Optional[datetime] = None, priority: int = PRIORITY_INTERACTIVE) -> Dict:
+        """获取每日运势：按日期缓存至当日结束，同一天的并发请求只触发一次生成
 
-    async def get_daily_fortune(self, date: Optional[datetime] = None) -> Dict:
-        """获取每日运势"""
-        try:
-            target_date = date or datetime.now()
-            date_string = target_date.strftime('%Y年%m月%d日')
-            
-            # 获取农历日期
-            try:
-                lunar = LunarDate.fromSolarDate(target_date.year, target_date.month, target_date.day)
-                lunar_date = f"{lunar.month}月{lunar.day}日"
-            except:
-                lunar_date = "农历吉日"
-            
-            prompt = f"""请根据今天的日期生成当日的运势情况。今天是{date_string}，农历{lunar_date}。
-
-请基于传统的中华民俗文化和五行理论，生成今日运势报告，包含以下方面：
-1. 总体运势评级（1-5星）
-2. 财运分析
-3. 事业运势
-4. 感情运势
-5. 健康运势
-6. 今日建议
-7. 幸运数字
-8. 幸运颜色
-9. 宜做的事情
-10. 忌做的事情
-
-请严格按照以下格式输出：
-
-黄道吉日
-{date_string}
-{lunar_date} [吉/平/凶]
-宜 [具体事项，用空格分隔]
-忌 [具体事项，用空格分隔]
-
-财运★★★★★
-[财运分析内容]
-
-事业★★★★☆
-[事业运势内容]
-
-感情★★★★☆
-[感情运势内容]
-
-健康★★★★★
-[健康运势内容]
-
-今日建议
-[具体建议内容]
-
-今日幸运
-幸运颜色: [颜色]
-幸运数字: [数字1], [数字2], [数字3]
-幸运方位: [方位]
-吉时: [时间段]
-
-请用传统的中式语言风格，保持庄重和神秘感。"""
-
-            system_prompt = "你是一位精通中国传统命理学的大师，擅长根据日期和农历信息提供详细的运势分析。请严格按照用户要求的格式输出，保持传统文化的庄重感。"
-            full_prompt = f"{system_prompt}\n\n{prompt}"
-            
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash-lite",
-                contents=full_prompt
+        priority 为 LLM 配额调度优先级（上香触发 / 后台预热使用较低优先级）。
+        """
+        target_date = date or datetime.now()
+        cache_key = self.get_daily_fortune_cache_key(target_date)
+        cached = await self.daily_fortune_cache.get(cache_key)
+        if cached is None:
+            cached = await self._daily_fortune_flight.do(
+                cache_key, lambda: self._generate_and_cache_daily_fortune(target_date, cache_key, priority)
             )
+        return dict(cached)
 
-            return {
-                "success": True,
-                "fortune": response.text,
-                "date": date_string,
-                "lunar_date": lunar_date
-            }
+    async def cached_daily_fortune(self, date: Optional[datetime] = None) -> Optional[Dict]:
+        """返回已缓存的每日运势（不触发生成，不计入命中统计）"""
+        return await self.daily_fortune_cache.peek(self.get_daily_fortune_cache_key(date))
+
+    async def refresh_daily_fortune(self, date: Optional[datetime] = None, priority: int = PRIORITY_BACKGROUND) -> Dict:
+        """重新生成每日运势并写入缓存（不读缓存），供后台预生成使用；与同日的在途生成合并"""
+        target_date = date or datetime.now()
+        cache_key = self.get_daily_fortune_cache_key(target_date)
+        result = await self._daily_fortune_flight.do(
+            cache_key, lambda: self._generate_and_cache_daily_fortune(target_date, cache_key, priority)
+        )
+        return dict(result)
+
+    async def _generate_and_cache_daily_fortune(self, target_date: datetime, cache_key: str, priority: int = PRIORITY_INTERACTIVE) -> Dict:
+        """生成每日运势并写入缓存；回退结果只短暂缓存，以便尽快重试（不覆盖已生成的正式结果）"""
+        result = await self.generate_daily_fortune(target_date, priority=priority)
+        if result.get("success"):
+            expires_at = next_local_midnight(target_date).timestamp()
+            self.index_daily_trend(cache_key, result["structured"]["trend"])
+        else:
+            existing = await self.daily_fortune_cache.peek(cache_key)
+            if existing is not None and existing.get("success"):
+                return existing
+            expires_at = time.time() + self.daily_fortune_retry_seconds
+        self.daily_fortune_cache.set(cache_key, result, expires_at=expires_at)
+        return result
+
+    async def generate_daily_fortune(self, date: Optional[datetime] = None, priority: int = PRIORITY_INTERACTIVE) -> Dict:
+        """生成每日运势（不经过缓存）
+
+        吉/平/凶、宜忌、星级与幸运信息由本地历法引擎算定，LLM 只撰写各项说明文字；
+        未配置 LLM 时全部使用本地内容，LLM 调用失败时使用本地内容并标记 success=False 以便重试。
+        """
+        target_date = date or datetime.now()
+        date_string = target_date.strftime('%Y年%m月%d日')
+        info = almanac.get_day(target_date)
+        paragraphs = almanac.local_paragraphs(info)
+        if not self.provider:
+            return self._daily_fortune_result(info, paragraphs, date_string, success=True)
+
+        try:
+            prompt = self.build_daily_fortune_prompt(info, date_string)
+            result = await self.generate_text(prompt, json_schema=DAILY_FORTUNE_SCHEMA, priority=priority)
+            data = json.loads(result)
+            for aspect, field in DAILY_FORTUNE_FIELDS:
+                text = str(data.get(field) or "").strip()
+                if text:
+                    paragraphs[aspect] = text
+            return self._daily_fortune_result(info, paragraphs, date_string, success=True)
         except Exception as error:
-            logger.error(f"获取每日运势失败: {error}")
-            
-            # 默认运势内容
-            target_date = date or datetime.now()
-            date_string = target_date.strftime('%Y年%m月%d日')
-            default_fortune = f"""黄道吉日
-{date_string}
-农历吉日 吉
-宜 祈福上香 拜访长辈 整理房间
-忌 冲动购物 与人争执 过度饮食
-
-财运★★★★☆
-财运平稳，有小额收入机会，宜谨慎理财。
-
-事业★★★★☆
-工作运势良好，适合推进重要项目，与同事关系和谐。
-
-感情★★★★☆
-感情运势平稳，单身者宜多参加社交活动。
-
-健康★★★★★
-身体状况良好，注意作息规律和饮食平衡。
-
-今日建议
-多行善事，保持善念，诚心祈福，福运自然来临。
-
-今日幸运
-幸运颜色: 金色
-幸运数字: 8, 18, 28
-幸运方位: 东南
-吉时: 09:00-11:00"""
+            logger.error(f"获取每日运势失败: {error!r}")
+            return self._daily_fortune_result(info, paragraphs, date_string, success=False)
+
+    def build_daily_fortune_prompt(self, info: Dict, date_string: str) -> str:
+        """每日运势提示词：注入本地算定的黄道吉日信息，只请模型撰写各项说明"""
+        stars = "，".join(f"{aspect}{info['stars'][aspect]}星" for aspect in almanac.ASPECTS)
+        return f"""你是一位精通中国传统命理学的大师。以下黄道吉日信息已由历法算定，请勿改动，只需据此撰写今日运势的说明文字。
+
+今天是{date_string}，农历{info['lunar_text']}，{info['year_ganzhi']}年 {info['month_ganzhi']}月 {info['day_ganzhi']}日，建除值「{info['officer']}」，总体运势：{info['trend']}。
+宜：{' '.join(info['suitable'])}；忌：{' '.join(info['avoid'])}。
+各项星级：{stars}。
+
+请以 JSON 输出以下字段，每项一至两句，语言采用传统中式风格，保持庄重和神秘感，与上述吉凶和星级相符：
+- wealth：财运分析
+- career：事业运势
+- love：感情运势
+- health：健康运势
+- advice：今日建议"""
+
+    def _daily_fortune_result(self, info: Dict, paragraphs: Dict[str, str], date_string: str, success: bool) -> Dict:
+        """组装每日运势：排版后的全文与结构化字段在生成时一次算好，随结果一起缓存"""
+        return {
+            "success": success,
+            "fortune": almanac.format_fortune(info, paragraphs, date_string),
+            "date": date_string,
+            "lunar_date": info["lunar_date"],
+            "structured": {
+                "trend": info["trend"],
+                "lunar_text": info["lunar_text"],
+                "ganzhi": {
+                    "year": info["year_ganzhi"],
+                    "month": info["month_ganzhi"],
+                    "day": info["day_ganzhi"],
+                },
+                "officer": info["officer"],
+                "suitable": info["suitable"],
+                "avoid": info["avoid"],
+                "aspects": {
+                    field: {"stars": info["stars"][aspect], "text": paragraphs[aspect]}
+                    for aspect, field in DAILY_FORTUNE_FIELDS if aspect in info["stars"]
+                },
+                "advice": paragraphs["今日建议"],
+                "lucky": {
+                    "color": info["lucky_color"],
+                    "numbers": info["lucky_numbers"],
+                    "direction": info["lucky_direction"],
+                    "time": info["lucky_hour"],
+                },
+            },
+        }
 
-            return {
-                "success": False,
-                "fortune": default_fortune,
-                "date": date_string,
-                "lunar_date": "农历吉日"
-            }
+    def index_daily_trend(self, cache_key: str, trend: str) -> None:
+        """写入吉/平/凶趋势索引，同时清理今天之前的条目"""
+        self.daily_trends[cache_key] = trend
+        today = self._daily_key_date(self.get_daily_fortune_cache_key())
+        for key in [k for k in self.daily_trends if self._daily_key_date(k) < today]:
+            del self.daily_trends[key]
+
+    @staticmethod
+    def _daily_key_date(cache_key: str) -> Tuple[int, ...]:
+        return tuple(int(part) for part in cache_key.split("_")[1:])
+
+    async def get_daily_trend(self, date: Optional[datetime] = None, priority: int = PRIORITY_INTERACTIVE) -> str:
+        """读取当日吉/平/凶（不等待 LLM）；运势尚未生成时由本地历法算定，并在后台触发生成"""
+        target_date = date or datetime.now()
+        cache_key = self.get_daily_fortune_cache_key(target_date)
+        trend = self.daily_trends.get(cache_key)
+        if trend is None:
+            # 重启后运势可能已在磁盘缓存中：回填趋势索引
+            cached = await self.daily_fortune_cache.peek(cache_key)
+            if cached is not None and cached.get("success"):
+                trend = cached["structured"]["trend"]
+                self.index_daily_trend(cache_key, trend)
+            elif cached is None and self.provider:
+                task = asyncio.ensure_future(self.refresh_daily_fortune(target_date, priority=priority))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+        return trend or almanac.get_trend(target_date)
 
     def get_daily_fortune_cache_key(self, date: Optional[datetime] = None) -> str:
         """生成缓存键"""
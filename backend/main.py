@@ -1,22 +1,91 @@
 import os
+import re
+import json
 import asyncio
+import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import List, Optional
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, validator
 
+import almanac
 from llm_service import llm_service
+from llm_scheduler import PRIORITY_INCENSE
+from fortune_scheduler import DailyFortuneScheduler
+from http_cache import ResponseCache, cached_response
+from auth import AuthError, IdentitySigner
+from user_store import InsufficientMeritError, UserStore, is_wallet
+from inventory import HOLD_PENDING, HOLD_STATUS_TEXT, HoldError, InventoryStore, OutOfStockError, PurchaseLimitError
+from payment_verifier import PaymentError, PaymentPendingError, PaymentUnavailableError, PaymentVerifier
+from shop_catalog import DEFAULT_SORT, SORT_KEYS, ShopCatalogFile, ShopResponse
 
 # 加载环境变量
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# 每日运势后台预生成（DAILY_FORTUNE_PREGEN_ENABLED=false 可关闭）
+fortune_scheduler = DailyFortuneScheduler.from_env(llm_service)
+
+# 用户状态存储（SQLite，按钱包地址 / 会话 ID 区分用户）
+user_store = UserStore.from_env()
+
+# 身份令牌：匿名会话与钱包签名登录（AUTH_SECRET 签名，各 worker 共用）
+identity = IdentitySigner.from_env()
+# 身份令牌的 Cookie 名与响应头（新签发的令牌通过该响应头返回给前端保存）
+AUTH_COOKIE = "temple_session"
+AUTH_TOKEN_HEADER = "X-Session-Token"
+AUTH_COOKIE_SECURE = os.getenv('AUTH_COOKIE_SECURE', 'false').lower() == 'true'
+
+# 商城库存（SQLite）：限量商品的原子预留与限时保留
+inventory = InventoryStore.from_env()
+
+# 链上支付校验（未配置 SHOP_PAYMENT_RPC_URL / SHOP_PAYMENT_RECIPIENT 时保留单无法确认）
+payment_verifier = PaymentVerifier.from_env()
+
+# 商城目录（data/shop_catalog.json）：ID / 分类索引与预序列化的列表响应，文件修改后自动重新加载
+shop_catalog = ShopCatalogFile.from_env()
+
+
+def inventory_items(catalog) -> list:
+    """目录中的库存登记项：(商品 ID, 库存数量, 是否抢购)"""
+    return [(item.id, item.stock, item.flash_sale) for item in catalog.items]
+
+
+# 目录重新加载时登记限量商品：新商品建立库存，已有商品按库存总量的变化补货或减量
+shop_catalog.on_reload(lambda catalog: inventory.schedule_seed(inventory_items(catalog)))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 预先编译本年的黄道吉日历法表
+    almanac.year_table(datetime.now().year)
+    if os.getenv('DAILY_FORTUNE_PREGEN_ENABLED', 'true').lower() == 'true':
+        fortune_scheduler.start()
+    user_store.start()
+    # 登记限量商品库存，并启动超时保留单回收
+    await inventory.run(inventory.seed, inventory_items(shop_catalog.catalog))
+    inventory.start()
+    yield
+    await fortune_scheduler.stop()
+    await user_store.stop()
+    user_store.close()
+    await inventory.stop()
+    inventory.close()
+    if llm_service.cache_store:
+        llm_service.cache_store.close()
+
+
 app = FastAPI(
     title="小六壬占卜 API",
     description="基于 Gemini API 的小六壬占卜服务",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 添加 CORS 中间件
@@ -26,6 +95,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[AUTH_TOKEN_HEADER],
 )
 
 
@@ -34,6 +104,8 @@ class DivinationRequest(BaseModel):
     wish: str
     numbers: List[int]
     language: Optional[str] = None
+    # 占卜模式：llm（默认，调用大模型）/ local（本地三宫五行引擎，毫秒级返回）
+    mode: Optional[str] = None
     
     @validator('wish')
     def validate_wish(cls, v):
@@ -52,6 +124,33 @@ class DivinationRequest(BaseModel):
                 raise ValueError('数字必须是1-99之间的整数')
         return v
 
+    @validator('mode')
+    def validate_mode(cls, v):
+        if v is None:
+            return v
+        if v not in ['llm', 'local']:
+            raise ValueError('占卜模式必须是 llm, local 之一')
+        return v
+
+
+# 批量占卜：单次请求的最大条目数
+DIVINATION_BATCH_MAX_ITEMS = int(os.getenv('DIVINATION_BATCH_MAX_ITEMS', '100'))
+
+
+class DivinationBatchRequest(BaseModel):
+    """批量占卜请求模型"""
+    items: List[DivinationRequest]
+    # 为 true 时以 NDJSON 逐条返回（按完成顺序），否则按请求顺序一次性返回
+    stream: Optional[bool] = False
+
+    @validator('items')
+    def validate_items(cls, v):
+        if not v:
+            raise ValueError('批量占卜至少包含1个条目')
+        if len(v) > DIVINATION_BATCH_MAX_ITEMS:
+            raise ValueError(f'批量占卜最多包含{DIVINATION_BATCH_MAX_ITEMS}个条目')
+        return v
+
 
 class DivinationResponse(BaseModel):
     """占卜响应模型"""
@@ -65,16 +164,29 @@ class DivinationResponse(BaseModel):
     # 新增：三宫（人/事/应）六神结构化信息
     # name: 中文六神名；pinyin: 英文拼音（小写空格分隔）；element: 五行；position: ren/shi/ying
     palaces: Optional[list] = None
+    # 新增：三组五行关系（人事/人应/事应）的生克判词
+    relations: Optional[list] = None
     full_text: Optional[str] = None
     error: Optional[str] = None
 
 
+class DivinationBatchResponse(BaseModel):
+    """批量占卜响应模型（results 与请求 items 顺序一致）"""
+    success: bool
+    count: int
+    # 去重后实际计算的条目数
+    unique: int
+    results: List[DivinationResponse]
+
+
 class DailyFortuneResponse(BaseModel):
     """每日运势响应模型"""
     success: bool
     fortune: Optional[str] = None
     date: Optional[str] = None
     lunar_date: Optional[str] = None
+    # format=structured 时返回：吉凶、干支、宜忌、各项星级与说明、幸运信息（不含 fortune 全文）
+    structured: Optional[dict] = None
     error: Optional[str] = None
 
 
@@ -127,24 +239,6 @@ class IncenseResponse(BaseModel):
     error: Optional[str] = None
 
 
-class ShopItem(BaseModel):
-    """商品模型"""
-    id: int
-    name: str
-    description: str
-    price: int  # 使用积分作为价格单位
-    category: str
-    in_stock: bool
-    image_url: Optional[str] = None
-
-
-class ShopResponse(BaseModel):
-    """商城响应模型"""
-    success: bool
-    items: Optional[List[ShopItem]] = None
-    error: Optional[str] = None
-
-
 class PurchaseRequest(BaseModel):
     """购买请求模型"""
     item_id: int
@@ -165,6 +259,49 @@ class PurchaseResponse(BaseModel):
     error: Optional[str] = None
 
 
+class HoldRequest(PurchaseRequest):
+    """库存保留请求模型（链上支付确认前先锁定库存）"""
+
+
+class HoldConfirmRequest(BaseModel):
+    """保留单确认请求模型"""
+    tx_hash: str
+
+    @validator('tx_hash')
+    def validate_tx_hash(cls, v):
+        v = v.strip()
+        if not re.fullmatch(r'0x[0-9a-fA-F]{64}', v):
+            raise ValueError('交易哈希格式不正确')
+        return v.lower()
+
+
+class WalletLoginRequest(BaseModel):
+    """钱包登录请求模型：/api/auth/challenge 下发的消息及其钱包签名"""
+    message: str
+    signature: str
+
+
+class AuthResponse(BaseModel):
+    """身份响应模型"""
+    success: bool
+    user_id: Optional[str] = None
+    token: Optional[str] = None
+    message: Optional[str] = None
+    expires_at: Optional[int] = None
+    error: Optional[str] = None
+
+
+class HoldResponse(BaseModel):
+    """库存保留响应模型"""
+    success: bool
+    hold_id: Optional[str] = None
+    item_id: Optional[int] = None
+    quantity: Optional[int] = None
+    status: Optional[str] = None
+    expires_at: Optional[str] = None
+    error: Optional[str] = None
+
+
 @app.get("/")
 async def root():
     """根路径"""
@@ -173,10 +310,15 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "占卜": "/api/divination",
+            "流式占卜": "/api/divination/stream",
+            "批量占卜": "/api/divination/batch",
             "每日运势": "/api/daily-fortune",
             "上香": "/api/incense",
             "商城": "/api/shop",
             "购买": "/api/purchase",
+            "用户状态": "/api/user/status",
+            "功德账本": "/api/user/ledger",
+            "钱包登录": "/api/auth/wallet",
             "API文档": "/docs"
         }
     }
@@ -189,6 +331,7 @@ async def perform_divination(request: DivinationRequest, http_request: Request):
     
     - **wish**: 您的愿望或要占卜的事情
     - **numbers**: 三个1-99之间的数字
+    - **mode**: 可选，llm（默认）或 local（本地三宫五行引擎）
     """
     try:
         # 语言优先级：body.language > Accept-Language header > zh
@@ -196,18 +339,107 @@ async def perform_divination(request: DivinationRequest, http_request: Request):
                 http_request.headers.get('Accept-Language', '') or 
                 'zh').lower()
         lang = 'en' if lang.startswith('en') else 'zh'
-        result = await llm_service.perform_divination(request.wish, request.numbers, language=lang)
+        result = await llm_service.perform_divination(
+            request.wish, request.numbers, language=lang, mode=request.mode or 'llm'
+        )
         return DivinationResponse(**result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"占卜服务异常: {str(e)}")
 
 
-@app.get("/api/daily-fortune", response_model=DailyFortuneResponse)
-async def get_daily_fortune(date: Optional[str] = None):
+def format_sse(event: str, data: dict) -> str:
+    """序列化为一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/divination/stream")
+async def stream_divination(request: DivinationRequest, http_request: Request):
+    """
+    流式执行小六壬占卜（text/event-stream）
+
+    事件顺序：
+    - **palaces**: 本地计算的三宫与吉凶文本，立即返回
+    - **section**: 【卦象解析】/【运势预测】/【神明指引】 各段生成后依次推送
+    - **result**: 最终解析结果（结构同 /api/divination）
+    """
+    lang = (request.language or
+            http_request.headers.get('Accept-Language', '') or
+            'zh').lower()
+    lang = 'en' if lang.startswith('en') else 'zh'
+
+    async def event_stream():
+        try:
+            async for event, data in llm_service.stream_divination(
+                request.wish, request.numbers, language=lang, mode=request.mode or 'llm'
+            ):
+                if event == "result":
+                    data = DivinationResponse(**data).model_dump()
+                yield format_sse(event, data)
+        except Exception as e:
+            yield format_sse("error", {"success": False, "error": f"占卜服务异常: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/divination/batch")
+async def divination_batch(request: DivinationBatchRequest, http_request: Request):
+    """
+    批量执行小六壬占卜
+
+    - **items**: 占卜请求列表（结构同 /api/divination），一次性校验
+    - **stream**: 可选，为 true（或 Accept: application/x-ndjson）时以 NDJSON 按完成顺序逐条返回 {"index", "result"}
+
+    相同条目只计算一次，LLM 调用以有限并发执行，且优先级低于实时占卜。
+    """
+    header_lang = http_request.headers.get('Accept-Language', '')
+    items = []
+    for item in request.items:
+        lang = (item.language or header_lang or 'zh').lower()
+        items.append((item.wish, item.numbers, 'en' if lang.startswith('en') else 'zh', item.mode or 'llm'))
+
+    streaming = request.stream or 'application/x-ndjson' in http_request.headers.get('Accept', '')
+    if streaming:
+        async def ndjson_stream():
+            async for indexes, result in llm_service.iter_divination_batch(items):
+                data = DivinationResponse(**result).model_dump()
+                for index in indexes:
+                    yield json.dumps({"index": index, "result": data}, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+    results: List[Optional[DivinationResponse]] = [None] * len(items)
+    unique = 0
+    async for indexes, result in llm_service.iter_divination_batch(items):
+        unique += 1
+        for index in indexes:
+            results[index] = DivinationResponse(**result)
+    return DivinationBatchResponse(success=True, count=len(items), unique=unique, results=results)
+
+
+# 每日运势可查询的年份范围：当前年份前后 N 年
+DAILY_FORTUNE_YEAR_RANGE = int(os.getenv('DAILY_FORTUNE_YEAR_RANGE', '1'))
+
+# 已序列化的响应体与 ETag（来源对象不变时复用）
+fortune_responses = ResponseCache()
+shop_responses = ResponseCache(maxsize=256)
+# 商城目录的浏览器 / CDN 缓存秒数（到期后凭 ETag 再验证）
+SHOP_CACHE_MAX_AGE = int(os.getenv('SHOP_CACHE_MAX_AGE', '300'))
+# 商城分页：每页默认 / 最大商品数
+SHOP_PAGE_SIZE = int(os.getenv('SHOP_PAGE_SIZE', '20'))
+SHOP_MAX_PAGE_SIZE = int(os.getenv('SHOP_MAX_PAGE_SIZE', '100'))
+
+
+@app.get("/api/daily-fortune", response_model=DailyFortuneResponse, response_model_exclude_none=True)
+async def get_daily_fortune(http_request: Request, date: Optional[str] = None, format: Optional[str] = None):
     """
     获取每日运势
     
     - **date**: 可选，指定日期（格式：YYYY-MM-DD），不提供则使用当前日期
+    - **format**: 可选，text（默认，返回 fortune 全文）或 structured（返回结构化字段，不含全文）
     """
     try:
         target_date = None
@@ -216,34 +448,93 @@ async def get_daily_fortune(date: Optional[str] = None):
                 target_date = datetime.strptime(date, '%Y-%m-%d')
             except ValueError:
                 raise HTTPException(status_code=400, detail="日期格式错误，请使用 YYYY-MM-DD 格式")
+            # 只接受当前年份前后 DAILY_FORTUNE_YEAR_RANGE 年内的日期：超出农历表的年份无法推算，
+            # 且每个新年份都要重新编译整年历法表
+            this_year = datetime.now().year
+            first_year = max(almanac.MIN_YEAR, this_year - DAILY_FORTUNE_YEAR_RANGE)
+            last_year = min(almanac.MAX_YEAR, this_year + DAILY_FORTUNE_YEAR_RANGE)
+            if not first_year <= target_date.year <= last_year:
+                raise HTTPException(status_code=400, detail=f"仅支持查询 {first_year}-{last_year} 年的运势")
         
+        if format not in (None, 'text', 'structured'):
+            raise HTTPException(status_code=400, detail="format 必须是 text, structured 之一")
+
         result = await llm_service.get_daily_fortune(target_date)
-        return DailyFortuneResponse(**result)
+        cache_key = llm_service.get_daily_fortune_cache_key(target_date)
+
+        def serialize() -> bytes:
+            data = dict(result)
+            data.pop('fortune' if format == 'structured' else 'structured', None)
+            return DailyFortuneResponse(**data).model_dump_json(exclude_none=True).encode()
+
+        # 同一份缓存结果的各个副本共享 structured 对象，以其作为来源标识
+        body, etag = fortune_responses.get(f"{cache_key}:{format or 'text'}", result.get('structured'), serialize)
+        # 浏览器 / CDN 缓存至服务端缓存到期（成功结果为当日零点，回退结果为重试间隔）
+        max_age = llm_service.daily_fortune_cache.ttl(cache_key) or 0
+        return cached_response(http_request, body, etag, min(max_age, 86400))
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取运势服务异常: {str(e)}")
 
 
-# 模拟用户数据存储（在实际应用中应使用数据库）
-user_data = {
-    "incense_count": 0,
-    "merit_points": 100,  # 初始功德值
-}
+def set_identity(response: Response, token: str) -> None:
+    """通过响应头与 Cookie 下发身份令牌"""
+    response.headers[AUTH_TOKEN_HEADER] = token
+    response.set_cookie(AUTH_COOKIE, token, max_age=int(identity.token_ttl), httponly=True,
+                        samesite="lax", secure=AUTH_COOKIE_SECURE)
 
-# 商品数据
-shop_items = [
-    ShopItem(id=1, name="平安符", description="保佑平安健康", price=50, category="护身符", in_stock=True),
-    ShopItem(id=2, name="招财符", description="招财进宝", price=80, category="护身符", in_stock=True),
-    ShopItem(id=3, name="学业符", description="学业进步", price=60, category="护身符", in_stock=True),
-    ShopItem(id=4, name="姻缘符", description="促进姻缘", price=70, category="护身符", in_stock=True),
-    ShopItem(id=5, name="檀香", description="高品质檀香", price=30, category="香品", in_stock=True),
-    ShopItem(id=6, name="沉香", description="珍贵沉香", price=100, category="香品", in_stock=True),
-]
+
+def current_user_id(http_request: Request, response: Response, authorization: Optional[str] = Header(None)) -> str:
+    """从签名令牌（Authorization: Bearer 或 Cookie）读取用户标识；没有有效令牌时签发新的匿名会话
+
+    钱包地址只能通过 /api/auth/wallet 签名登录获得，请求方自报的标识不被信任。
+    """
+    token = None
+    if authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:].strip()
+    token = token or http_request.cookies.get(AUTH_COOKIE)
+    user_id = identity.verify(token) if token else None
+    if user_id is None:
+        user_id, token = identity.new_session()
+        set_identity(response, token)
+    return user_id
+
+
+@app.get("/api/auth/challenge", response_model=AuthResponse)
+async def wallet_challenge(address: str):
+    """
+    获取钱包登录消息（由钱包以 personal_sign 签名后提交到 /api/auth/wallet）
+
+    - **address**: 钱包地址
+    """
+    if not identity.wallet_login_available:
+        raise HTTPException(status_code=503, detail="服务端未启用钱包登录")
+    try:
+        challenge = identity.challenge(address)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return AuthResponse(success=True, message=challenge["message"], expires_at=challenge["expires_at"])
+
+
+@app.post("/api/auth/wallet", response_model=AuthResponse)
+async def wallet_login(request: WalletLoginRequest, response: Response):
+    """验证钱包签名，签发绑定该钱包地址的身份令牌（每条登录消息只能使用一次）"""
+    if not identity.wallet_login_available:
+        raise HTTPException(status_code=503, detail="服务端未启用钱包登录")
+    try:
+        address, nonce, expires_at = identity.verify_wallet(request.message, request.signature)
+    except AuthError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    if not await user_store.run(user_store.consume_nonce, nonce, expires_at):
+        raise HTTPException(status_code=401, detail="登录消息已使用，请重新登录")
+    token = identity.issue(address)
+    set_identity(response, token)
+    return AuthResponse(success=True, user_id=address, token=token)
 
 
 @app.post("/api/incense", response_model=IncenseResponse)
-async def offer_incense(request: IncenseRequest, http_request: Request):
+async def offer_incense(request: IncenseRequest, http_request: Request, user_id: str = Depends(current_user_id)):
     """
     上香祈福
     
@@ -273,18 +564,12 @@ async def offer_incense(request: IncenseRequest, http_request: Request):
                 amount = 1
             merit_points = int(amount) * 10
 
-        # 更新用户数据
-        user_data["incense_count"] += 1
-        user_data["merit_points"] += merit_points
+        # 更新用户数据（原子累加）
+        user = await user_store.run(user_store.increment, user_id, incense=1, merit=merit_points,
+                                    ref=f"{token}:{amount}")
 
-        # 获取当日运势，解析吉/平/凶
-        daily = await llm_service.get_daily_fortune()
-        fortune_text = (daily or {}).get('fortune') or ''
-        trend = '吉'
-        import re
-        m = re.search(r"\[(吉|平|凶)\]", fortune_text)
-        if m:
-            trend = m.group(1)
+        # 当日吉/平/凶：读取运势趋势索引（未生成时由本地历法算定），不等待 LLM
+        trend = await llm_service.get_daily_trend(priority=PRIORITY_INCENSE)
 
         # 生成中英文祝福，结合愿望与当日运势
         wish = request.wish
@@ -308,7 +593,7 @@ async def offer_incense(request: IncenseRequest, http_request: Request):
             blessing_en=en,
             fortune_trend=trend,
             merit_points=merit_points,
-            incense_count=user_data["incense_count"],
+            incense_count=user["incense_count"],
             token=token,
             amount=amount
         )
@@ -320,25 +605,56 @@ async def offer_incense(request: IncenseRequest, http_request: Request):
 
 
 @app.get("/api/shop", response_model=ShopResponse)
-async def get_shop_items(category: Optional[str] = None):
+async def get_shop_items(http_request: Request, category: Optional[str] = None, sort: Optional[str] = None,
+                         page: Optional[int] = None, page_size: Optional[int] = None):
     """
     获取商城商品列表
     
     - **category**: 可选，商品分类筛选
+    - **sort**: 可选，排序方式 (id/price/-price/name)，默认 id
+    - **page** / **page_size**: 可选，分页（页码从 1 开始）
     """
+    sort = sort or DEFAULT_SORT
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"排序方式必须是 {', '.join(SORT_KEYS)} 之一")
+    if page is not None or page_size is not None:
+        page = 1 if page is None else page
+        page_size = SHOP_PAGE_SIZE if page_size is None else page_size
+        if page < 1 or page_size < 1 or page_size > SHOP_MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"page 从 1 开始，page_size 必须在 1-{SHOP_MAX_PAGE_SIZE} 之间")
+
     try:
-        items = shop_items
-        if category:
-            items = [item for item in shop_items if item.category == category]
-        
-        return ShopResponse(success=True, items=items)
+        catalog = shop_catalog.catalog
+        category = category or ''
+        # 限量商品售罄后在列表中标记为缺货
+        sold_out = await inventory.current_sold_out() & catalog.category_ids.get(category, frozenset())
+
+        # 常规请求（默认排序、不分页、无售罄商品）：直接返回加载目录时预先序列化的响应
+        listing = catalog.listing(category)
+        if listing is not None and sort == DEFAULT_SORT and page_size is None and not sold_out:
+            body, etag = listing
+            return cached_response(http_request, body, etag, SHOP_CACHE_MAX_AGE)
+
+        def serialize() -> bytes:
+            items, total = catalog.select(category, sort, page, page_size)
+            items = [item.model_copy(update={"in_stock": False}) if item.id in sold_out else item for item in items]
+            return ShopResponse(
+                success=True, items=items, total=total, page=page, page_size=page_size
+            ).model_dump_json().encode()
+
+        # 以目录快照为来源对象：目录重新加载后缓存的响应体与 ETag 随之失效；
+        # 售罄商品集合计入缓存键，售罄 / 补货时列表随之更新
+        sold_out_key = ",".join(str(item_id) for item_id in sorted(sold_out))
+        key = f"shop:{category}:{sort}:{page}:{page_size}:{sold_out_key}"
+        body, etag = shop_responses.get(key, catalog, serialize)
+        return cached_response(http_request, body, etag, SHOP_CACHE_MAX_AGE)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"商城服务异常: {str(e)}")
 
 
 @app.post("/api/purchase", response_model=PurchaseResponse)
-async def purchase_item(request: PurchaseRequest):
+async def purchase_item(request: PurchaseRequest, user_id: str = Depends(current_user_id)):
     """
     购买商品
     
@@ -347,7 +663,7 @@ async def purchase_item(request: PurchaseRequest):
     """
     try:
         # 查找商品
-        item = next((item for item in shop_items if item.id == request.item_id), None)
+        item = shop_catalog.catalog.get(request.item_id)
         if not item:
             raise HTTPException(status_code=404, detail="商品不存在")
         
@@ -356,16 +672,39 @@ async def purchase_item(request: PurchaseRequest):
         
         total_price = item.price * request.quantity
         
-        if user_data["merit_points"] < total_price:
+        # 限量商品先原子预留库存（库存不足时不扣功德），不限量商品不经过库存表
+        try:
+            hold_id = await inventory.run(inventory.reserve, item.id, request.quantity, user_id,
+                                      verified=is_wallet(user_id))
+        except (OutOfStockError, PurchaseLimitError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # 扣除功德值并记账：单个事务内的条件更新，余额不足时不扣减，并发购买不会透支
+        ref = f"item:{item.id}x{request.quantity}"
+        try:
+            user = await user_store.run(user_store.spend, user_id, total_price, ref=ref)
+        except InsufficientMeritError:
+            await release_hold_quietly(hold_id, user_id)
             raise HTTPException(status_code=400, detail="功德值不足")
-        
-        # 扣除功德值
-        user_data["merit_points"] -= total_price
+        except Exception:
+            await release_hold_quietly(hold_id, user_id)
+            raise
+
+        # 库存计入已售；失败时（保留单已超时被回收、数据库繁忙等）退还功德并记账，释放保留单
+        try:
+            await inventory.run(inventory.commit, hold_id, user_id, ref="merit")
+        except Exception as e:
+            await user_store.run(user_store.refund, user_id, total_price, ref=ref)
+            await release_hold_quietly(hold_id, user_id)
+            if isinstance(e, HoldError):
+                raise HTTPException(status_code=409, detail=f"{e}，功德值已退还")
+            logger.error(f"购买确认库存失败，已退还功德值: {e!r}")
+            raise HTTPException(status_code=500, detail="购买未完成，功德值已退还")
         
         return PurchaseResponse(
             success=True,
             message=f"成功购买 {request.quantity} 个 {item.name}",
-            remaining_points=user_data["merit_points"]
+            remaining_points=user["merit_points"]
         )
         
     except HTTPException:
@@ -374,13 +713,114 @@ async def purchase_item(request: PurchaseRequest):
         raise HTTPException(status_code=500, detail=f"购买服务异常: {str(e)}")
 
 
+async def release_hold_quietly(hold_id: Optional[str], user_id: str) -> None:
+    """购买失败时释放保留单；保留单已被回收或处理时忽略（未释放的由超时回收兜底）"""
+    try:
+        await inventory.run(inventory.release, hold_id, user_id)
+    except Exception as e:
+        logger.warning(f"释放保留单 {hold_id} 失败: {e!r}")
+
+
+def hold_response(hold: dict) -> HoldResponse:
+    return HoldResponse(
+        success=True,
+        hold_id=hold["hold_id"],
+        item_id=hold["item_id"],
+        quantity=hold["quantity"],
+        status=hold["status"],
+        expires_at=datetime.fromtimestamp(hold["expires_at"]).isoformat(timespec="seconds")
+    )
+
+
+@app.post("/api/shop/holds", response_model=HoldResponse)
+async def create_hold(request: HoldRequest, user_id: str = Depends(current_user_id)):
+    """
+    保留限量商品库存，等待链上支付确认（超时未确认自动释放）
+    
+    - **item_id**: 商品ID
+    - **quantity**: 数量
+    """
+    if not is_wallet(user_id):
+        raise HTTPException(status_code=403, detail="链上支付需先连接钱包并签名登录")
+    item = shop_catalog.catalog.get(request.item_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="商品不存在")
+    if not inventory.is_limited(item.id):
+        raise HTTPException(status_code=400, detail="该商品不限量，无需保留库存")
+    try:
+        hold_id = await inventory.run(inventory.reserve, item.id, request.quantity, user_id,
+                                      verified=is_wallet(user_id))
+    except (OutOfStockError, PurchaseLimitError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return hold_response(await inventory.run(inventory.get_hold, hold_id))
+
+
+@app.post("/api/shop/holds/{hold_id}/confirm", response_model=HoldResponse)
+async def confirm_hold(hold_id: str, request: HoldConfirmRequest, user_id: str = Depends(current_user_id)):
+    """
+    确认保留单：链上核对支付交易（付款钱包、收款地址、金额）后库存计入已售
+
+    交易未上链或确认数不足时返回 409，保留单保持待确认，可稍后重试；同一笔交易只能确认一个保留单。
+    """
+    if payment_verifier is None:
+        raise HTTPException(status_code=503, detail="未配置链上支付校验，暂无法确认支付")
+    hold = await inventory.run(inventory.get_hold, hold_id)
+    if hold is None or hold["user_id"] != user_id:
+        raise HTTPException(status_code=409, detail="保留单不存在")
+    if hold["status"] != HOLD_PENDING:
+        raise HTTPException(status_code=409, detail=f"保留单{HOLD_STATUS_TEXT.get(hold['status'], '已处理')}")
+    item = shop_catalog.catalog.get(hold["item_id"])
+    if not item:
+        raise HTTPException(status_code=409, detail="商品已下架")
+
+    try:
+        await payment_verifier.verify(request.tx_hash, user_id, item.price * hold["quantity"], hold["created_at"])
+    except PaymentPendingError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PaymentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PaymentUnavailableError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    try:
+        await inventory.run(inventory.commit, hold_id, user_id, ref=request.tx_hash, tx_hash=request.tx_hash)
+    except HoldError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return hold_response(await inventory.run(inventory.get_hold, hold_id))
+
+
+@app.delete("/api/shop/holds/{hold_id}", response_model=HoldResponse)
+async def release_hold(hold_id: str, user_id: str = Depends(current_user_id)):
+    """取消保留单，库存退回"""
+    try:
+        await inventory.run(inventory.release, hold_id, user_id)
+    except HoldError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return hold_response(await inventory.run(inventory.get_hold, hold_id))
+
+
 @app.get("/api/user/status")
-async def get_user_status():
+async def get_user_status(user_id: str = Depends(current_user_id)):
     """获取用户状态"""
+    user = await user_store.run(user_store.get, user_id)
+    return {
+        "success": True,
+        "user_id": user_id,
+        "incense_count": user["incense_count"],
+        "merit_points": user["merit_points"]
+    }
+
+
+@app.get("/api/user/ledger")
+async def get_user_ledger(limit: int = 20, user_id: str = Depends(current_user_id)):
+    """获取功德账本（最近的功德值变动记录）"""
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="limit 必须在 1-100 之间")
     return {
         "success": True,
-        "incense_count": user_data["incense_count"],
-        "merit_points": user_data["merit_points"]
+        "user_id": user_id,
+        "merit_points": (await user_store.run(user_store.get, user_id))["merit_points"],
+        "entries": await user_store.run(user_store.ledger, user_id, limit)
     }
 
 
@@ -390,7 +830,13 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "api_key_configured": bool(os.getenv('GEMINI_API_KEY'))
+        "api_key_configured": bool(os.getenv('GEMINI_API_KEY')),
+        "llm": llm_service.get_llm_stats(),
+        "cache": llm_service.get_cache_stats(),
+        "user_store": user_store.stats(),
+        "inventory": inventory.stats(),
+        "payments": payment_verifier.stats() if payment_verifier else None,
+        "daily_fortune_scheduler": await fortune_scheduler.get_status()
     }
 
 @app.get("/api/debug/env")
@@ -0,0 +1,146 @@
+"""
+链上支付校验：确认保留单前通过节点 JSON-RPC 核对支付交易
+
+- 交易回执状态为成功，且达到所需确认数；未上链或确认数不足时视为待确认，保留单保持 pending
+- 交易发送方必须是下单的钱包（钱包用户经签名登录，见 auth.py）
+- 交易所在区块须晚于保留单创建时间（允许 SHOP_PAYMENT_CLOCK_SKEW 秒误差），
+  下单前已有的转账（如其他用途的付款）不能用来确认保留单
+- 配置了代币合约（SHOP_PAYMENT_TOKEN，如 USDC）时核对回执中由付款钱包转给收款地址的 Transfer 事件，
+  否则核对原生币转账的收款地址与金额；金额按 商品积分价格 × SHOP_PAYMENT_UNITS_PER_POINT 计算
+- 同一笔交易只能确认一个保留单，由库存表的唯一约束保证（见 InventoryStore.commit）
+"""
+
+import os
+import logging
+from typing import Any, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# ERC-20 Transfer(address,address,uint256) 事件签名
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+
+class PaymentError(Exception):
+    """支付交易不符合要求（失败、收款方 / 付款方 / 金额不符）"""
+
+
+class PaymentPendingError(PaymentError):
+    """交易尚未上链或确认数不足，稍后重试"""
+
+
+class PaymentUnavailableError(Exception):
+    """节点 RPC 不可用，暂时无法校验"""
+
+
+def _topic_address(topic: str) -> str:
+    return "0x" + topic[-40:].lower()
+
+
+class PaymentVerifier:
+    """按交易哈希核对链上支付"""
+
+    def __init__(self, rpc_url: str, recipient: str, token: Optional[str] = None,
+                 units_per_point: int = 100000, min_confirmations: int = 1, timeout: float = 10.0,
+                 clock_skew: float = 30.0):
+        self.rpc_url = rpc_url
+        self.recipient = recipient.lower()
+        self.token = token.lower() if token else None
+        self.units_per_point = units_per_point
+        self.min_confirmations = max(1, min_confirmations)
+        self.timeout = timeout
+        self.clock_skew = clock_skew
+        self.stats_counters = {"verified": 0, "pending": 0, "rejected": 0, "rpc_errors": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["PaymentVerifier"]:
+        """未配置 SHOP_PAYMENT_RPC_URL 或 SHOP_PAYMENT_RECIPIENT 时返回 None（保留单无法确认）"""
+        rpc_url = os.getenv('SHOP_PAYMENT_RPC_URL', '').strip()
+        recipient = os.getenv('SHOP_PAYMENT_RECIPIENT', '').strip()
+        if not rpc_url or not recipient:
+            return None
+        return cls(
+            rpc_url,
+            recipient,
+            token=os.getenv('SHOP_PAYMENT_TOKEN', '').strip() or None,
+            # 默认按 USDC（6 位小数）计价，10 功德点 = 1 USDC，与上香的金额换算一致
+            units_per_point=int(os.getenv('SHOP_PAYMENT_UNITS_PER_POINT', '100000')),
+            min_confirmations=int(os.getenv('SHOP_PAYMENT_MIN_CONFIRMATIONS', '1')),
+            timeout=float(os.getenv('SHOP_PAYMENT_RPC_TIMEOUT', '10')),
+            clock_skew=float(os.getenv('SHOP_PAYMENT_CLOCK_SKEW', '30')),
+        )
+
+    async def _rpc(self, client: httpx.AsyncClient, method: str, params: List[Any]) -> Any:
+        try:
+            response = await client.post(self.rpc_url, json={"jsonrpc": "2.0", "id": 1, "method": method, "params": params})
+            response.raise_for_status()
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as error:
+            self.stats_counters["rpc_errors"] += 1
+            logger.warning(f"支付校验 RPC {method} 失败: {error!r}")
+            raise PaymentUnavailableError("链上支付校验暂不可用，请稍后重试")
+        if data.get("error"):
+            self.stats_counters["rpc_errors"] += 1
+            logger.warning(f"支付校验 RPC {method} 返回错误: {data['error']}")
+            raise PaymentUnavailableError("链上支付校验暂不可用，请稍后重试")
+        return data.get("result")
+
+    async def verify(self, tx_hash: str, payer: str, price_points: int, not_before: float) -> int:
+        """核对交易：payer 在 not_before（保留单创建时间戳）之后向收款地址支付不少于 price_points 对应的金额，
+        返回实付金额（最小单位）"""
+        try:
+            paid = await self._verify(tx_hash, payer.lower(), price_points * self.units_per_point, not_before)
+        except PaymentPendingError:
+            self.stats_counters["pending"] += 1
+            raise
+        except PaymentError:
+            self.stats_counters["rejected"] += 1
+            raise
+        self.stats_counters["verified"] += 1
+        return paid
+
+    async def _verify(self, tx_hash: str, payer: str, required: int, not_before: float) -> int:
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            receipt = await self._rpc(client, "eth_getTransactionReceipt", [tx_hash])
+            if receipt is None:
+                raise PaymentPendingError("交易尚未上链，请稍后重试")
+            if int(receipt.get("status", "0x0"), 16) != 1:
+                raise PaymentError("支付交易执行失败")
+            if self.min_confirmations > 1:
+                head = int(await self._rpc(client, "eth_blockNumber", []), 16)
+                if head - int(receipt["blockNumber"], 16) + 1 < self.min_confirmations:
+                    raise PaymentPendingError("交易确认数不足，请稍后重试")
+            if (receipt.get("from") or "").lower() != payer:
+                raise PaymentError("支付交易的发送方与下单钱包不符")
+            block = await self._rpc(client, "eth_getBlockByNumber", [receipt["blockNumber"], False])
+            if block is None or int(block["timestamp"], 16) < not_before - self.clock_skew:
+                raise PaymentError("支付交易早于保留单创建时间")
+
+            if self.token:
+                paid = sum(
+                    int(log["data"], 16)
+                    for log in receipt.get("logs", [])
+                    if (log.get("address") or "").lower() == self.token
+                    and len(log.get("topics", [])) == 3
+                    and log["topics"][0].lower() == TRANSFER_TOPIC
+                    and _topic_address(log["topics"][1]) == payer
+                    and _topic_address(log["topics"][2]) == self.recipient
+                )
+            else:
+                tx = await self._rpc(client, "eth_getTransactionByHash", [tx_hash])
+                if tx is None or (tx.get("to") or "").lower() != self.recipient:
+                    raise PaymentError("支付交易的收款地址不符")
+                paid = int(tx.get("value", "0x0"), 16)
+
+        if paid < required:
+            raise PaymentError("支付金额不足")
+        return paid
+
+    def stats(self) -> dict:
+        return {
+            "recipient": self.recipient,
+            "token": self.token,
+            "min_confirmations": self.min_confirmations,
+            **self.stats_counters,
+        }
@@ -0,0 +1,164 @@
+"""
+持久化缓存层：SQLite（WAL 模式）磁盘缓存，位于内存 TTLCache 之后
+
+- 内存未命中时回查磁盘，命中后回填内存；写入内存后提交到存储线程写穿到磁盘
+- 读写都在存储专用线程中执行（见 SQLiteStore.run / submit），不阻塞事件循环
+- 进程重启或实例休眠唤醒后，冷实例可直接提供已生成的占卜与每日运势，无需重新调用 LLM
+- 连接按进程惰性打开（fork 出的 worker 各自建立连接），启动时不做全量加载
+- 按过期时间淘汰，并按命名空间限制条目数（超出时淘汰最久未写入的条目）
+- 磁盘缓存只是加速层：读写失败仅记录日志，不影响请求
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_entries_expires ON cache_entries (expires_at);
+CREATE INDEX IF NOT EXISTS idx_cache_entries_updated ON cache_entries (namespace, updated_at);
+"""
+
+
+class SQLiteCacheStore(SQLiteStore):
+    """SQLite 磁盘缓存：(命名空间, key) -> (JSON 值, 过期时间戳)
+
+    每写入 prune_every 次执行一次淘汰：删除已过期条目，并将各命名空间裁剪到注册的容量上限。
+    """
+
+    SCHEMA = _SCHEMA
+    # 缓存读写在存储线程中串行执行：写锁被占用时短暂等待后放弃（记为失败，内存缓存不受影响），
+    # 不让写竞争拖慢排在其后的磁盘读取；WAL 模式下读取不等待写锁
+    BUSY_TIMEOUT = 0.25
+
+    def __init__(self, path: str, prune_every: int = 200):
+        super().__init__(path)
+        self.prune_every = max(1, prune_every)
+        # 命名空间 -> 条目数上限
+        self.limits: Dict[str, int] = {}
+        self._writes_since_prune = 0
+        self.stats_counters = {"reads": 0, "hits": 0, "writes": 0, "pruned": 0, "errors": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["SQLiteCacheStore"]:
+        """CACHE_PERSIST_ENABLED=false 或 CACHE_DB_PATH 为空时不启用磁盘缓存"""
+        if os.getenv('CACHE_PERSIST_ENABLED', 'true').lower() != 'true':
+            return None
+        path = os.getenv('CACHE_DB_PATH', 'cache.sqlite3').strip()
+        if not path:
+            return None
+        return cls(path, prune_every=int(os.getenv('CACHE_DB_PRUNE_EVERY', '200')))
+
+    def register(self, namespace: str, max_rows: int) -> None:
+        self.limits[namespace] = max(1, max_rows)
+
+    def _failed(self, action: str, error: Exception) -> None:
+        self.stats_counters["errors"] += 1
+        logger.warning(f"磁盘缓存{action}失败: {error!r}")
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Optional[float], Any]]:
+        """读取未过期的条目，返回 (过期时间戳 或 None, 值)；不存在或出错时返回 None"""
+        self.stats_counters["reads"] += 1
+        try:
+            row = self._connection().execute(
+                "SELECT expires_at, value FROM cache_entries "
+                "WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, time.time()),
+            ).fetchone()
+        except sqlite3.Error as error:
+            self._failed("读取", error)
+            return None
+        if row is None:
+            return None
+        try:
+            value = json.loads(row[1])
+        except ValueError as error:
+            self._failed("解析", error)
+            return None
+        self.stats_counters["hits"] += 1
+        return row[0], value
+
+    def set(self, namespace: str, key: str, value: Any, expires_at: Optional[float]) -> None:
+        try:
+            payload = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError) as error:
+            self._failed("序列化", error)
+            return
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, payload, expires_at, time.time()),
+            )
+        except sqlite3.Error as error:
+            self._failed("写入", error)
+            return
+        self.stats_counters["writes"] += 1
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= self.prune_every:
+            self.prune()
+
+    def delete(self, namespace: str, key: str) -> None:
+        try:
+            self._connection().execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key)
+            )
+        except sqlite3.Error as error:
+            self._failed("删除", error)
+
+    def clear(self, namespace: str) -> None:
+        try:
+            self._connection().execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+        except sqlite3.Error as error:
+            self._failed("清空", error)
+
+    def prune(self) -> int:
+        """删除已过期条目，并将各命名空间裁剪到容量上限；返回删除的条目数"""
+        self._writes_since_prune = 0
+        removed = 0
+        try:
+            conn = self._connection()
+            removed += conn.execute(
+                "DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            ).rowcount
+            for namespace, max_rows in self.limits.items():
+                removed += conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                    "SELECT key FROM cache_entries WHERE namespace = ? "
+                    "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                    (namespace, namespace, max_rows),
+                ).rowcount
+        except sqlite3.Error as error:
+            self._failed("淘汰", error)
+        self.stats_counters["pruned"] += removed
+        return removed
+
+    def count(self, namespace: str) -> Optional[int]:
+        try:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
+        except sqlite3.Error as error:
+            self._failed("统计", error)
+            return None
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "limits": dict(self.limits),
+            **self.stats_counters,
+        }
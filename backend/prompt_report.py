@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+占卜提示词体积对比：完整知识库提示词（full）vs 预计算精简提示词（compact）
+使用方法：python prompt_report.py
+使用 Gemini 提供方时调用 count_tokens 统计，否则按字符估算。
+"""
+
+import asyncio
+
+from llm_scheduler import estimate_tokens
+from llm_service import llm_service
+
+SAMPLES = [
+    ("希望今年事业顺利", [8, 26, 67], 'zh'),
+    ("这次考试能否顺利通过", [18, 36, 88], 'zh'),
+    ("How will my career luck be next month?", [8, 26, 67], 'en'),
+    ("Will my new business partnership succeed?", [5, 12, 99], 'en'),
+]
+
+
+async def count_tokens(text: str) -> int:
+    if llm_service.provider:
+        try:
+            tokens = await llm_service.provider.count_tokens(text)
+            if tokens is not None:
+                return tokens
+        except Exception as e:
+            print(f"⚠️  count_tokens 调用失败，改用估算: {e}")
+    return estimate_tokens(text)
+
+
+async def main():
+    source = "Gemini count_tokens" if llm_service.provider and llm_service.provider.name == "gemini" else "字符估算"
+    print(f"📏 占卜提示词 token 对比（统计方式：{source}）")
+    print("-" * 72)
+    print(f"{'语言':<4} {'full':>8} {'compact':>8} {'节省':>8}  愿望")
+    total_full = total_compact = 0
+    for wish, numbers, language in SAMPLES:
+        full = await count_tokens(llm_service.build_llm_prompt(wish, numbers, language, mode='full'))
+        compact = await count_tokens(llm_service.build_llm_prompt(wish, numbers, language, mode='compact'))
+        total_full += full
+        total_compact += compact
+        print(f"{language:<4} {full:>8} {compact:>8} {1 - compact / full:>8.0%}  {wish}")
+    print("-" * 72)
+    print(f"合计 {total_full:>8} {total_compact:>8} {1 - total_compact / total_full:>8.0%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""
+容错工具：熔断器（circuit breaker）与延迟分位数统计
+
+连续失败（含超时）达到阈值后熔断，熔断期间调用方直接走本地回退；
+冷却时间过后进入半开状态，放行少量探测请求，成功则恢复，失败则重新熔断。
+LatencyTracker 记录最近的调用耗时，供对冲请求（hedged request）确定触发时机。
+"""
+
+import time
+from collections import deque
+from typing import Dict, Optional
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，调用被直接拒绝"""
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器：closed → open → half_open → closed/open"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probes_in_flight = 0
+        # 统计：熔断次数、被拒绝的调用数
+        self.opened_count = 0
+        self.rejected = 0
+
+    def before_call(self) -> None:
+        """调用前检查；熔断中（或半开探测名额已满）时抛出 CircuitOpenError"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                self.rejected += 1
+                raise CircuitOpenError("LLM 熔断中，使用本地结果")
+            self.state = self.HALF_OPEN
+            self._probes_in_flight = 0
+        if self.state == self.HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_max_calls:
+                self.rejected += 1
+                raise CircuitOpenError("LLM 熔断半开探测中，使用本地结果")
+            self._probes_in_flight += 1
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        if self.state == self.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+        self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            # 探测失败：重新熔断
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            self._open()
+        elif self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def release(self) -> None:
+        """调用被取消（非服务端失败）时归还半开探测名额，不计成败"""
+        if self.state == self.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.opened_count += 1
+
+    def stats(self) -> Dict:
+        retry_in = 0.0
+        if self.state == self.OPEN:
+            retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_timeout": self.recovery_timeout,
+            "retry_in_seconds": round(retry_in, 1),
+            "opened_count": self.opened_count,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """最近 N 次调用耗时（毫秒）的滑动窗口，用于计算分位数"""
+
+    def __init__(self, maxlen: int = 512):
+        self._samples = deque(maxlen=maxlen)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, latency_ms: float) -> None:
+        self._samples.append(latency_ms)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """返回第 p 分位（0-1）的耗时；尚无样本时返回 None"""
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
@@ -0,0 +1,170 @@
+"""
+商城目录：从数据文件（data/shop_catalog.json）加载商品
+
+- 加载时建立商品 ID 索引与分类索引，并按各排序方式预先排好序，分页只需切片
+- 加载 / 版本变化时预先序列化各分类的完整列表（响应体字节与 ETag），常规列表请求只是一次字典查找
+- 数据文件修改后按检查间隔自动重新加载，加载失败时继续使用旧目录
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from http_cache import make_etag
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "shop_catalog.json")
+
+# 排序方式：名称 -> (排序键, 是否倒序)
+SORT_KEYS = {
+    "id": (lambda item: item.id, False),
+    "price": (lambda item: (item.price, item.id), False),
+    "-price": (lambda item: (item.price, -item.id), True),
+    "name": (lambda item: (item.name, item.id), False),
+}
+DEFAULT_SORT = "id"
+
+
+class ShopItem(BaseModel):
+    """商品模型"""
+    id: int
+    name: str
+    description: str
+    price: int  # 使用积分作为价格单位
+    category: str
+    in_stock: bool
+    image_url: Optional[str] = None
+    # 限量商品的库存总量；None 表示不限量。只用于登记库存，不出现在商城列表中
+    # （剩余数量随销售变化，列表只以 in_stock 标记售罄）
+    stock: Optional[int] = Field(default=None, exclude=True)
+    # 抢购商品：每人限购（FLASH_SALE_MAX_PER_USER）
+    flash_sale: bool = False
+
+
+class ShopResponse(BaseModel):
+    """商城响应模型"""
+    success: bool
+    items: Optional[List[ShopItem]] = None
+    # 符合条件的商品总数；分页时另返回页码与每页数量
+    total: Optional[int] = None
+    page: Optional[int] = None
+    page_size: Optional[int] = None
+    error: Optional[str] = None
+
+
+class ShopCatalog:
+    """不可变的商品目录快照；重新加载时整体替换，version 随内容变化"""
+
+    def __init__(self, items: List[ShopItem], version: str):
+        self.version = version
+        self.items: Tuple[ShopItem, ...] = tuple(items)
+        self.by_id: Dict[int, ShopItem] = {}
+        for item in self.items:
+            if item.id in self.by_id:
+                raise ValueError(f"商品 ID 重复: {item.id}")
+            self.by_id[item.id] = item
+
+        # 分类索引（"" 表示全部商品）：分类 -> 排序方式 -> 已排序的商品
+        groups: Dict[str, List[ShopItem]] = {"": list(self.items)}
+        for item in self.items:
+            groups.setdefault(item.category, []).append(item)
+        self.sorted: Dict[str, Dict[str, Tuple[ShopItem, ...]]] = {
+            category: {
+                sort: tuple(sorted(group, key=key, reverse=reverse))
+                for sort, (key, reverse) in SORT_KEYS.items()
+            }
+            for category, group in groups.items()
+        }
+        self.category_ids: Dict[str, frozenset] = {
+            category: frozenset(item.id for item in group) for category, group in groups.items()
+        }
+
+        # 预序列化各分类的完整列表（默认排序、不分页）
+        self.listings: Dict[str, Tuple[bytes, str]] = {}
+        for category, by_sort in self.sorted.items():
+            items = by_sort[DEFAULT_SORT]
+            body = ShopResponse(success=True, items=list(items), total=len(items)).model_dump_json().encode()
+            self.listings[category] = (body, make_etag(body))
+
+    @classmethod
+    def load(cls, path: str) -> "ShopCatalog":
+        with open(path, "rb") as f:
+            raw = f.read()
+        data = json.loads(raw)
+        items = [ShopItem(**item) for item in data["items"]]
+        version = f"{data.get('version', 0)}-{hashlib.sha256(raw).hexdigest()[:12]}"
+        return cls(items, version)
+
+    @property
+    def categories(self) -> List[str]:
+        return [category for category in self.sorted if category]
+
+    def get(self, item_id: int) -> Optional[ShopItem]:
+        return self.by_id.get(item_id)
+
+    def listing(self, category: str = "") -> Optional[Tuple[bytes, str]]:
+        """分类完整列表的预序列化响应体与 ETag；分类不存在时返回 None"""
+        return self.listings.get(category)
+
+    def select(self, category: str = "", sort: str = DEFAULT_SORT, page: Optional[int] = None,
+               page_size: Optional[int] = None) -> Tuple[Tuple[ShopItem, ...], int]:
+        """按分类、排序与分页取商品，返回 (本页商品, 总数)"""
+        items = self.sorted.get(category, {}).get(sort, ())
+        if page_size is None:
+            return items, len(items)
+        start = (max(1, page or 1) - 1) * page_size
+        return items[start:start + page_size], len(items)
+
+
+class ShopCatalogFile:
+    """数据文件中的商品目录：按检查间隔比对文件修改时间，变化时重新加载并通知监听者"""
+
+    def __init__(self, path: str, check_interval: float = 30.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._catalog = ShopCatalog.load(path)
+        self._mtime = os.stat(path).st_mtime
+        self._checked_at = time.monotonic()
+        self._listeners: List[Callable[[ShopCatalog], None]] = []
+        logger.info(f"商城目录已加载: {len(self._catalog.items)} 个商品，版本 {self._catalog.version}")
+
+    @classmethod
+    def from_env(cls) -> "ShopCatalogFile":
+        return cls(
+            os.getenv('SHOP_CATALOG_PATH', DEFAULT_CATALOG_PATH),
+            check_interval=float(os.getenv('SHOP_CATALOG_RELOAD_SECONDS', '30')),
+        )
+
+    def on_reload(self, listener: Callable[[ShopCatalog], None]) -> None:
+        self._listeners.append(listener)
+
+    @property
+    def catalog(self) -> ShopCatalog:
+        """当前目录；check_interval 为 0 时不检查文件变化"""
+        if self.check_interval > 0 and time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            self._reload_if_changed()
+        return self._catalog
+
+    def _reload_if_changed(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return
+            catalog = ShopCatalog.load(self.path)
+        except (OSError, ValueError, KeyError) as error:
+            logger.error(f"商城目录重新加载失败，继续使用版本 {self._catalog.version}: {error!r}")
+            return
+        self._mtime = mtime
+        if catalog.version == self._catalog.version:
+            return
+        self._catalog = catalog
+        logger.info(f"商城目录已更新: {len(catalog.items)} 个商品，版本 {catalog.version}")
+        for listener in self._listeners:
+            listener(catalog)
@@ -0,0 +1,89 @@
+"""
+SQLite 存储基类：WAL 模式、按进程惰性打开连接、写事务
+
+磁盘缓存、用户状态与库存共用：多个 worker 进程各自打开连接访问同一个数据库文件，
+fork 出的子进程不会复用父进程的连接。
+
+请求处理中通过 run() 在每个存储专用的单线程中执行同步方法：事务等待其他进程释放写锁时
+只阻塞该线程，不阻塞事件循环（流式响应等照常推送）；同一进程内对连接与进程内状态的访问
+都在该线程中串行执行。
+"""
+
+import os
+import asyncio
+import sqlite3
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """SQLite 存储基类；子类通过 SCHEMA 声明表结构"""
+
+    SCHEMA = ""
+    # 等待其他进程释放写锁的秒数
+    BUSY_TIMEOUT = 10.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """惰性打开连接；fork 后的子进程不复用父进程的连接"""
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, isolation_level=None,
+                                   check_same_thread=False, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            if self._pid is not None and self._pid != os.getpid():
+                self._after_fork()
+            self._conn = conn
+            self._pid = os.getpid()
+            logger.info(f"{type(self).__name__} 数据库已打开: {self.path}")
+        return self._conn
+
+    def _after_fork(self) -> None:
+        """子进程首次打开连接时调用，用于丢弃从父进程继承的进程内状态"""
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """写事务：BEGIN IMMEDIATE 立即获取写锁，事务内读取到的结果与本次写入一致"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def submit(self, func: Callable, *args: Any, **kwargs: Any) -> Future:
+        """提交到本进程的存储专用线程执行（fork 后的子进程重新创建线程）"""
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)
+            self._executor_pid = os.getpid()
+        return self._executor.submit(func, *args, **kwargs)
+
+    async def run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """在存储专用线程中执行同步方法并等待结果，不阻塞事件循环"""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            if self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=True)
+            self._executor = None
+            self._executor_pid = None
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._pid = None
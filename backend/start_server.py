@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 """
 小六壬占卜服务启动脚本
+
+开发模式（默认）：单个 uvicorn 进程，DEBUG=True 时开启热重载与访问日志
+生产模式（--production 或 SERVER_MODE=production）：多 worker，数量默认等于可用 CPU 核数（SERVER_WORKERS 可覆盖），
+使用 uvloop + httptools；安装了 gunicorn 时由 gunicorn 预加载应用（preload）后 fork worker，否则使用 uvicorn 多进程模式。
+各 worker 不共享内存：用户数据、占卜与运势缓存均位于共享的 SQLite 数据库中。
 """
 
 import os
 import sys
+import argparse
+import importlib.util
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -56,33 +63,115 @@ def check_environment():
     
     return True
 
+def cpu_count() -> int:
+    """可用 CPU 核数（考虑容器 / 进程亲和性限制）"""
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def worker_count() -> int:
+    """生产模式 worker 数：SERVER_WORKERS 未设置或为 0 时使用 CPU 核数"""
+    workers = int(os.getenv('SERVER_WORKERS', '0') or 0)
+    return workers if workers > 0 else cpu_count()
+
+
+def event_loop_options() -> dict:
+    """优先使用 uvloop 与 httptools（未安装时由 uvicorn 自动选择）"""
+    return {
+        "loop": "uvloop" if importlib.util.find_spec('uvloop') else "auto",
+        "http": "httptools" if importlib.util.find_spec('httptools') else "auto",
+    }
+
+
+def run_production(host: str, port: int, workers: int):
+    """多 worker 生产模式"""
+    # 在加载应用之前设置，各 worker 据此平分 LLM 配额
+    os.environ['SERVER_WORKERS'] = str(workers)
+
+    if importlib.util.find_spec('gunicorn') is None or sys.platform == 'win32':
+        import uvicorn
+        print("⚠️  未安装 gunicorn，使用 uvicorn 多进程模式（不预加载应用）")
+        uvicorn.run("main:app", host=host, port=port, workers=workers, access_log=False, **event_loop_options())
+        return
+
+    from gunicorn.app.base import BaseApplication
+
+    class TempleApplication(BaseApplication):
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    TempleApplication({
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        # UvicornWorker 的 loop/http 为 auto：已安装时即使用 uvloop 与 httptools
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        # 主进程预加载应用（导入模块、编译历法表等只做一次），worker 以写时复制方式共享
+        "preload_app": True,
+        "keepalive": int(os.getenv('SERVER_KEEPALIVE', '5')),
+        # worker 心跳超时需长于 LLM 调用截止时间
+        "timeout": int(os.getenv('SERVER_WORKER_TIMEOUT', '60')),
+        "graceful_timeout": int(os.getenv('SERVER_GRACEFUL_TIMEOUT', '30')),
+        "accesslog": None,
+        "errorlog": "-",
+    }).run()
+
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="小六壬占卜服务")
+    parser.add_argument('--production', action='store_true',
+                        default=os.getenv('SERVER_MODE', 'development').lower() == 'production',
+                        help="多 worker 生产模式")
+    parser.add_argument('--workers', type=int, default=None, help="worker 数（默认等于 CPU 核数）")
+    parser.add_argument('--skip-checks', action='store_true', help="跳过环境检查")
+    args = parser.parse_args()
+
     print("🔮 小六壬占卜服务")
     print("=" * 50)
     
-    if not check_environment():
+    if not args.skip_checks and not check_environment():
         print("\n❌ 环境检查失败，请解决上述问题后重试")
         return
+
+    # 生产模式必须固定身份令牌密钥：随机密钥在重启后失效，且不预加载的各 worker 互不认可
+    if args.production and not os.getenv('AUTH_SECRET'):
+        print("\n❌ 生产模式需要设置 AUTH_SECRET（身份令牌签名密钥）")
+        sys.exit(1)
     
     print("\n🚀 启动服务...")
     
     try:
-        import uvicorn
-        from main import app
-        
         host = os.getenv('SERVER_HOST', '127.0.0.1')
         port = int(os.getenv('SERVER_PORT', 8000))
         debug = os.getenv('DEBUG', 'False').lower() == 'true'
         
         print(f"📍 服务地址: http://{host}:{port}")
         print(f"📚 API 文档: http://{host}:{port}/docs")
-        print(f"🔧 调试模式: {'开启' if debug else '关闭'}")
+        if args.production:
+            workers = args.workers or worker_count()
+            print(f"🏭 生产模式: {workers} 个 worker")
+        else:
+            print(f"🔧 调试模式: {'开启' if debug else '关闭'}")
         print(f"🎯 测试客户端: python test_client.py")
         print("=" * 50)
         print("💡 按 Ctrl+C 停止服务")
         print()
         
+        if args.production:
+            run_production(host, port, workers)
+            return
+
+        import uvicorn
         uvicorn.run(
             "main:app",
             host=host,
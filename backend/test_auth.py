@@ -0,0 +1,161 @@
+"""
+身份与功德账本测试：令牌篡改 / 过期、钱包登录消息篡改与 nonce 重放、写回模式下的账本快照对账
+
+使用方法：python -m pytest -q test_auth.py
+"""
+
+import os
+import time
+import asyncio
+
+import httpx
+import pytest
+from eth_account import Account
+from eth_account.messages import encode_defunct
+
+os.environ.setdefault('LLM_PROVIDER', 'mock')
+os.environ.setdefault('CACHE_PERSIST_ENABLED', 'false')
+os.environ.setdefault('DAILY_FORTUNE_PREGEN_ENABLED', 'false')
+os.environ.setdefault('AUTH_SECRET', 'test-auth')
+
+import main
+from auth import SESSION_PREFIX, AuthError, IdentitySigner
+from user_store import REASON_INCENSE, REASON_INITIAL, REASON_PURCHASE, UserStore
+
+signer = IdentitySigner(b"secret")
+
+
+def sign(account, message):
+    return account.sign_message(encode_defunct(text=message)).signature.hex()
+
+
+def test_token_round_trip():
+    user_id, token = signer.new_session()
+    assert user_id.startswith(SESSION_PREFIX)
+    assert signer.verify(token) == user_id
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda token: "0x" + "ab" * 20 + token[token.index("."):],
+    lambda token: token[:-1] + ("0" if token[-1] != "0" else "1"),
+    lambda token: token.rsplit(".", 2)[0] + f".{int(time.time()) + 10 ** 6}." + token.rsplit(".", 1)[1],
+    lambda token: token.split(".")[0],
+    lambda token: token + "功德",
+])
+def test_tampered_token_is_rejected(tamper):
+    _, token = signer.new_session()
+    assert signer.verify(tamper(token)) is None
+
+
+def test_token_from_other_secret_is_rejected():
+    _, token = IdentitySigner(b"other").new_session()
+    assert signer.verify(token) is None
+
+
+def test_expired_token_is_rejected():
+    _, token = IdentitySigner(b"secret", token_ttl=-1).new_session()
+    assert signer.verify(token) is None
+
+
+def test_wallet_login_verifies_signer():
+    account = Account.create()
+    challenge = signer.challenge(account.address)
+    address, nonce, expires_at = signer.verify_wallet(challenge["message"], sign(account, challenge["message"]))
+    assert address == account.address.lower()
+    assert nonce in challenge["message"]
+    assert expires_at == challenge["expires_at"]
+
+
+def test_wallet_login_rejects_other_signer():
+    account = Account.create()
+    challenge = signer.challenge(account.address)
+    with pytest.raises(AuthError):
+        signer.verify_wallet(challenge["message"], sign(Account.create(), challenge["message"]))
+
+
+def test_wallet_login_rejects_tampered_message():
+    account, victim = Account.create(), Account.create()
+    message = signer.challenge(account.address)["message"]
+    forged = message.replace(account.address.lower(), victim.address.lower())
+    with pytest.raises(AuthError):
+        signer.verify_wallet(forged, sign(account, forged))
+
+
+def test_wallet_login_rejects_expired_challenge():
+    account = Account.create()
+    message = IdentitySigner(b"secret", challenge_ttl=-1).challenge(account.address)["message"]
+    with pytest.raises(AuthError):
+        signer.verify_wallet(message, sign(account, message))
+
+
+def test_nonce_is_single_use(tmp_path):
+    store = UserStore(str(tmp_path / "users.sqlite3"))
+    expires_at = time.time() + 60
+    assert store.consume_nonce("n1", expires_at)
+    assert not store.consume_nonce("n1", expires_at)
+    assert store.consume_nonce("n2", expires_at)
+    store.close()
+
+
+@pytest.fixture
+def users(tmp_path, monkeypatch):
+    store = UserStore(str(tmp_path / "users.sqlite3"))
+    monkeypatch.setattr(main, "user_store", store)
+    yield store
+    store.close()
+
+
+def call(method, url, **kwargs):
+    async def request():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, url, **kwargs)
+    return asyncio.run(request())
+
+
+def test_wallet_login_replay_is_rejected(users):
+    account = Account.create()
+    challenge = call("GET", "/api/auth/challenge", params={"address": account.address}).json()
+    body = {"message": challenge["message"], "signature": sign(account, challenge["message"])}
+
+    response = call("POST", "/api/auth/wallet", json=body)
+    assert response.status_code == 200
+    token = response.json()["token"]
+    status = call("GET", "/api/user/status", headers={"Authorization": f"Bearer {token}"}).json()
+    assert status["user_id"] == account.address.lower()
+
+    assert call("POST", "/api/auth/wallet", json=body).status_code == 401
+
+
+def test_forged_token_gets_new_anonymous_session(users):
+    wallet = "0x" + "cd" * 20
+    forged = f"{wallet}.{int(time.time()) + 3600}.{'0' * 64}"
+    response = call("GET", "/api/user/status", headers={"Authorization": f"Bearer {forged}"})
+    assert response.json()["user_id"].startswith(SESSION_PREFIX)
+    assert response.headers[main.AUTH_TOKEN_HEADER] != forged
+
+
+def test_clients_without_token_get_separate_sessions(users):
+    first = call("GET", "/api/user/status").json()["user_id"]
+    second = call("GET", "/api/user/status").json()["user_id"]
+    assert first != second
+
+
+def test_write_behind_ledger_matches_balance_across_snapshots(tmp_path):
+    store = UserStore(str(tmp_path / "users.sqlite3"), write_behind=True)
+    for _ in range(3):
+        store.increment("s:user", incense=1, merit=10)
+    assert store.get("s:user")["merit_points"] == 130
+    assert store.flush() == 1
+
+    assert store.snapshot() == 1
+    store.increment("s:user", incense=1, merit=10)
+    store.spend("s:user", 40, ref="item:1x1")
+    audit = store.audit("s:user")
+    assert audit["snapshot_ledger_id"] > 0
+    assert audit["consistent"]
+    assert audit["balance"] == audit["ledger_balance"] == 100
+
+    reasons = [entry["reason"] for entry in store.ledger("s:user")]
+    assert reasons == [REASON_PURCHASE, REASON_INCENSE, REASON_INCENSE, REASON_INITIAL]
+    store.close()
@@ -0,0 +1,93 @@
+"""
+缓存工具测试：SingleFlight 合并并发的相同请求、TTLCache 过期与 LRU 淘汰
+
+使用方法：python -m pytest -q test_cache.py
+"""
+
+import asyncio
+
+from cache import SingleFlight, TTLCache
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def generate(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return f"result:{key}"
+
+    async def main():
+        keys = [f"wish{index % 5}" for index in range(50)]
+        return keys, await asyncio.gather(*(flight.do(key, lambda key=key: generate(key)) for key in keys))
+
+    keys, results = asyncio.run(main())
+    assert results == [f"result:{key}" for key in keys]
+    assert sorted(calls) == sorted(set(keys))
+    assert flight.stats() == {"in_flight": 0, "executed": 5, "shared": 45}
+
+
+def test_single_flight_survives_cancelled_initiator():
+    flight = SingleFlight()
+
+    async def generate():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("key", generate))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do("key", generate))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(main()) == ("done", True)
+    assert flight.executed == 1
+
+
+def test_single_flight_shares_errors_and_retries_afterwards():
+    flight = SingleFlight()
+    attempts = []
+
+    async def generate():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        if len(attempts) == 1:
+            raise RuntimeError("quota")
+        return "ok"
+
+    async def main():
+        results = await asyncio.gather(*(flight.do("key", generate) for _ in range(3)), return_exceptions=True)
+        return results, await flight.do("key", generate)
+
+    results, retried = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retried == "ok"
+    assert len(attempts) == 2
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+
+    async def main():
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert await cache.get("a") == 1
+        cache.set("c", 3)
+        return [await cache.get(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(main()) == [1, None, 3]
+    assert cache.stats()["hits"] == 3
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=4, default_ttl=60)
+    cache.set("fresh", 1)
+    cache.set("expired", 2, ttl=-1)
+    assert asyncio.run(cache.get("expired")) is None
+    assert asyncio.run(cache.peek("fresh")) == 1
+    assert cache.ttl("fresh") > 59
+    assert cache.ttl("expired") is None
+    assert len(cache) == 1
@@ -0,0 +1,198 @@
+"""
+库存与购买补偿测试：并发预留不超卖、抢购限购、一笔支付只确认一个保留单、购买失败退还功德
+
+使用方法：python -m pytest -q test_inventory.py
+多个线程各自持有 InventoryStore 实例（各自的连接），模拟多个 worker 同时访问同一个数据库文件。
+"""
+
+import os
+import random
+import sqlite3
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+os.environ.setdefault('LLM_PROVIDER', 'mock')
+os.environ.setdefault('CACHE_PERSIST_ENABLED', 'false')
+os.environ.setdefault('DAILY_FORTUNE_PREGEN_ENABLED', 'false')
+os.environ.setdefault('AUTH_SECRET', 'test-inventory')
+
+import main
+from inventory import HOLD_COMMITTED, HOLD_PENDING, HoldError, InventoryStore, OutOfStockError, PurchaseLimitError
+from user_store import UserStore
+
+WALLET = "0x" + "ab" * 20
+
+
+def run_workers(count, target):
+    """并发执行 target(worker 序号)，返回各自的结果"""
+    results = [None] * count
+    barrier = threading.Barrier(count)
+
+    def worker(index):
+        barrier.wait()
+        results[index] = target(index)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def stock_row(store, item_id):
+    conn = store._connection()
+    available, sold = conn.execute("SELECT available, sold FROM inventory WHERE item_id = ?", (item_id,)).fetchone()
+    pending = conn.execute(
+        "SELECT COALESCE(SUM(quantity), 0) FROM stock_holds WHERE item_id = ? AND status = ?", (item_id, HOLD_PENDING)
+    ).fetchone()[0]
+    return available, sold, pending
+
+
+def test_concurrent_reserve_commit_release_never_oversells(tmp_path):
+    path = str(tmp_path / "shop.sqlite3")
+    InventoryStore(path).seed([(1, 10, False)])
+
+    def worker(index):
+        store = InventoryStore(path, sold_out_recheck=0)
+        store.seed([(1, 10, False)])
+        rng = random.Random(index)
+        committed = released = 0
+        for attempt in range(8):
+            try:
+                hold_id = store.reserve(1, 1, f"s:user{index}")
+            except OutOfStockError:
+                continue
+            if rng.random() < 0.5:
+                store.commit(hold_id, f"s:user{index}")
+                committed += 1
+            else:
+                store.release(hold_id, f"s:user{index}")
+                released += 1
+        store.close()
+        return committed, released
+
+    results = run_workers(8, worker)
+    committed = sum(result[0] for result in results)
+    store = InventoryStore(path)
+    available, sold, pending = stock_row(store, 1)
+    assert committed == sold <= 10
+    assert pending == 0
+    assert available + sold + pending == 10
+    store.close()
+
+
+def test_flash_sale_limit_holds_under_concurrency(tmp_path):
+    path = str(tmp_path / "shop.sqlite3")
+    InventoryStore(path).seed([(7, 5, True)])
+
+    def worker(index):
+        store = InventoryStore(path)
+        store.seed([(7, 5, True)])
+        try:
+            return store.reserve(7, 1, WALLET, verified=True)
+        except PurchaseLimitError:
+            return None
+        finally:
+            store.close()
+
+    holds = [hold_id for hold_id in run_workers(6, worker) if hold_id]
+    assert len(holds) == 1
+
+    store = InventoryStore(path)
+    store.seed([(7, 5, True)])
+    with pytest.raises(PurchaseLimitError):
+        store.reserve(7, 1, "s:anonymous")
+    assert stock_row(store, 7) == (4, 0, 1)
+    store.close()
+
+
+def test_payment_confirms_only_one_hold(tmp_path):
+    store = InventoryStore(str(tmp_path / "shop.sqlite3"))
+    store.seed([(1, 10, False)])
+    first = store.reserve(1, 1, WALLET, verified=True)
+    second = store.reserve(1, 1, WALLET, verified=True)
+
+    store.commit(first, WALLET, ref="0xtx", tx_hash="0xtx")
+    with pytest.raises(HoldError):
+        store.commit(second, WALLET, ref="0xtx", tx_hash="0xtx")
+    assert store.get_hold(first)["status"] == HOLD_COMMITTED
+    assert store.get_hold(second)["status"] == HOLD_PENDING
+
+    store.commit(second, WALLET, ref="0xother", tx_hash="0xother")
+    assert stock_row(store, 1) == (8, 2, 0)
+    store.close()
+
+
+def test_expired_hold_cannot_be_committed(tmp_path):
+    store = InventoryStore(str(tmp_path / "shop.sqlite3"))
+    store.seed([(1, 1, False)])
+    hold_id = store.reserve(1, 1, "s:user", hold_seconds=-1)
+    with pytest.raises(HoldError):
+        store.commit(hold_id, "s:user")
+    assert store.release_expired() == 1
+    assert stock_row(store, 1) == (1, 0, 0)
+    store.close()
+
+
+@pytest.fixture
+def shop(tmp_path, monkeypatch):
+    """购买接口使用临时数据库；沉香（ID 6）为限量商品，价格 100，与初始功德值相同"""
+    users = UserStore(str(tmp_path / "users.sqlite3"))
+    stock = InventoryStore(str(tmp_path / "shop.sqlite3"))
+    stock.seed(main.inventory_items(main.shop_catalog.catalog))
+    monkeypatch.setattr(main, "user_store", users)
+    monkeypatch.setattr(main, "inventory", stock)
+    yield users, stock
+    users.close()
+    stock.close()
+
+
+def purchase(user_id, item_id=6):
+    async def request():
+        headers = {"Authorization": f"Bearer {main.identity.issue(user_id)}"}
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=headers) as client:
+            return await client.post("/api/purchase", json={"item_id": item_id, "quantity": 1})
+    return asyncio.run(request())
+
+
+def test_purchase_commits_stock_and_spends_merit(shop):
+    users, stock = shop
+    response = purchase("s:buyer")
+    assert response.status_code == 200
+    assert response.json()["remaining_points"] == 0
+    assert stock_row(stock, 6) == (49, 1, 0)
+    assert users.audit("s:buyer")["consistent"]
+
+
+def test_insufficient_merit_releases_hold(shop):
+    users, stock = shop
+    users.spend("s:poor", 50)
+    response = purchase("s:poor")
+    assert response.status_code == 400
+    assert users.get("s:poor")["merit_points"] == 50
+    assert stock_row(stock, 6) == (50, 0, 0)
+
+
+@pytest.mark.parametrize("error, status", [
+    (HoldError("保留已超时，请重新下单"), 409),
+    (sqlite3.OperationalError("database is locked"), 500),
+])
+def test_failed_commit_refunds_merit_and_releases_hold(shop, monkeypatch, error, status):
+    users, stock = shop
+
+    def failing_commit(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(stock, "commit", failing_commit)
+    response = purchase("s:refund")
+    assert response.status_code == status
+    assert "功德值已退还" in response.json()["detail"]
+    assert users.get("s:refund")["merit_points"] == 100
+    assert [entry["reason"] for entry in users.ledger("s:refund")] == ["refund", "purchase", "initial"]
+    assert users.audit("s:refund")["consistent"]
+    assert stock_row(stock, 6) == (50, 0, 0)
@@ -0,0 +1,102 @@
+"""
+LLM 配额调度测试：令牌桶补充与欠额、按优先级放行排队请求、等待超时
+
+使用方法：python -m pytest -q test_llm_scheduler.py
+"""
+
+import asyncio
+
+import pytest
+
+from llm_scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INCENSE,
+    PRIORITY_INTERACTIVE,
+    QuotaScheduler,
+    QuotaWaitTimeout,
+    TokenBucket,
+)
+
+
+def test_token_bucket_charges_oversize_calls_in_full():
+    bucket = TokenBucket(per_minute=600, capacity=100)
+    bucket.refill(bucket.updated_at)
+    assert bucket.time_until(500) == 0
+    bucket.take(500)
+    assert bucket.tokens == -400
+    # 欠额 400 + 本次 1，按每秒 10 个补充
+    assert bucket.time_until(1) == pytest.approx(40.1)
+
+    bucket.refill(bucket.updated_at + 60)
+    assert bucket.tokens == 100
+
+
+def test_bucket_capacity_and_refill_stay_within_quota():
+    bucket = QuotaScheduler._bucket(600, burst=0.1)
+    assert bucket.capacity == 60
+    assert bucket.capacity + bucket.rate * 60 == pytest.approx(600)
+
+
+def drain(scheduler):
+    while scheduler.try_acquire(1):
+        pass
+
+
+def test_queued_requests_are_granted_by_priority():
+    # 桶容量 60，每秒补充 99 个请求：耗尽后排队的请求约每 10ms 放行一个
+    scheduler = QuotaScheduler(rpm=6000, burst=0.01, max_wait=2)
+    granted = []
+
+    async def request(name, priority):
+        await scheduler.acquire(1, priority)
+        granted.append(name)
+
+    async def main():
+        drain(scheduler)
+        await asyncio.gather(
+            request("background", PRIORITY_BACKGROUND),
+            request("incense", PRIORITY_INCENSE),
+            request("interactive-1", PRIORITY_INTERACTIVE),
+            request("interactive-2", PRIORITY_INTERACTIVE),
+        )
+
+    asyncio.run(main())
+    assert granted == ["interactive-1", "interactive-2", "incense", "background"]
+    stats = scheduler.get_stats()
+    assert stats["queued"] == 4
+    assert stats["granted_by_priority"]["interactive"] >= 2
+
+
+def test_try_acquire_does_not_jump_the_queue():
+    scheduler = QuotaScheduler(rpm=6000, burst=0.01, max_wait=2)
+
+    async def main():
+        drain(scheduler)
+        waiter = asyncio.ensure_future(scheduler.acquire(1, PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        scheduler.buckets[0][1].tokens = scheduler.buckets[0][1].capacity
+        jumped = scheduler.try_acquire(1)
+        await waiter
+        return jumped
+
+    assert asyncio.run(main()) is False
+
+
+def test_wait_beyond_budget_times_out():
+    scheduler = QuotaScheduler(rpm=1, max_wait=0.05)
+
+    async def main():
+        await scheduler.acquire(1)
+        with pytest.raises(QuotaWaitTimeout):
+            await scheduler.acquire(1)
+
+    asyncio.run(main())
+    stats = scheduler.get_stats()
+    assert stats["timeouts"] == 1
+    assert stats["waiting"] == 0
+
+
+def test_unlimited_scheduler_never_waits():
+    scheduler = QuotaScheduler()
+    assert not scheduler.enabled
+    assert scheduler.try_acquire(10 ** 6)
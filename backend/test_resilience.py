@@ -0,0 +1,87 @@
+"""
+熔断器测试：连续失败达到阈值后熔断，冷却后半开探测，探测成功恢复、失败重新熔断
+
+使用方法：python -m pytest -q test_resilience.py
+"""
+
+import time
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError, LatencyTracker
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=60)
+    fail(breaker, 4)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    fail(breaker, 1)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.opened_count == 1
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=5)
+    fail(breaker, 4)
+    breaker.before_call()
+    breaker.record_success()
+    fail(breaker, 4)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_probe_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=0.05)
+    fail(breaker, 5)
+    time.sleep(0.06)
+
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_half_open_probe_reopens_on_failure():
+    breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=0.05)
+    fail(breaker, 5)
+    time.sleep(0.06)
+
+    fail(breaker, 1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_count == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_released_probe_frees_half_open_slot():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+    fail(breaker, 1)
+    time.sleep(0.06)
+
+    breaker.before_call()
+    breaker.release()
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_latency_percentiles():
+    tracker = LatencyTracker(maxlen=100)
+    assert tracker.percentile(0.5) is None
+    for latency in range(1, 201):
+        tracker.record(latency)
+    assert len(tracker) == 100
+    assert tracker.percentile(0.5) == 151
+    assert tracker.percentile(0.95) == 196
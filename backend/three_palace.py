@@ -0,0 +1,311 @@
+"""
+小六壬「三宫五行」本地解读引擎
+
+根据三个数字定出人/事/应三宫，计算三组五行生克关系（生/克/比和），
+并为全部 6×6×6=216 种三宫组合预先编译中英文解读模板。
+运行时只需查表并填入愿望，无需调用 LLM。
+"""
+
+from itertools import product
+from typing import Dict, List, Tuple
+
+# 六神配置（顺序即宫位 1-6）
+HEXAGRAMS = [
+    {"name": "大安", "element": "木", "meaning": "事事如意，心想事成", "luck": 9},
+    {"name": "留连", "element": "土", "meaning": "需要耐心等待，时机未到", "luck": 6},
+    {"name": "速喜", "element": "火", "meaning": "好事将至，喜事临门", "luck": 8},
+    {"name": "赤口", "element": "金", "meaning": "需要谨慎言行，避免冲突", "luck": 4},
+    {"name": "小吉", "element": "水", "meaning": "小有收获，稳中求进", "luck": 7},
+    {"name": "空亡", "element": "土", "meaning": "暂时困顿，需要调整方向", "luck": 3},
+]
+
+# 六神拼音（英文，按字分隔，全部小写）
+HEXAGRAM_PINYIN = {
+    "大安": "da an",
+    "留连": "liu lian",
+    "速喜": "su xi",
+    "赤口": "chi kou",
+    "小吉": "xiao ji",
+    "空亡": "kong wang",
+}
+
+# 六神英文名与核心意象
+HEXAGRAM_EN = {
+    "大安": ("Da'an", "stability, peace and steady authority"),
+    "留连": ("Liulian", "delay, entanglement and lingering worries"),
+    "速喜": ("Suxi", "swiftness, joyful news and passion"),
+    "赤口": ("Chikou", "disputes, sharp words and conflict"),
+    "小吉": ("Xiaoji", "cooperation, wealth and wise movement"),
+    "空亡": ("Kongwang", "emptiness, futility and hidden blessings"),
+}
+
+HEXAGRAM_KEYWORDS = {
+    "大安": "稳定、安康、正直、官贵",
+    "留连": "迟滞、纠缠、阻碍、忧虑",
+    "速喜": "迅速、喜讯、热恋、文书",
+    "赤口": "官非、口舌、凶险、斗争",
+    "小吉": "吉利、合作、财源、出行",
+    "空亡": "落空、徒劳、阴德、玄奥",
+}
+
+# 人宫六神的行事建议（中, 英）
+HEXAGRAM_ADVICE = {
+    "大安": ("宜守正持重，稳扎稳打", "hold steady and act with integrity"),
+    "留连": ("宜耐心周旋，化繁为简", "be patient and untangle complications step by step"),
+    "速喜": ("宜把握时机，当机立断", "seize the moment and act decisively"),
+    "赤口": ("宜谨言慎行，以和为贵", "mind your words and value harmony"),
+    "小吉": ("宜广结善缘，借力合作", "build goodwill and lean on cooperation"),
+    "空亡": ("宜静心内省，积累阴德", "reflect quietly and accumulate hidden merit"),
+}
+
+ELEMENT_EN = {"木": "Wood", "火": "Fire", "土": "Earth", "金": "Metal", "水": "Water"}
+
+# 五行生克
+GENERATES = {"木": "火", "火": "土", "土": "金", "金": "水", "水": "木"}
+OVERCOMES = {"木": "土", "土": "水", "水": "火", "火": "金", "金": "木"}
+
+POSITIONS = ("ren", "shi", "ying")
+
+# 三组关系：(前宫, 后宫, 中文标题, 英文标题)
+PAIRS = (
+    ("ren", "shi", "您与事情的关系 (人 vs 事)", "You and the matter (Person vs Matter)"),
+    ("ren", "ying", "您与结果的关系 (人 vs 应)", "You and the outcome (Person vs Outcome)"),
+    ("shi", "ying", "事情与结果的关系 (事 vs 应)", "The matter and the outcome (Matter vs Outcome)"),
+)
+
+# 关系判词：(前宫, 后宫) -> 关系 -> (判词, 分值, 中文释义, 英文判词, 英文释义)
+# 关系取值：generate(前生后) / generated(后生前) / overcome(前克后) / overcome_by(后克前) / same(比和)
+VERDICTS = {
+    ("ren", "shi"): {
+        "generate": ("付出", 0, "您需要为此事投入心力，付出越多，根基越稳", "giving", "the matter draws on your energy; what you invest becomes its foundation"),
+        "generated": ("得利", 2, "事情本身会反哺于您，顺势而为即可有所收获", "benefit", "the matter itself nourishes you; following its flow brings gains"),
+        "overcome": ("掌控", 1, "您对局面有主导权，只要把握分寸便能驾驭", "control", "you hold the initiative and can steer the matter with measured effort"),
+        "overcome_by": ("受阻", -2, "事情对您形成压力，推进时易遇阻碍与牵制", "obstruction", "the matter presses on you; expect resistance as you push forward"),
+        "same": ("顺畅", 1, "您与此事气场相合，推进自然顺畅", "harmony", "you and the matter share the same energy, so progress flows naturally"),
+    },
+    ("ren", "ying"): {
+        "generate": ("耗费", -1, "为求结果需要持续消耗，须留意投入与回报的平衡", "expenditure", "reaching the outcome will keep costing you; watch the balance of effort and return"),
+        "generated": ("圆满", 2, "结果会主动回馈于您，愿望有圆满之象", "fulfilment", "the outcome flows back to you, a sign of fulfilment"),
+        "overcome": ("可控", 1, "结果在您掌握之中，主动争取便可成事", "within reach", "the outcome is within your control if you actively pursue it"),
+        "overcome_by": ("不利", -2, "结果对您有所克制，需防事与愿违", "unfavourable", "the outcome restrains you; guard against results turning against your wish"),
+        "same": ("如愿", 2, "您与结果同气相求，多能如愿以偿", "as wished", "you and the outcome resonate, so the wish is likely to be granted"),
+    },
+    ("shi", "ying"): {
+        "generate": ("事成", 2, "事情发展自然导向好的结果，水到渠成", "accomplishment", "the matter naturally carries itself toward a good result"),
+        "generated": ("助缘", 1, "结果一方会给事情带来助力与贵人之缘", "support", "the outcome side lends support and helpful connections to the matter"),
+        "overcome": ("难成", -2, "事情的走向与结果相抵，成事难度较大", "difficulty", "the course of the matter works against the outcome, making success harder"),
+        "overcome_by": ("受限", -1, "结果对事情有所约束，过程中易受限制", "restriction", "the outcome constrains the matter; expect limits along the way"),
+        "same": ("一致", 1, "事情与结果方向一致，进展可期", "alignment", "the matter and outcome point the same way, so progress is promising"),
+    },
+}
+
+# 关系展示用语
+RELATION_ZH = {"generate": "生", "generated": "生", "overcome": "克", "overcome_by": "克", "same": "比和"}
+
+# 运势分档文本：(最低分, 中文预测, 中文建议, 英文预测, 英文建议)
+LUCK_BANDS = (
+    (8, "实现的可能性很高，时机已经成熟，可以积极行动。",
+        "诚心祈福，保持善念，您的愿望将会实现。建议多行善事，积累福德。",
+        "high likelihood of success; timing is ripe to act.",
+        "Stay sincere and kind; continued good deeds will bring fulfillment."),
+    (6, "有一定的实现可能，需要耐心等待合适的时机。",
+        "保持耐心，坚持努力，时机成熟时自然水到渠成。建议多烧香祈福。",
+        "some chance of success; patience is needed until timing aligns.",
+        "Be patient and steady; keep making efforts as timing matures."),
+    (4, "面临一些挑战，需要谨慎处理，调整策略。",
+        "需要调整心态，化解阻碍，可通过上香祈福来改善运势。",
+        "challenges present; proceed cautiously and adjust strategy.",
+        "Adjust mindset and resolve obstacles; prayers/incense may help."),
+    (1, "当前阻力较大，建议暂缓行动，寻求其他途径。",
+        "当前运势低迷，建议多行善事，上香祈福，等待时机转变。",
+        "significant headwinds; pause plans and seek alternatives.",
+        "Low fortune currently; do good deeds and wait for a turn of luck."),
+)
+
+
+def luck_to_text(luck: int) -> str:
+    """将 luck 数值转换为吉凶文本"""
+    if luck >= 9:
+        return "大吉"
+    if luck >= 8:
+        return "中吉"
+    if luck >= 7:
+        return "小吉"
+    if luck >= 6:
+        return "平吉"
+    if luck >= 4:
+        return "小凶"
+    return "大凶"
+
+
+def palace_index(number: int) -> int:
+    """数字对6取余定宫（余数为0 视为第6宫），返回 0-5 的六神下标"""
+    remainder = number % 6
+    return 5 if remainder == 0 else remainder - 1
+
+
+def element_relation(a: str, b: str) -> str:
+    """以 a 为主体判断 a 与 b 的五行关系"""
+    if a == b:
+        return "same"
+    if GENERATES[a] == b:
+        return "generate"
+    if GENERATES[b] == a:
+        return "generated"
+    if OVERCOMES[a] == b:
+        return "overcome"
+    return "overcome_by"
+
+
+def _relation_phrase(a: str, b: str, relation: str) -> str:
+    """生克方向描述，如「木生火」「金克木」「同属土」"""
+    if relation == "same":
+        return f"同属{a}"
+    if relation in ("generate", "overcome"):
+        return f"{a}{RELATION_ZH[relation]}{b}"
+    return f"{b}{RELATION_ZH[relation]}{a}"
+
+
+def _relation_phrase_en(a: str, b: str, relation: str) -> str:
+    """英文生克方向描述，如 Wood generates Fire、both Earth"""
+    a_en, b_en = ELEMENT_EN[a], ELEMENT_EN[b]
+    if relation == "same":
+        return f"both {a_en}"
+    if relation == "generate":
+        return f"{a_en} generates {b_en}"
+    if relation == "generated":
+        return f"{b_en} generates {a_en}"
+    if relation == "overcome":
+        return f"{a_en} overcomes {b_en}"
+    return f"{b_en} overcomes {a_en}"
+
+
+def _luck_band(luck: int) -> Tuple[str, str, str, str]:
+    """按运势评分选取预测与建议文本"""
+    for floor, *texts in LUCK_BANDS:
+        if luck >= floor:
+            return tuple(texts)
+    return LUCK_BANDS[-1][1:]
+
+
+def _compile_reading(indexes: Tuple[int, int, int]) -> Dict:
+    """为一个三宫组合编译解读（文本中的 {wish} 在运行时填入）"""
+    hexagrams = {pos: HEXAGRAMS[i] for pos, i in zip(POSITIONS, indexes)}
+    palaces = [
+        {
+            "name": hexagrams[pos]["name"],
+            "pinyin": HEXAGRAM_PINYIN[hexagrams[pos]["name"]],
+            "element": hexagrams[pos]["element"],
+            "position": pos,
+        }
+        for pos in POSITIONS
+    ]
+
+    relations = []
+    zh_lines, en_lines = [], []
+    adjust = 0
+    for n, (first, second, title_zh, title_en) in enumerate(PAIRS, start=1):
+        a, b = hexagrams[first], hexagrams[second]
+        relation = element_relation(a["element"], b["element"])
+        verdict, score, meaning_zh, verdict_en, meaning_en = VERDICTS[(first, second)][relation]
+        adjust += score
+        phrase = _relation_phrase(a["element"], b["element"], relation)
+        relations.append({
+            "pair": f"{first}-{second}",
+            "relation": RELATION_ZH[relation],
+            "direction": relation,
+            "phrase": phrase,
+            "phrase_en": _relation_phrase_en(a["element"], b["element"], relation),
+            "verdict": verdict,
+            "verdict_en": verdict_en,
+        })
+        zh_lines.append(
+            f"{n}. {title_zh}：{a['name']}（{a['element']}）与{b['name']}（{b['element']}）"
+            f"{phrase}，为{RELATION_ZH[relation]}关系，"
+            f"主「{verdict}」，这代表：{meaning_zh}。"
+        )
+        en_lines.append(
+            f"{n}) {title_en}: {HEXAGRAM_EN[a['name']][0]} ({ELEMENT_EN[a['element']]}) and "
+            f"{HEXAGRAM_EN[b['name']][0]} ({ELEMENT_EN[b['element']]}) show '{verdict_en}' — {meaning_en}."
+        )
+
+    # 以应宫六神为基准分，三组关系的判词分值作修正
+    ying = hexagrams["ying"]
+    luck = max(1, min(10, round(ying["luck"] + adjust / 2)))
+    prediction_zh, advice_zh, prediction_en, advice_en = _luck_band(luck)
+    ren = hexagrams["ren"]
+    weakest = min(range(3), key=lambda i: VERDICTS[PAIRS[i][:2]][relations[i]["direction"]][1])
+    weak_zh = PAIRS[weakest][2]
+    weak_en = PAIRS[weakest][3]
+
+    zh = {
+        "divination": "\n".join(zh_lines),
+        "prediction": (
+            f"您的愿望「{{wish}}」应落「{ying['name']}」，主{HEXAGRAM_KEYWORDS[ying['name']]}之象，"
+            f"{ying['meaning']}。综合三宫生克，{prediction_zh}"
+        ),
+        "advice": (
+            f"神明指引：{advice_zh}人宫为「{ren['name']}」，{HEXAGRAM_ADVICE[ren['name']][0]}；"
+            f"三宫之中{weak_zh.split(' ')[0]}最需留意，凡事多思而后行。"
+        ),
+    }
+    en = {
+        "divination": "\n".join(en_lines),
+        "prediction": (
+            f"Regarding your wish '{{wish}}', the outcome palace falls on {HEXAGRAM_EN[ying['name']][0]}, "
+            f"signifying {HEXAGRAM_EN[ying['name']][1]}. Weighing all three palaces: {prediction_en}"
+        ),
+        "advice": (
+            f"Divine guidance: {advice_en} Your person palace is {HEXAGRAM_EN[ren['name']][0]}, "
+            f"so {HEXAGRAM_ADVICE[ren['name']][1]}; pay closest attention to {weak_en.split(' (')[0].lower()}."
+        ),
+    }
+    zh["full_text"] = (
+        f"【卦象解析】\n{zh['divination']}\n\n【运势预测】\n{zh['prediction']}\n\n"
+        f"【神明指引】\n{zh['advice']}\n\n【吉凶判断】\n总体运势评分：{luck}/10分"
+    )
+    en["full_text"] = (
+        f"[Hexagram Analysis]\n{en['divination']}\n\n[Prediction]\n{en['prediction']}\n\n"
+        f"[Divine Guidance]\n{en['advice']}\n\n[Fortune Level]\nOverall score: {luck}/10"
+    )
+    return {
+        "luck": luck,
+        "luck_text": luck_to_text(luck),
+        "palaces": palaces,
+        "relations": relations,
+        "zh": zh,
+        "en": en,
+    }
+
+
+# 预编译全部 216 种三宫组合
+READINGS: Dict[Tuple[int, int, int], Dict] = {
+    indexes: _compile_reading(indexes) for indexes in product(range(len(HEXAGRAMS)), repeat=3)
+}
+
+
+def palace_indexes(numbers: List[int]) -> Tuple[int, int, int]:
+    """三个数字对应的人/事/应三宫下标"""
+    return tuple(palace_index(n) for n in numbers[:3])
+
+
+def get_reading(numbers: List[int]) -> Dict:
+    """查表获取三宫组合的预编译解读"""
+    return READINGS[palace_indexes(numbers)]
+
+
+def divine(wish: str, numbers: List[int], language: str = 'zh') -> Dict:
+    """本地三宫五行占卜，返回结构与 LLM 占卜结果一致"""
+    reading = get_reading(numbers)
+    texts = reading['en'] if language == 'en' else reading['zh']
+    return {
+        "success": True,
+        "divination": texts["divination"],
+        "prediction": texts["prediction"].replace("{wish}", wish),
+        "advice": texts["advice"],
+        "luck": reading["luck"],
+        "luck_text": reading["luck_text"],
+        "palaces": [dict(p) for p in reading["palaces"]],
+        "relations": [dict(r) for r in reading["relations"]],
+        "full_text": texts["full_text"].replace("{wish}", wish),
+    }
@@ -0,0 +1,328 @@
+"""
+用户状态存储：按用户（钱包地址或会话 ID）保存上香次数与功德值
+
+- 默认后端为 SQLite（WAL 模式），多个 worker 进程共享同一数据库文件
+- 增减均为单条 SQL 的原子操作；扣减为条件更新，余额不足时不扣减
+- 功德值的每次变动在同一事务内追加到只增不改的功德账本（merit_ledger），users 表保存物化余额，
+  读取余额为 O(1) 主键查询；定期为有变动的用户写入余额快照，对账时从快照起累加账本即可
+- SQL 语句固定、参数化，由 sqlite3 的语句缓存复用预编译结果
+- 可选写回（write-behind）：上香计数先在内存中累加，按间隔批量合并写入，读取时叠加未落盘的增量
+- 方法均为同步调用，异步代码中经 run() 在存储专用线程中执行，写回缓冲只在该线程中访问
+"""
+
+import os
+import re
+import time
+import asyncio
+import sqlite3
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# 钱包地址（0x 开头）或会话 ID：字母数字与 - _ . :，最长 128 字符
+_USER_ID_RE = re.compile(r"^[A-Za-z0-9_.:\-]{1,128}$")
+_WALLET_RE = re.compile(r"^0x[0-9a-fA-F]{40}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    incense_count INTEGER NOT NULL DEFAULT 0,
+    merit_points INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS merit_ledger (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    balance_after INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    ref TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_merit_ledger_user ON merit_ledger (user_id, id);
+CREATE TABLE IF NOT EXISTS auth_nonces (
+    nonce TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS merit_snapshots (
+    user_id TEXT NOT NULL,
+    ledger_id INTEGER NOT NULL,
+    balance INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (user_id, ledger_id)
+);
+"""
+
+# 账本变动原因
+REASON_INITIAL = "initial"
+REASON_INCENSE = "incense"
+REASON_PURCHASE = "purchase"
+REASON_REFUND = "refund"
+
+_INSERT_USER = (
+    "INSERT INTO users (user_id, incense_count, merit_points, created_at, updated_at) "
+    "VALUES (?, 0, ?, ?, ?) ON CONFLICT(user_id) DO NOTHING"
+)
+_SELECT_USER = "SELECT incense_count, merit_points FROM users WHERE user_id = ?"
+_INCREMENT = (
+    "UPDATE users SET incense_count = incense_count + ?, merit_points = merit_points + ?, updated_at = ? "
+    "WHERE user_id = ?"
+)
+_SPEND = (
+    "UPDATE users SET merit_points = merit_points - ?, updated_at = ? "
+    "WHERE user_id = ? AND merit_points >= ?"
+)
+# 追加账本：balance_after 直接取刚更新的物化余额
+_APPEND_LEDGER = (
+    "INSERT INTO merit_ledger (user_id, delta, balance_after, reason, ref, created_at) "
+    "SELECT user_id, ?, merit_points, ?, ?, ? FROM users WHERE user_id = ?"
+)
+_SELECT_LEDGER = (
+    "SELECT id, delta, balance_after, reason, ref, created_at FROM merit_ledger "
+    "WHERE user_id = ? ORDER BY id DESC LIMIT ?"
+)
+# 为自上次快照以来账本有变动的用户写入快照
+_SNAPSHOT = (
+    "INSERT OR IGNORE INTO merit_snapshots (user_id, ledger_id, balance, created_at) "
+    "SELECT l.user_id, MAX(l.id), u.merit_points, ? FROM merit_ledger l JOIN users u ON u.user_id = l.user_id "
+    "WHERE l.id > ? GROUP BY l.user_id"
+)
+_LATEST_SNAPSHOT = (
+    "SELECT ledger_id, balance FROM merit_snapshots WHERE user_id = ? ORDER BY ledger_id DESC LIMIT 1"
+)
+_LEDGER_SUM_AFTER = "SELECT COALESCE(SUM(delta), 0) FROM merit_ledger WHERE user_id = ? AND id > ?"
+
+
+def normalize_user_id(raw: Optional[str]) -> str:
+    """规范化用户标识：钱包地址统一小写；为空或格式非法时抛出 ValueError"""
+    user_id = (raw or "").strip()
+    if not _USER_ID_RE.match(user_id):
+        raise ValueError("用户标识格式不正确")
+    if _WALLET_RE.match(user_id):
+        user_id = user_id.lower()
+    return user_id
+
+
+def is_wallet(user_id: str) -> bool:
+    """用户标识是否为钱包地址"""
+    return bool(_WALLET_RE.match(user_id))
+
+
+class InsufficientMeritError(Exception):
+    """功德值不足，扣减未执行"""
+
+
+class UserStore(SQLiteStore):
+    """SQLite 用户状态存储；新用户以 initial_merit 点功德值开户"""
+
+    SCHEMA = _SCHEMA
+
+    def __init__(self, path: str, initial_merit: int = 100, write_behind: bool = False,
+                 flush_interval: float = 1.0, max_pending: int = 1000, snapshot_interval: float = 300.0):
+        super().__init__(path)
+        self.initial_merit = initial_merit
+        self.write_behind = write_behind
+        self.flush_interval = max(0.05, flush_interval)
+        self.max_pending = max(1, max_pending)
+        self.snapshot_interval = max(1.0, snapshot_interval)
+        # 写回缓冲：user_id -> [上香次数增量, 功德值增量]
+        self._pending: Dict[str, List[int]] = {}
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self.stats_counters = {
+            "increments": 0, "spends": 0, "rejected_spends": 0, "refunds": 0,
+            "flushes": 0, "flushed_users": 0, "snapshots": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "UserStore":
+        return cls(
+            os.getenv('USER_DB_PATH', 'users.sqlite3'),
+            initial_merit=int(os.getenv('USER_INITIAL_MERIT', '100')),
+            write_behind=os.getenv('USER_STORE_WRITE_BEHIND', 'false').lower() == 'true',
+            flush_interval=float(os.getenv('USER_STORE_FLUSH_INTERVAL', '1.0')),
+            max_pending=int(os.getenv('USER_STORE_MAX_PENDING', '1000')),
+            snapshot_interval=float(os.getenv('USER_LEDGER_SNAPSHOT_INTERVAL', '300')),
+        )
+
+    def _after_fork(self) -> None:
+        # fork 继承的写回缓冲由父进程负责落盘
+        self._pending = {}
+
+    def _ensure_user(self, conn: sqlite3.Connection, user_id: str, now: float) -> None:
+        """首次出现的用户开户，初始功德值记入账本"""
+        if conn.execute(_INSERT_USER, (user_id, self.initial_merit, now, now)).rowcount:
+            conn.execute(_APPEND_LEDGER, (self.initial_merit, REASON_INITIAL, None, now, user_id))
+
+    def _apply(self, conn: sqlite3.Connection, user_id: str, incense: int, merit: int,
+               reason: str, ref: Optional[str], now: float) -> None:
+        """在事务内更新物化余额并追加账本"""
+        self._ensure_user(conn, user_id, now)
+        conn.execute(_INCREMENT, (incense, merit, now, user_id))
+        if merit:
+            conn.execute(_APPEND_LEDGER, (merit, reason, ref, now, user_id))
+
+    @staticmethod
+    def _row(user_id: str, row: Tuple[int, int]) -> Dict:
+        return {"user_id": user_id, "incense_count": row[0], "merit_points": row[1]}
+
+    def get(self, user_id: str) -> Dict:
+        """读取用户状态（叠加尚未落盘的写回增量）；未开户的用户返回初始状态"""
+        row = self._connection().execute(_SELECT_USER, (user_id,)).fetchone()
+        incense, merit = row if row is not None else (0, self.initial_merit)
+        pending = self._pending.get(user_id)
+        if pending:
+            incense += pending[0]
+            merit += pending[1]
+        return self._row(user_id, (incense, merit))
+
+    def increment(self, user_id: str, incense: int = 0, merit: int = 0,
+                  reason: str = REASON_INCENSE, ref: Optional[str] = None) -> Dict:
+        """原子增加上香次数 / 功德值，返回更新后的状态；写回模式下先累加到内存缓冲（落盘时按用户合并记账）"""
+        self.stats_counters["increments"] += 1
+        if self.write_behind:
+            pending = self._pending.setdefault(user_id, [0, 0])
+            pending[0] += incense
+            pending[1] += merit
+            if len(self._pending) >= self.max_pending:
+                self.flush()
+            return self.get(user_id)
+        with self._transaction() as conn:
+            self._apply(conn, user_id, incense, merit, reason, ref, time.time())
+            return self._row(user_id, conn.execute(_SELECT_USER, (user_id,)).fetchone())
+
+    def spend(self, user_id: str, amount: int, reason: str = REASON_PURCHASE, ref: Optional[str] = None) -> Dict:
+        """原子扣减功德值并记账：条件更新在余额不足时不生效，抛出 InsufficientMeritError，不会透支"""
+        self._flush_user(user_id)
+        now = time.time()
+        with self._transaction() as conn:
+            self._ensure_user(conn, user_id, now)
+            updated = conn.execute(_SPEND, (amount, now, user_id, amount)).rowcount
+            if not updated:
+                self.stats_counters["rejected_spends"] += 1
+                raise InsufficientMeritError("功德值不足")
+            conn.execute(_APPEND_LEDGER, (-amount, reason, ref, now, user_id))
+            self.stats_counters["spends"] += 1
+            return self._row(user_id, conn.execute(_SELECT_USER, (user_id,)).fetchone())
+
+    def refund(self, user_id: str, amount: int, ref: Optional[str] = None) -> Dict:
+        """退还功德值并记账（扣减后购买未完成时的补偿）；直接落盘，不经过写回缓冲"""
+        with self._transaction() as conn:
+            self._apply(conn, user_id, 0, amount, REASON_REFUND, ref, time.time())
+            self.stats_counters["refunds"] += 1
+            return self._row(user_id, conn.execute(_SELECT_USER, (user_id,)).fetchone())
+
+    def ledger(self, user_id: str, limit: int = 20) -> List[Dict]:
+        """最近的功德账本记录（新记录在前）"""
+        rows = self._connection().execute(_SELECT_LEDGER, (user_id, limit)).fetchall()
+        return [
+            {"id": row[0], "delta": row[1], "balance_after": row[2], "reason": row[3], "ref": row[4],
+             "created_at": row[5]}
+            for row in rows
+        ]
+
+    def snapshot(self) -> int:
+        """为上次快照以来账本有变动的用户写入余额快照，返回写入的快照数"""
+        with self._transaction() as conn:
+            watermark = conn.execute("SELECT COALESCE(MAX(ledger_id), 0) FROM merit_snapshots").fetchone()[0]
+            written = conn.execute(_SNAPSHOT, (time.time(), watermark)).rowcount
+        self.stats_counters["snapshots"] += written
+        return written
+
+    def audit(self, user_id: str) -> Dict:
+        """对账：最近快照 + 其后的账本增量，应与物化余额一致"""
+        self._flush_user(user_id)
+        conn = self._connection()
+        snapshot = conn.execute(_LATEST_SNAPSHOT, (user_id,)).fetchone() or (0, 0)
+        ledger_balance = snapshot[1] + conn.execute(_LEDGER_SUM_AFTER, (user_id, snapshot[0])).fetchone()[0]
+        row = conn.execute(_SELECT_USER, (user_id,)).fetchone()
+        balance = row[1] if row is not None else None
+        return {
+            "user_id": user_id,
+            "balance": balance,
+            "ledger_balance": ledger_balance,
+            "snapshot_ledger_id": snapshot[0],
+            "consistent": balance is None or balance == ledger_balance,
+        }
+
+    def consume_nonce(self, nonce: str, expires_at: float) -> bool:
+        """登记一次性的登录 nonce；已使用过时返回 False（多个 worker 共享同一记录）"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM auth_nonces WHERE expires_at <= ?", (time.time(),))
+            return bool(conn.execute(
+                "INSERT OR IGNORE INTO auth_nonces (nonce, expires_at) VALUES (?, ?)", (nonce, expires_at)
+            ).rowcount)
+
+    def _flush_user(self, user_id: str) -> None:
+        """扣减前先落盘该用户的写回增量，保证余额判断基于完整数据"""
+        pending = self._pending.pop(user_id, None)
+        if pending:
+            self._write_pending({user_id: pending})
+
+    def flush(self) -> int:
+        """批量落盘全部写回增量（单个事务），返回落盘的用户数"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        return self._write_pending(pending)
+
+    def _write_pending(self, pending: Dict[str, List[int]]) -> int:
+        now = time.time()
+        try:
+            with self._transaction() as conn:
+                for user_id, (incense, merit) in pending.items():
+                    self._apply(conn, user_id, incense, merit, REASON_INCENSE, None, now)
+        except sqlite3.Error:
+            # 落盘失败：增量放回缓冲，下次重试
+            for user_id, (incense, merit) in pending.items():
+                merged = self._pending.setdefault(user_id, [0, 0])
+                merged[0] += incense
+                merged[1] += merit
+            raise
+        self.stats_counters["flushes"] += 1
+        self.stats_counters["flushed_users"] += len(pending)
+        return len(pending)
+
+    async def _maintenance_loop(self) -> None:
+        """定时任务：写回模式下按间隔落盘增量，按快照间隔写入余额快照"""
+        interval = min(self.flush_interval, self.snapshot_interval) if self.write_behind else self.snapshot_interval
+        last_snapshot = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.run(self.flush)
+                if time.monotonic() - last_snapshot >= self.snapshot_interval:
+                    last_snapshot = time.monotonic()
+                    await self.run(self.snapshot)
+            except sqlite3.Error as error:
+                logger.warning(f"用户数据写回 / 快照失败，稍后重试: {error!r}")
+
+    def start(self) -> None:
+        """启动定时落盘与快照任务"""
+        if self._maintenance_task is None or self._maintenance_task.done():
+            self._maintenance_task = asyncio.ensure_future(self._maintenance_loop())
+
+    async def stop(self) -> None:
+        """停止定时任务并写入剩余增量"""
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_task = None
+        try:
+            await self.run(self.flush)
+        except sqlite3.Error as error:
+            logger.error(f"用户数据写回失败: {error!r}")
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "write_behind": self.write_behind,
+            "pending_users": len(self._pending),
+            **self.stats_counters,
+        }
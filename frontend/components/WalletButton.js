@@ -1,12 +1,23 @@
-import { useAccount, useConnect, useDisconnect } from 'wagmi'
-import { useState } from 'react'
+import { useAccount, useConnect, useDisconnect, useSignMessage } from 'wagmi'
+import { useEffect, useState } from 'react'
+import apiClient, { getSessionToken } from '../lib/api'
 
 export default function WalletButton() {
   const { address, isConnected } = useAccount()
   const { connect, connectors } = useConnect()
   const { disconnect } = useDisconnect()
+  const { signMessageAsync } = useSignMessage()
   const [showConnectors, setShowConnectors] = useState(false)
 
+  // 连接钱包后签名登录，功德与购买记录绑定到该钱包地址（令牌以用户标识开头，已登录该地址时跳过）
+  useEffect(() => {
+    if (!isConnected || !address) return
+    const token = getSessionToken()
+    if (token && token.startsWith(`${address.toLowerCase()}.`)) return
+    apiClient.loginWithWallet(address, signMessageAsync)
+      .catch((error) => console.error('钱包登录失败:', error))
+  }, [isConnected, address])
+
   const formatAddress = (addr) => {
     if (!addr) return ''
     return `${addr.slice(0, 6)}...${addr.slice(-4)}`
@@ -46,6 +57,7 @@ export default function WalletButton() {
             <button
               onClick={() => {
                 disconnect()
+                apiClient.logout()
                 setShowConnectors(false)
               }}
               style={{
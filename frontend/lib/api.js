@@ -3,6 +3,42 @@ const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL ||
     ? 'https://temple-backend.onrender.com'  // 生产环境默认后端地址，部署时请在环境变量中设置正确的后端 URL
     : 'http://127.0.0.1:8000')  // 开发环境地址
 
+// 身份令牌：后端为每个客户端签发的匿名会话，或钱包签名登录后的钱包令牌
+const SESSION_TOKEN_KEY = 'temple_session_token'
+const SESSION_TOKEN_HEADER = 'X-Session-Token'
+
+export function getSessionToken() {
+  if (typeof window === 'undefined') return null
+  try {
+    return localStorage.getItem(SESSION_TOKEN_KEY)
+  } catch (e) {
+    return null
+  }
+}
+
+export function setSessionToken(token) {
+  if (typeof window === 'undefined') return
+  try {
+    if (token) {
+      localStorage.setItem(SESSION_TOKEN_KEY, token)
+    } else {
+      localStorage.removeItem(SESSION_TOKEN_KEY)
+    }
+  } catch (e) {}
+}
+
+// 每个请求都携带身份令牌
+export function authHeaders() {
+  const token = getSessionToken()
+  return token ? { Authorization: `Bearer ${token}` } : {}
+}
+
+// 保存后端新签发的令牌（首次请求或令牌过期时）
+export function rememberSession(response) {
+  const token = response.headers.get(SESSION_TOKEN_HEADER)
+  if (token) setSessionToken(token)
+}
+
 class ApiClient {
   constructor(baseURL = API_BASE_URL) {
     this.baseURL = baseURL
@@ -47,6 +83,7 @@ class ApiClient {
       headers: {
         'Content-Type': 'application/json',
         'Accept-Language': this.getLanguage(),
+        ...authHeaders(),
         ...options.headers,
       },
       ...options,
@@ -58,6 +95,7 @@ class ApiClient {
 
     try {
       const response = await fetch(url, config)
+      rememberSession(response)
       const data = await response.json()
 
       if (!response.ok) {
@@ -121,6 +159,27 @@ class ApiClient {
     return this.request('/api/user/status')
   }
 
+  async getUserLedger(limit = 20) {
+    return this.request(`/api/user/ledger?limit=${limit}`)
+  }
+
+  // 钱包登录：对后端下发的登录消息签名（signMessage 为 wagmi 的 signMessageAsync）
+  async loginWithWallet(address, signMessage) {
+    const challenge = await this.request(`/api/auth/challenge?address=${address}`)
+    const signature = await signMessage({ message: challenge.message })
+    const data = await this.request('/api/auth/wallet', {
+      method: 'POST',
+      body: { message: challenge.message, signature }
+    })
+    setSessionToken(data.token)
+    return data
+  }
+
+  // 退出钱包登录：清除令牌，下次请求时后端签发新的匿名会话
+  logout() {
+    setSessionToken(null)
+  }
+
   // 健康检查API
   async healthCheck() {
     return this.request('/api/health')
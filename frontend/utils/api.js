@@ -1,4 +1,6 @@
 // API 工具函数
+import { authHeaders, rememberSession } from '../lib/api'
+
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
 
 export function getLanguage() {
@@ -39,6 +41,7 @@ export async function callDivinationAPI(wish, numbers) {
       headers: {
         'Content-Type': 'application/json',
         'Accept-Language': getLanguage(),
+        ...authHeaders(),
       },
       body: JSON.stringify({
         wish: wish,
@@ -46,6 +49,7 @@ export async function callDivinationAPI(wish, numbers) {
         language: getLanguage()
       })
     })
+    rememberSession(response)
 
     if (!response.ok) {
       throw new Error(`HTTP error! status: ${response.status}`)
@@ -74,6 +78,7 @@ export async function callIncenseAPI(wish, token = 'USDC', amount = 1) {
       headers: {
         'Content-Type': 'application/json',
         'Accept-Language': getLanguage(),
+        ...authHeaders(),
       },
       body: JSON.stringify({
         wish,
@@ -82,6 +87,7 @@ export async function callIncenseAPI(wish, token = 'USDC', amount = 1) {
         language: getLanguage(),
       })
     })
+    rememberSession(response)
 
     if (!response.ok) {
       throw new Error(`HTTP error! status: ${response.status}`)